@@ -0,0 +1,213 @@
+"""
+A local stand-in for the eCFR versioner and admin APIs serving synthetic titles, so the hot
+paths can be measured without touching ecfr.gov.
+
+Every title has the same shape: parts of PART_SECTIONS sections, each a few paragraphs of
+regulatory sounding text, repeated until the document reaches the configured size. The
+first version date holds every section and each later date amends a slice of them. Full
+documents are generated while they stream, so a 500 MB title never sits in memory.
+"""
+
+import asyncio
+import random
+from dataclasses import dataclass
+
+import falcon
+import falcon.asgi
+from hypercorn import Config
+from hypercorn.asyncio import serve
+
+VOCABULARY = (
+    "shall must may not operator vehicle emission record report permit facility agency "
+    "administrator section part subpart applicable requirement standard compliance "
+    "inspection test procedure limit each any such under pursuant to the of and or in for "
+    "with by on as provided paragraph this that date notice approval request submit within "
+    "days year annual information required person owner equipment system control program"
+).split()
+
+PART_SECTIONS = 50
+PARAGRAPHS = 256  # distinct paragraphs the documents are assembled from
+CHUNK_SIZE = 256 * 1024
+
+
+@dataclass
+class Dataset:
+    titles: int = 2
+    title_mb: float = 5.0  # size of each full title document
+    versions: int = 3  # version dates per title
+    seed: int = 1
+
+    def dates(self) -> list[str]:
+        return [f"{2020 + i // 12:04d}-{i % 12 + 1:02d}-01" for i in range(self.versions)]
+
+    def latest_date(self) -> str:
+        return self.dates()[-1]
+
+
+class Synthesizer:
+    """Builds the synthetic documents and version lists of a dataset"""
+
+    def __init__(self, dataset: Dataset):
+        self.dataset = dataset
+        rng = random.Random(dataset.seed)
+        self.paragraphs = [
+            " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(20, 60))) + "."
+            for _ in range(PARAGRAPHS)
+        ]
+        section = self._section("1", 0, "")
+        self.sections = max(1, int(dataset.title_mb * 1024 * 1024 / len(section.encode())))
+
+    def _section(self, part: str, index: int, variant: str) -> str:
+        identifier = f"{part}.{index + 1}"
+        body = "".join(
+            f"<P>{self.paragraphs[(index * 3 + k + len(variant)) % PARAGRAPHS]}{variant}</P>\n"
+            for k in range(3)
+        )
+        return (
+            f'<DIV8 N="§ {identifier}" TYPE="SECTION">'
+            f"<HEAD>§ {identifier} Section {identifier}.</HEAD>\n{body}</DIV8>\n"
+        )
+
+    def section_ids(self):
+        """(part, subpart, identifier, position) of every section in document order"""
+        for position in range(self.sections):
+            part = str(position // PART_SECTIONS + 1)
+            index = position % PART_SECTIONS
+            yield part, "A", f"{part}.{index + 1}", position
+
+    def amended(self, position: int, date_index: int) -> bool:
+        """Whether a section has a version on the date_index-th version date"""
+        return date_index == 0 or position % self.dataset.versions == date_index
+
+    def versions(self, title: int) -> list[dict]:
+        versions = []
+        for date_index, date in enumerate(self.dataset.dates()):
+            for part, subpart, identifier, position in self.section_ids():
+                if self.amended(position, date_index):
+                    versions.append(
+                        {
+                            "title": str(title),
+                            "part": part,
+                            "subpart": subpart,
+                            "identifier": identifier,
+                            "date": date,
+                            "removed": False,
+                        }
+                    )
+        return versions
+
+    def document(self, title: int, date: str):
+        """Yield the full XML of a title as of date in chunks"""
+        dates = self.dataset.dates()
+        date_index = max((i for i, d in enumerate(dates) if d <= date), default=0)
+        buffer = [f'<DIV1 N="{title}" TYPE="TITLE"><HEAD>Title {title}</HEAD>\n']
+        size = 0
+        open_part = None
+        for part, _subpart, _identifier, position in self.section_ids():
+            if part != open_part:
+                if open_part is not None:
+                    buffer.append("</DIV6></DIV5>\n")
+                buffer.append(
+                    f'<DIV5 N="{part}" TYPE="PART"><HEAD>PART {part}</HEAD>\n'
+                    '<DIV6 N="A" TYPE="SUBPART"><HEAD>Subpart A</HEAD>\n'
+                )
+                open_part = part
+            # the latest amendment of a section on or before date changes its text
+            amendments = [i for i in range(date_index + 1) if self.amended(position, i)]
+            variant = f" Amended {dates[amendments[-1]]}" if amendments[-1] else ""
+            text = self._section(part, position % PART_SECTIONS, variant)
+            buffer.append(text)
+            size += len(text)
+            if size >= CHUNK_SIZE:
+                yield "".join(buffer).encode()
+                buffer, size = [], 0
+        buffer.append("</DIV6></DIV5>\n</DIV1>\n")
+        yield "".join(buffer).encode()
+
+    def titles(self) -> list[dict]:
+        latest = self.dataset.latest_date()
+        return [
+            {
+                "number": title,
+                "name": f"Synthetic Title {title}",
+                "latest_amended_on": latest,
+                "latest_issue_date": latest,
+                "up_to_date_as_of": latest,
+            }
+            for title in range(1, self.dataset.titles + 1)
+        ]
+
+    def agencies(self) -> list[dict]:
+        return [
+            {
+                "name": f"Agency {title}",
+                "short_name": f"A{title}",
+                "slug": f"agency-{title}",
+                "children": [],
+                "cfr_references": [{"title": title}],
+            }
+            for title in range(1, self.dataset.titles + 1)
+        ]
+
+
+class TitlesResource:
+    def __init__(self, synthesizer: Synthesizer):
+        self.synthesizer = synthesizer
+
+    async def on_get(self, req, resp):
+        resp.media = {"titles": self.synthesizer.titles()}
+
+
+class VersionsResource:
+    def __init__(self, synthesizer: Synthesizer):
+        self.synthesizer = synthesizer
+
+    async def on_get(self, req, resp, title):
+        number = int(title.removeprefix("title-").removesuffix(".json"))
+        resp.media = {"content_versions": self.synthesizer.versions(number)}
+
+
+class FullResource:
+    def __init__(self, synthesizer: Synthesizer):
+        self.synthesizer = synthesizer
+
+    async def on_get(self, req, resp, date, title):
+        number = int(title.removeprefix("title-").removesuffix(".xml"))
+        if number > self.synthesizer.dataset.titles:
+            raise falcon.HTTPNotFound()
+
+        async def stream():
+            for chunk in self.synthesizer.document(number, date):
+                yield chunk
+                await asyncio.sleep(0)
+
+        resp.content_type = "application/xml"
+        resp.stream = stream()
+
+
+class AgenciesResource:
+    def __init__(self, synthesizer: Synthesizer):
+        self.synthesizer = synthesizer
+
+    async def on_get(self, req, resp):
+        resp.media = {"agencies": self.synthesizer.agencies()}
+
+
+def fake_ecfr_app(dataset: Dataset) -> falcon.asgi.App:
+    synthesizer = Synthesizer(dataset)
+    app = falcon.asgi.App()
+    app.add_route("/api/versioner/v1/titles.json", TitlesResource(synthesizer))
+    app.add_route("/api/versioner/v1/versions/{title}", VersionsResource(synthesizer))
+    app.add_route("/api/versioner/v1/full/{date}/{title}", FullResource(synthesizer))
+    app.add_route("/api/admin/v1/agencies.json", AgenciesResource(synthesizer))
+    return app
+
+
+def run_server(port: int, dataset: dict):
+    """Serve the fake API until the process is terminated, the target of a server process"""
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.loglevel = "CRITICAL"
+    config.accesslog = None
+    config.errorlog = None
+    asyncio.run(serve(fake_ecfr_app(Dataset(**dataset)), config))
@@ -0,0 +1,205 @@
+"""
+Times the hot paths of the backend against the local fake eCFR API and writes the results
+as JSON, so runs from different releases can be compared.
+
+    python -m benchmarks.run --titles 2 --title-mb 50 --versions 3 --output bench.json
+
+Each scenario runs cold, against an empty store and document directory, then warm, against
+the store and documents the cold run left behind. Peak RSS is read after every run. It only
+grows over a session, and the children figure covers child processes that have exited,
+such as the count engine workers of a finished scenario.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+
+import httpx
+
+from benchmarks.fake_ecfr import Dataset, Synthesizer, run_server
+from ecfr import counting, urls
+from ecfr.blobs import BlobStore
+from ecfr.engine import CountEngine
+from ecfr.fetch import Fetcher
+from ecfr.services import TitleService
+from ecfr.store import SqliteStore
+from ecfr.timestamps import nowIso8601
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def peak_rss_mb() -> dict:
+    """Peak resident set size so far, in MiB. ru_maxrss is in KiB on Linux, bytes on macOS"""
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20, 1
+        ),
+        "children_peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2**20, 1
+        ),
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def wait_for_server(base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(f"{base_url}/api/versioner/v1/titles.json")
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+
+class Benchmark:
+    """Runs each scenario cold then warm and collects the timings"""
+
+    def __init__(self, dataset: Dataset, workers: int | None, concurrency: int):
+        self.dataset = dataset
+        self.workers = workers
+        self.concurrency = concurrency
+        self.results = []
+
+    async def timed(self, scenario: str, phase: str, coro):
+        started = time.perf_counter()
+        result = await coro
+        seconds = time.perf_counter() - started
+        self.results.append(
+            {
+                "scenario": scenario,
+                "phase": phase,
+                "seconds": round(seconds, 4),
+                **peak_rss_mb(),
+            }
+        )
+        print(f"{scenario:36} {phase:5} {seconds:9.3f}s", file=sys.stderr)
+        return result
+
+    async def run(self, directory: str):
+        await self.word_count()
+        for scenario in ("get_title_counts", "get_title_word_count_by_sections"):
+            async with self.title_service(f"{directory}/{scenario}") as service:
+                for phase in ("cold", "warm"):
+                    await self.timed(scenario, phase, self.scenario(service, scenario))
+
+    async def scenario(self, service: TitleService, scenario: str):
+        if scenario == "get_title_counts":
+            # cached=False so the warm run goes through every title's stored count
+            counts = await service.get_title_counts(cached=False)
+            errors = [count for count in counts if "error" in count]
+            if errors:
+                raise RuntimeError(f"Counting failed: {errors}")
+        else:
+            await service.get_title_word_count_by_sections("1")
+
+    async def word_count(self):
+        """Counting alone on one in memory document, without I/O or worker processes"""
+        synthesizer = Synthesizer(self.dataset)
+        xml = b"".join(synthesizer.document(1, self.dataset.latest_date()))
+
+        async def count(document: bytes):
+            return counting.word_count(document)
+
+        for phase in ("cold", "warm"):
+            await self.timed("word_count", phase, count(xml))
+
+    @asynccontextmanager
+    async def title_service(self, directory: str):
+        """A TitleService with its own store, documents and count engine"""
+        engine = CountEngine(max_workers=self.workers)
+        with SqliteStore(f"{directory}.sqlite3") as store:
+            async with httpx.AsyncClient(timeout=300.0) as client:
+                fetcher = Fetcher(client, concurrency=self.concurrency)
+                blobs = BlobStore(f"{directory}-documents")
+                try:
+                    yield TitleService(fetcher, store, engine, blobs)
+                finally:
+                    engine.shutdown()
+
+
+async def main(args) -> dict:
+    dataset = Dataset(
+        titles=args.titles, title_mb=args.title_mb, versions=args.versions, seed=args.seed
+    )
+    started_at = nowIso8601()
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = multiprocessing.get_context("spawn").Process(
+        target=run_server, args=(port, asdict(dataset)), daemon=True
+    )
+    server.start()
+    try:
+        await wait_for_server(base_url)
+        urls.VRSN_URL = f"{base_url}/api/versioner/v1"
+        urls.ADMN_URL = f"{base_url}/api/admin/v1"
+
+        benchmark = Benchmark(dataset, args.workers, args.concurrency)
+        with tempfile.TemporaryDirectory(prefix="ecfr-bench-") as directory:
+            await benchmark.run(directory)
+    finally:
+        server.terminate()
+        server.join()
+
+    return {
+        "started_at": started_at,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "dataset": asdict(dataset),
+        "workers": args.workers,
+        "concurrency": args.concurrency,
+        "results": benchmark.results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--titles", type=int, default=2, help="synthetic titles served")
+    parser.add_argument(
+        "--title-mb", type=float, default=5.0, help="size of each title document, up to ~500"
+    )
+    parser.add_argument("--versions", type=int, default=3, help="version dates per title")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None, help="count engine workers")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent downloads")
+    parser.add_argument("--output", default="-", help="JSON results file, - for stdout")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args()
+    report = asyncio.run(main(args))
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
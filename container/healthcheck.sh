@@ -1,9 +1,11 @@
 #!/bin/bash
+# Usage: healthcheck.sh [path]
+# /health (the default) checks the server is live, /ready fails until the cache is warm
 set -e
 
-curl -k https://127.0.0.1/health \
+curl -kf "https://127.0.0.1${1:-/health}" \
   --key /etc/nginx/ssl/tls.key \
   --cacert /etc/nginx/ssl/tls.ca-chain.crt \
   --cert /etc/nginx/ssl/tls.crt
 
-exit 0
\ No newline at end of file
+exit 0
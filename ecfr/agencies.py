@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+
+from ecfr import urls
+from ecfr.services import TitleService
+from ecfr.timestamps import nowIso8601
+
+logger = logging.getLogger("ecfr")
+
+AGENCIES_KEY = "agencies"
+AGENCY_COUNTS_KEY = "agency-counts"
+
+# cfr_references fields that narrow a reference below a whole title, matched against parts
+REFERENCE_LEVELS = ("subtitle", "chapter", "subchapter", "part")
+
+
+class AgencyService:
+    """
+    AgencyService serves word counts per agency from aggregates precomputed at refresh time.
+
+    Each agency's cfr_references (title plus optional subtitle, chapter, subchapter or part)
+    are resolved against the per part word counts stored when titles are counted. Totals
+    including child agencies count each part once. Reads only touch the cache; all network
+    I/O happens in refresh_agencies, which reuses the aggregate of every agency whose
+    references and referenced titles have not changed since the last refresh.
+    """
+
+    def __init__(self, title_service: TitleService):
+        self.title_service = title_service
+        self.cache = title_service.cache
+
+    def get_agencies(self) -> list | None:
+        return self.cache.get(AGENCIES_KEY)
+
+    def get_agency_counts(self) -> dict | None:
+        return self.cache.get(AGENCY_COUNTS_KEY)
+
+    async def load_agencies(self) -> list | dict:
+        """
+        Fetch and store agencies.json, falling back to the stored agencies when that fails.
+        The aggregates are left to refresh_agencies, so the list is served before any title
+        is counted.
+        """
+        response = await self.title_service.fetcher.get(f"{urls.ADMN_URL}/agencies.json")
+        if response.status_code == 200:
+            agencies = response.json()["agencies"]
+            self.cache[AGENCIES_KEY] = agencies
+            return agencies
+        if AGENCIES_KEY in self.cache:
+            logger.error(
+                f"Failed to retrieve agencies: {response.status_code}, using cached agencies"
+            )
+            return self.cache[AGENCIES_KEY]
+        logger.error(f"Failed to retrieve agencies: {response.status_code}")
+        return {
+            "error": "Failed to retrieve agencies",
+            "status_code": response.status_code,
+        }
+
+    async def refresh_agencies(self) -> dict:
+        """Fetch agencies.json and recompute the aggregates of agencies that changed"""
+        agencies = await self.load_agencies()
+        if not isinstance(agencies, list):
+            return agencies
+
+        flat = flatten_agencies(agencies)
+        previous = (self.get_agency_counts() or {}).get("agencies", {})
+        part_counts = {}
+        entries = {}
+        updated = []
+        for slug, agency in flat.items():
+            titles = sorted({str(ref["title"]) for ref in agency["cfr_references"]})
+            signature = self._signature(agency["cfr_references"], titles)
+            entry = previous.get(slug)
+            if entry is None or entry["signature"] != signature:
+                for title in titles:
+                    if title not in part_counts:
+                        part_counts[title] = await self.get_part_counts(title)
+                entry = {
+                    **agency,
+                    "signature": signature,
+                    "parts": resolve_parts(agency["cfr_references"], part_counts),
+                }
+                entry["word_count"] = sum(count for _t, _p, count in entry["parts"])
+                updated.append(slug)
+            else:
+                entry = {**entry, **agency}  # names and children may change on their own
+            entries[slug] = entry
+
+        for slug, entry in entries.items():
+            parts = {}
+            for member in [slug, *descendants(slug, entries)]:
+                parts.update({(t, p): count for t, p, count in entries[member]["parts"]})
+            entry["word_count_with_children"] = sum(parts.values())
+
+        self.cache[AGENCY_COUNTS_KEY] = {"computed_at": nowIso8601(), "agencies": entries}
+        logger.info(f"Agency counts refreshed for {len(updated)} of {len(entries)} agencies")
+        return {"updated": updated, "unchanged": len(entries) - len(updated)}
+
+    async def get_part_counts(self, title) -> dict:
+        """Per part word counts of a title, counting the title first if needed"""
+        parts_key = f"part-counts/{title}"
+        if parts_key not in self.cache:
+            await self.title_service.get_title_words(title)
+        return self.cache.get(parts_key, {})
+
+    def _signature(self, references: list[dict], titles: list[str]) -> str:
+        """Changes when an agency's references or the counts of any referenced title change"""
+        markers = [self.cache.get(f"title-processed/{title}") for title in titles]
+        data = json.dumps([references, markers], sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+
+def flatten_agencies(agencies: list[dict], parent: str | None = None) -> dict[str, dict]:
+    """Agencies and their children by slug, each linked to its parent and children"""
+    flat = {}
+    for agency in agencies:
+        children = agency.get("children") or []
+        flat[agency["slug"]] = {
+            "slug": agency["slug"],
+            "name": agency.get("name"),
+            "short_name": agency.get("short_name"),
+            "parent": parent,
+            "children": [child["slug"] for child in children],
+            "cfr_references": agency.get("cfr_references") or [],
+        }
+        flat.update(flatten_agencies(children, parent=agency["slug"]))
+    return flat
+
+
+def descendants(slug: str, entries: dict[str, dict]) -> list[str]:
+    found = []
+    for child in entries[slug]["children"]:
+        if child in entries:
+            found.append(child)
+            found.extend(descendants(child, entries))
+    return found
+
+
+def resolve_parts(
+    references: list[dict], part_counts: dict[str, dict]
+) -> list[tuple[str, str, int]]:
+    """The (title, part, word count) of every part matched by any of the references"""
+    matched = {}
+    for ref in references:
+        title = str(ref["title"])
+        for part, info in part_counts.get(title, {}).items():
+            levels = {**info, "part": part}
+            if all(
+                str(ref[level]) == str(levels.get(level))
+                for level in REFERENCE_LEVELS
+                if ref.get(level)
+            ):
+                matched[(title, part)] = info["word_count"]
+    return [(title, part, count) for (title, part), count in sorted(matched.items())]
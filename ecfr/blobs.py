@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+from ecfr import metrics
+from ecfr.fetch import Fetcher
+from ecfr.tasks import fetched_bytes
+
+logger = logging.getLogger("ecfr")
+
+# Seconds a stored document is kept before it may be collected, so a download that finished
+# but has not been recorded under a document key yet is not removed
+COLLECT_GRACE = 60 * 60
+
+
+class BlobStore:
+    """
+    BlobStore keeps downloaded XML documents on disk, addressed by the SHA-256 of their bytes.
+
+    Documents are streamed from the response to a temporary file in chunks while the hash is
+    computed, then moved into place, so a download never holds more than one chunk in memory
+    and identical documents are stored once. Concurrent downloads of one URL share a single
+    request. Parsers read the stored files directly. Documents no key refers to any more are
+    removed by collect(): the previous snapshot of a refreshed title, whose key is dropped
+    once the recount succeeds, and documents fetched for other dates, whose keys are dropped
+    once the counts or diffs computed from them are stored.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.in_flight: dict[str, asyncio.Future] = {}  # url -> shared download
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], f"{digest}.xml")
+
+    def __contains__(self, digest) -> bool:
+        return isinstance(digest, str) and os.path.exists(self.path(digest))
+
+    async def download(self, fetcher: Fetcher, url: str, **kwargs) -> tuple[int, str | None]:
+        """
+        Download a URL into the store, returning the response status and the digest of the
+        stored document, None unless the status is 200. A waiter being cancelled does not
+        cancel the download for the others.
+        """
+        future = self.in_flight.get(url)
+        if future is None:
+            future = asyncio.ensure_future(self._download(fetcher, url, **kwargs))
+            self.in_flight[url] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(url, None))
+        return await asyncio.shield(future)
+
+    async def _download(self, fetcher: Fetcher, url: str, **kwargs) -> tuple[int, str | None]:
+        tmp_path = os.path.join(self.directory, f"download.{os.getpid()}.{id(url)}.tmp")
+        sha = hashlib.sha256()
+        size = 0
+        job_bytes = fetched_bytes.get()
+        try:
+            async with fetcher.stream(url, **kwargs) as response:
+                if response.status_code != 200:
+                    return response.status_code, None
+                with open(tmp_path, "wb") as f:
+                    async for chunk in response.aiter_bytes():
+                        sha.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+                        if job_bytes is not None:
+                            job_bytes[0] += len(chunk)
+                if not response.extensions.get("from_cache"):
+                    metrics.UPSTREAM_BYTES.inc(metrics.endpoint_class(url), amount=size)
+            digest = sha.hexdigest()
+            os.makedirs(os.path.dirname(self.path(digest)), exist_ok=True)
+            os.replace(tmp_path, self.path(digest))
+            logger.info(f"Stored {url} as {digest}")
+            return 200, digest
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def collect(self, referenced: set[str], grace: float = COLLECT_GRACE) -> int:
+        """
+        Remove stored documents whose digest is not in referenced and that are older than
+        grace seconds, returning the number of bytes freed
+        """
+        cutoff = time.time() - grace
+        freed = removed = 0
+        for dirpath, _dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                digest, extension = os.path.splitext(filename)
+                path = os.path.join(dirpath, filename)
+                if extension != ".xml" or digest in referenced:
+                    continue
+                try:
+                    stat = os.stat(path)
+                    if stat.st_mtime > cutoff:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                freed += stat.st_size
+                removed += 1
+        if removed:
+            logger.info(f"Removed {removed} unreferenced documents, {freed} bytes")
+        return freed
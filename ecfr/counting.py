@@ -0,0 +1,394 @@
+import re
+from collections import Counter
+from itertools import islice
+
+from lxml import etree
+
+WORD_RE = re.compile(r"\w+")
+
+CHUNK_SIZE = 1 << 20  # 1 MiB
+
+# Regulatory keywords counted by TextStats, matched as whole words in lower case text
+KEYWORD_RE = re.compile(r"\b(shall|must|may\s+not)\b")
+
+# A sentence ends with terminal punctuation after a word, followed by whitespace or the end.
+# Abbreviations such as U.S.C. overcount slightly, which is acceptable for an average.
+SENTENCE_END_RE = re.compile(r"\w[.!?]+(?=\s|$)")
+
+# Terms kept per title and per part
+TOP_TERMS = 25
+
+# Path segment names of DIV types in the hierarchy tree, other types are lower cased
+LEVEL_NAMES = {"SUBCHAP": "subchapter", "SUBJGRP": "subject-group"}
+
+# Common words left out of the top terms
+STOP_WORDS = frozenset(
+    "a an and any are as at be been by for from has have if in into is it its no not of on "
+    "or other such than that the their them then there these this those to under was were "
+    "which who will with".split()
+)
+
+
+def count_words(text: str) -> int:
+    """Count the \\w+ tokens in text without building a list of matches"""
+    return sum(1 for _ in WORD_RE.finditer(text))
+
+
+class WordCounter:
+    """
+    Incremental word counter for eCFR XML documents.
+
+    Feed it bytes as they arrive (for example straight from an HTTP response body) and call
+    close() for the total. Text is counted as soon as the element holding it is closed, after
+    which the element's children are dropped. Its earlier siblings are dropped too, their
+    tails being complete by then and counted on the parent's behalf, so memory stays bounded
+    by the depth of the document rather than its size.
+    """
+
+    events = ("end",)
+
+    def __init__(self):
+        self.parser = etree.XMLPullParser(events=self.events, huge_tree=True)
+        self.count = 0
+
+    def feed(self, data: bytes | str):
+        if isinstance(data, str):
+            data = data.encode()
+        self.parser.feed(data)
+        self._drain()
+
+    def close(self) -> int:
+        self.parser.close()
+        self._drain()
+        return self.count
+
+    def _drain(self):
+        for _event, elem in self.parser.read_events():
+            self.count += self._count_element(elem)
+            del elem[:]
+            self.count += self._drop_previous(elem)
+
+    def _count_element(self, elem) -> int:
+        return self._count_texts(self._texts(elem))
+
+    def _count_texts(self, texts) -> int:
+        return sum(count_words(text) for text in texts)
+
+    def _drop_previous(self, elem) -> int:
+        """
+        Remove the siblings before an element that just closed and return the words of their
+        tails and of the comments among them, complete by now, which the parent no longer
+        counts when it closes
+        """
+        parent = elem.getparent()
+        previous = elem.getprevious()
+        if parent is None or previous is None:
+            return 0
+        dropped = []
+        while previous is not None:
+            # remove() takes the tail along, unlike a slice deletion it does not walk the
+            # siblings parsed ahead
+            parent.remove(previous)
+            dropped.append(previous)
+            previous = elem.getprevious()
+        texts = []
+        for child in reversed(dropped):
+            if not isinstance(child.tag, str) and child.text:
+                texts.append(child.text)
+            if child.tail:
+                texts.append(child.tail)
+        return self._count_texts(texts)
+
+    @staticmethod
+    def _texts(elem):
+        """
+        The text directly inside an element: its own text plus the tail of each child.
+        An element's own tail belongs to its parent and is counted when the parent closes.
+        Comments and processing instructions never produce end events so their text is
+        counted here along with their tails.
+        """
+        if elem.text:
+            yield elem.text
+        for child in elem:
+            if not isinstance(child.tag, str) and child.text:
+                yield child.text
+            if child.tail:
+                yield child.tail
+
+
+class SectionIndexer(WordCounter):
+    """
+    Counts the words of every section in a full title document in a single pass.
+
+    eCFR documents nest DIV elements carrying a TYPE such as PART, SUBPART, SECTION or
+    APPENDIX and a number in N. Words are attributed to the innermost enclosing section or
+    appendix and keyed `{part}/{subpart}/{identifier}` with "-" for a missing level, matching
+    the version keys built from the versioner's content_versions. Words outside any section,
+    such as part headings and authority notes, only count toward the total.
+    """
+
+    events = ("start", "end")
+    SECTION_TYPES = {"SECTION", "APPENDIX"}
+
+    def __init__(self):
+        super().__init__()
+        self.path: list[tuple[str, str]] = []  # (TYPE, N) of each open DIV
+        self.sections: dict[str, int] = {}
+
+    def close(self) -> dict[str, int]:
+        super().close()
+        return self.sections
+
+    def _drain(self):
+        for event, elem in self.parser.read_events():
+            div = self._div(elem)
+            if event == "start":
+                if div:
+                    self._enter(div)
+                continue
+            count = self._count_element(elem)
+            self.count += count
+            self._attribute(count)
+            if div:
+                self._leave()
+            del elem[:]
+            # credited within the parent, like the parent's own text
+            count = self._drop_previous(elem)
+            self.count += count
+            self._attribute(count)
+
+    def _enter(self, div: tuple[str, str]):
+        self.path.append(div)
+
+    def _leave(self):
+        self.path.pop()
+
+    def _attribute(self, count: int):
+        """Credit the words of the element that just closed to the open section"""
+        key = self._section_key()
+        if key is not None:
+            self.sections[key] = self.sections.get(key, 0) + count
+
+    @staticmethod
+    def _div(elem) -> tuple[str, str] | None:
+        if not isinstance(elem.tag, str) or not elem.tag.startswith("DIV"):
+            return None
+        if "TYPE" not in elem.attrib:
+            return None
+        number = elem.get("N", "").replace("\u00a7", "").strip()
+        return elem.get("TYPE").upper(), number or "-"
+
+    def _section_key(self) -> str | None:
+        part = subpart = identifier = "-"
+        for div_type, number in self.path:
+            if div_type == "PART":
+                part, subpart = number, "-"
+            elif div_type == "SUBPART":
+                subpart = number
+            elif div_type in self.SECTION_TYPES:
+                identifier = number
+        if identifier == "-":
+            return None
+        return f"{part}/{subpart}/{identifier}"
+
+
+class TextStats:
+    """Term frequencies, regulatory keywords and sentences of a body of text"""
+
+    def __init__(self):
+        self.terms = Counter()
+        self.keywords = Counter()
+        self.words = 0
+        self.sentences = 0
+
+    def add(self, text: str) -> int:
+        """Tokenize text once for every statistic and return its word count"""
+        text = text.lower()
+        words = WORD_RE.findall(text)
+        self.terms.update(words)
+        self.keywords.update(" ".join(k.split()) for k in KEYWORD_RE.findall(text))
+        self.words += len(words)
+        self.sentences += sum(1 for _ in SENTENCE_END_RE.finditer(text))
+        return len(words)
+
+    def update(self, other: "TextStats"):
+        self.terms.update(other.terms)
+        self.keywords.update(other.keywords)
+        self.words += other.words
+        self.sentences += other.sentences
+
+    def summary(self, top: int = TOP_TERMS) -> dict:
+        terms = (
+            (term, count)
+            for term, count in sorted(self.terms.items(), key=lambda item: (-item[1], item[0]))
+            if term not in STOP_WORDS and not term.isdigit()
+        )
+        return {
+            "word_count": self.words,
+            "sentence_count": self.sentences,
+            "average_sentence_length": (
+                round(self.words / self.sentences, 2) if self.sentences else 0.0
+            ),
+            "keywords": {k: self.keywords[k] for k in ("shall", "must", "may not")},
+            "top_terms": [[term, count] for term, count in islice(terms, top)],
+        }
+
+
+class TitleIndexer(SectionIndexer):
+    """
+    Indexes a full title document in a single pass: the total word count, the count of each
+    section and the count of each part along with the subtitle, chapter and subchapter the
+    part belongs to. Part counts include every word inside the part, headings and notes too.
+    The same tokens feed the text statistics of each part and of the whole title.
+
+    It also builds the hierarchy tree of the title, one node per DIV, holding the word total
+    of the node's subtree. Words are credited to the innermost open node and what a node
+    gained while open is added to its parent when it closes, so every total is known by the
+    end of the pass. Sibling DIVs sharing a segment, such as a repeated or missing N, share a
+    node whose total is theirs combined.
+    """
+
+    PART_LEVELS = {"SUBTITLE": "subtitle", "CHAPTER": "chapter", "SUBCHAP": "subchapter"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts: dict[str, dict] = {}
+        self.part_stats: dict[str, TextStats] = {}
+        self.other_stats = TextStats()  # text outside any part
+        self.root = hierarchy_node("title", None)
+        self.nodes = [self.root]  # the open nodes, outermost first
+        self.entered: list[int] = []  # the total of each open node when it was entered
+
+    def close(self) -> dict:
+        sections = super().close()
+        title_stats = TextStats()
+        title_stats.update(self.other_stats)
+        for stats in self.part_stats.values():
+            title_stats.update(stats)
+        return {
+            "word_count": self.count,
+            "sections": sections,
+            "parts": self.parts,
+            "hierarchy": sorted_tree(self.root),
+            "analytics": {
+                "title": title_stats.summary(),
+                "parts": {part: stats.summary() for part, stats in self.part_stats.items()},
+            },
+        }
+
+    def _count_texts(self, texts) -> int:
+        part = self._part_number()
+        if part is None:
+            stats = self.other_stats
+        else:
+            stats = self.part_stats.setdefault(part, TextStats())
+        return stats.add(" ".join(texts))
+
+    def _part_number(self) -> str | None:
+        for div_type, number in self.path:
+            if div_type == "PART":
+                return number
+        return None
+
+    def _attribute(self, count: int):
+        super()._attribute(count)
+        self.nodes[-1]["word_count"] += count
+        part = self._part()
+        if part is not None:
+            part["word_count"] += count
+
+    def _enter(self, div: tuple[str, str]):
+        super()._enter(div)
+        div_type, number = div
+        parent = self.nodes[-1]
+        if div_type == "TITLE" and parent is self.root and self.root["number"] is None:
+            # the document element is the title itself
+            self.root["number"] = number
+            node = self.root
+        else:
+            kind = LEVEL_NAMES.get(div_type, div_type.lower())
+            segment = f"{kind}-{number}".replace("/", "-")
+            if segment not in parent["children"]:
+                parent["children"][segment] = hierarchy_node(kind, number)
+            node = parent["children"][segment]
+        self.nodes.append(node)
+        self.entered.append(node["word_count"])
+
+    def _leave(self):
+        super()._leave()
+        node = self.nodes.pop()
+        entered = self.entered.pop()
+        if node is not self.nodes[-1]:
+            # a node entered again already passed its earlier words on
+            self.nodes[-1]["word_count"] += node["word_count"] - entered
+
+    def _part(self) -> dict | None:
+        levels = {}
+        for div_type, number in self.path:
+            if div_type in self.PART_LEVELS:
+                levels[self.PART_LEVELS[div_type]] = number
+            elif div_type == "PART":
+                if number not in self.parts:
+                    self.parts[number] = {**levels, "word_count": 0}
+                return self.parts[number]
+        return None
+
+
+def hierarchy_node(kind: str, number: str | None) -> dict:
+    return {"type": kind, "number": number, "word_count": 0, "children": {}}
+
+
+def sorted_tree(node: dict) -> dict:
+    """
+    A hierarchy node with its children as a list, largest subtree first and in document
+    order among equal totals. Each child carries the path segment addressing it.
+    """
+    children = sorted(node["children"].items(), key=lambda item: -item[1]["word_count"])
+    return {
+        "type": node["type"],
+        "number": node["number"],
+        "word_count": node["word_count"],
+        "children": [
+            {"segment": segment, **sorted_tree(child)} for segment, child in children
+        ],
+    }
+
+
+def _feed(counter: WordCounter, xml: bytes | str, chunk_size: int):
+    if isinstance(xml, str):
+        xml = xml.encode()
+    for start in range(0, len(xml), chunk_size):
+        counter.feed(xml[start : start + chunk_size])
+    return counter.close()
+
+
+def _feed_file(counter: WordCounter, path: str, chunk_size: int):
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            counter.feed(chunk)
+    return counter.close()
+
+
+def word_count(xml: bytes | str, chunk_size: int = CHUNK_SIZE) -> int:
+    """Count the words in an XML document"""
+    return _feed(WordCounter(), xml, chunk_size)
+
+
+def section_word_counts(xml: bytes | str, chunk_size: int = CHUNK_SIZE) -> dict[str, int]:
+    """Count the words of each section in a full title XML document"""
+    return _feed(SectionIndexer(), xml, chunk_size)
+
+
+def index_title(xml: bytes | str, chunk_size: int = CHUNK_SIZE) -> dict:
+    """Total, per section and per part word counts of a full title XML document"""
+    return _feed(TitleIndexer(), xml, chunk_size)
+
+
+def section_word_counts_file(path: str, chunk_size: int = CHUNK_SIZE) -> dict[str, int]:
+    """Count the words of each section in a full title XML file, reading it in chunks"""
+    return _feed_file(SectionIndexer(), path, chunk_size)
+
+
+def index_title_file(path: str, chunk_size: int = CHUNK_SIZE) -> dict:
+    """Index a full title XML file like index_title, reading it in chunks"""
+    return _feed_file(TitleIndexer(), path, chunk_size)
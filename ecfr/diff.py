@@ -0,0 +1,197 @@
+import asyncio
+import difflib
+import hashlib
+import logging
+
+from ecfr.counting import CHUNK_SIZE, WORD_RE
+from ecfr.search import SectionTextExtractor
+from ecfr.services import TitleService, document_url
+from ecfr.tasks import active_tasks
+from ecfr.timestamps import nowIso8601
+
+logger = logging.getLogger("ecfr")
+
+
+def section_texts_file(path: str, keys=None, chunk_size: int = CHUNK_SIZE) -> dict[str, str]:
+    """
+    The text of every section of a full title XML file keyed `{part}/{subpart}/{section}`,
+    or only of the sections in keys. Text of sections sharing a key is joined.
+    """
+    extractor = SectionTextExtractor()
+    texts: dict[str, list[str]] = {}
+
+    def collect(sections):
+        for part, subpart, section, _heading, text in sections:
+            key = f"{part}/{subpart}/{section}"
+            if keys is None or key in keys:
+                texts.setdefault(key, []).append(text)
+
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            extractor.feed(chunk)
+            collect(extractor.take())
+    collect(extractor.close())
+    return {key: " ".join(parts) for key, parts in texts.items()}
+
+
+def section_digests_file(path: str, chunk_size: int = CHUNK_SIZE) -> dict[str, list]:
+    """The content digest and word count of every section of a full title XML file"""
+    return {
+        key: [hashlib.sha256(text.encode()).hexdigest(), len(WORD_RE.findall(text))]
+        for key, text in section_texts_file(path, chunk_size=chunk_size).items()
+    }
+
+
+def word_changes(old: str, new: str) -> dict[str, int]:
+    """
+    Words added, removed and changed between two texts. A replaced run of words counts as
+    changed up to the shorter side and the rest as added or removed.
+    """
+    old_words = WORD_RE.findall(old)
+    new_words = WORD_RE.findall(new)
+    changes = {"words_added": 0, "words_removed": 0, "words_changed": 0}
+    matcher = difflib.SequenceMatcher(None, old_words, new_words, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        removed, added = i2 - i1, j2 - j1
+        if tag == "replace":
+            changed = min(removed, added)
+            changes["words_changed"] += changed
+            removed -= changed
+            added -= changed
+        if tag != "equal":
+            changes["words_added"] += added
+            changes["words_removed"] += removed
+    return changes
+
+
+def diff_title_files(old_path: str, new_path: str, keys: list[str]) -> dict[str, dict]:
+    """Word changes of the given sections, present in both files, between the two files"""
+    wanted = set(keys)
+    old_texts = section_texts_file(old_path, wanted)
+    new_texts = section_texts_file(new_path, wanted)
+    return {key: word_changes(old_texts[key], new_texts[key]) for key in keys}
+
+
+class DiffService:
+    """
+    DiffService reports how much of a title changed between two snapshot dates.
+
+    Each snapshot's sections are hashed in one pass over its document and the digests are
+    stored per document, so a snapshot shared by several comparisons is hashed once. Sections
+    whose digests match are skipped. Only the sections changed in place are read again and
+    compared word by word, and sections present on one date only count as wholly added or
+    removed. Results are stored under `title-diff/{title}/{from}/{to}` and concurrent
+    requests for the same comparison share one computation. The documents are released once
+    the result is stored, except a title's latest snapshot, and a later comparison
+    downloads them again.
+    """
+
+    def __init__(self, title_service: TitleService):
+        self.title_service = title_service
+        self.cache = title_service.cache
+        self.engine = title_service.engine
+        self.tasks: dict[str, asyncio.Task] = {}  # diff key -> in-flight computation
+
+    async def get_diff(self, title, from_date: str, to_date: str) -> dict:
+        key = f"title-diff/{title}/{from_date}/{to_date}"
+        diff = self.cache.get(key)
+        if diff is not None:
+            return diff
+        task = self.tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(self.compute_diff(title, from_date, to_date))
+            self.tasks[key] = task
+            active_tasks.add(task)
+
+            def diff_done(t):
+                active_tasks.discard(t)
+                if self.tasks.get(key) is t:
+                    del self.tasks[key]
+
+            task.add_done_callback(diff_done)
+        # a cancelled request leaves the computation running for the next one
+        return await asyncio.shield(task)
+
+    async def compute_diff(self, title, from_date: str, to_date: str) -> dict:
+        digests = {}
+        paths = {}
+        for date in (from_date, to_date):
+            document_key = f"document/{title}/{date}"
+            status_code = await self.title_service.get_document(
+                document_key, document_url(document_key)
+            )
+            if status_code != 200:
+                for fetched in digests:
+                    self.title_service.release_document(title, fetched)
+                return {
+                    "error": f"Title {title} not found on {date} or rate limited",
+                    "status_code": status_code,
+                }
+            # the files outlive their keys until collected, another comparison releasing
+            # the same date does not affect this one
+            digests[date] = self.cache[document_key]
+            paths[date] = self.title_service.document_path(document_key)
+        old = await self.section_digests(digests[from_date], paths[from_date])
+        new = await self.section_digests(digests[to_date], paths[to_date])
+
+        modified = sorted(key for key in old.keys() & new.keys() if old[key][0] != new[key][0])
+        changes = {}
+        if modified:
+            changes = await self.engine.run(
+                diff_title_files, paths[from_date], paths[to_date], modified
+            )
+        for key in new.keys() - old.keys():
+            changes[key] = {"words_added": new[key][1], "words_removed": 0, "words_changed": 0}
+        for key in old.keys() - new.keys():
+            changes[key] = {"words_added": 0, "words_removed": old[key][1], "words_changed": 0}
+
+        diff = {
+            "title": title,
+            "from": from_date,
+            "to": to_date,
+            "computed_at": nowIso8601(),
+            **total(changes.values()),
+            "sections_changed": len(changes),
+            "sections_unchanged": len(old.keys() & new.keys()) - len(modified),
+            "parts": {},
+            "sections": [],
+        }
+        by_part: dict[str, list[dict]] = {}
+        for key in sorted(changes):
+            part, subpart, section = key.split("/", 2)
+            status = "removed" if key not in new else "added" if key not in old else "modified"
+            change = {
+                "part": part,
+                "subpart": subpart,
+                "section": section,
+                "status": status,
+                **changes[key],
+            }
+            diff["sections"].append(change)
+            by_part.setdefault(part, []).append(change)
+        diff["parts"] = {part: total(sections) for part, sections in by_part.items()}
+        logger.info(
+            f"Title {title} {from_date} to {to_date}: {len(changes)} sections changed, "
+            f"{len(modified)} diffed"
+        )
+        self.cache[f"title-diff/{title}/{from_date}/{to_date}"] = diff
+        for date in (from_date, to_date):
+            self.title_service.release_document(title, date)
+        return diff
+
+    async def section_digests(self, digest: str, path: str) -> dict[str, list]:
+        """Section digests and word counts of a stored snapshot, shared by identical ones"""
+        key = f"section-digests/{digest}"
+        digests = self.cache.get(key)
+        if digests is None:
+            digests = await self.engine.run(section_digests_file, path)
+            self.cache[key] = digests
+        return digests
+
+
+def total(changes) -> dict[str, int]:
+    totals = {"words_added": 0, "words_removed": 0, "words_changed": 0}
+    for change in changes:
+        for name in totals:
+            totals[name] += change[name]
+    return totals
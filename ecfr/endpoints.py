@@ -1,15 +1,30 @@
+import asyncio
+import json
 import logging
+import re
 
 import falcon
 import httpx
 
-from ecfr import urls
+from ecfr.agencies import AgencyService
+from ecfr.diff import DiffService
+from ecfr.history import HistoryService, part_series
+from ecfr.jobs import JobManager
+from ecfr.leader import LeaderElection
 from ecfr.logs import log_errors
+from ecfr.metrics import CONTENT_TYPE, REGISTRY, Registry
+from ecfr.search import SearchService
 from ecfr.services import TitleService
 from ecfr.timestamps import nowIso8601
+from ecfr.warmup import PROGRESS_KEY, REFRESH_REQUEST_KEY, CacheWarmer, refresh_all
 
 logger = logging.getLogger("ecfr")
 
+DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+# Titles one NDJSON title counts request may ask for, a little over every title there is
+MAX_STREAM_TITLES = 60
+
 
 class HealthResource:
     """Health resource for determining that a container is live"""
@@ -22,16 +37,58 @@ class HealthResource:
         resp.media = {"message": f"Health is okay. Time is {nowIso8601()}"}
 
 
+class MetricsResource:
+    """Serves counters and histograms of the process in the Prometheus text format"""
+
+    auth = {"auth_disabled": True}
+
+    def __init__(self, registry: Registry = REGISTRY):
+        self.registry = registry
+
+    @log_errors
+    async def on_get(self, req, resp):
+        resp.status = falcon.HTTP_OK
+        resp.content_type = CONTENT_TYPE
+        resp.text = self.registry.render()
+
+
+class ReadyResource:
+    """Readiness resource reporting cache warm up progress, 503 until the cache is warm"""
+
+    auth = {"auth_disabled": True}
+
+    def __init__(self, warmer: CacheWarmer):
+        self.warmer = warmer
+
+    @log_errors
+    async def on_get(self, req, resp):
+        progress = self.warmer.progress()
+        resp.status = falcon.HTTP_OK if progress["ready"] else falcon.HTTP_SERVICE_UNAVAILABLE
+        resp.content_type = "application/json"
+        resp.media = progress
+
+
 class WordCountResource:
-    """Analyzing word count per agency from eCFR Titles"""
+    """
+    Lists the agencies whose eCFR Titles are analyzed, fetching agencies.json when it has not
+    been loaded yet
+    """
 
     auth = {"auth_disabled": True}
 
+    def __init__(self, agency_service: AgencyService):
+        self.agency_service = agency_service
+
     @log_errors
     async def on_get(self, req, resp):
-        # Read the request body
-        r = httpx.get(f"{urls.ADMN_URL}/agencies.json")
-        agencies = r.json()["agencies"]
+        agencies = self.agency_service.get_agencies()
+        if agencies is None:
+            agencies = await self.agency_service.load_agencies()
+        resp.content_type = "application/json"
+        if not isinstance(agencies, list):
+            resp.status = falcon.HTTP_BAD_GATEWAY
+            resp.media = agencies
+            return
 
         agency_names = [item["short_name"] for item in agencies]
 
@@ -40,29 +97,97 @@ class WordCountResource:
 
         # Prepare the response
         resp.status = falcon.HTTP_OK
-        resp.content_type = "application/json"
         resp.media = {"agency_count": agency_count, "agencies": agency_names}
 
 
+class AgencyCountsResource:
+    """Gets word counts for all agencies, or for one agency by slug with a part breakdown"""
+
+    auth = {"auth_disabled": True}
+
+    def __init__(self, agency_service: AgencyService):
+        self.agency_service = agency_service
+
+    @log_errors
+    async def on_get(self, req, resp, slug=None):
+        counts = self.agency_service.get_agency_counts()
+        resp.content_type = "application/json"
+        if counts is None:
+            resp.status = falcon.HTTP_SERVICE_UNAVAILABLE
+            resp.media = {"error": "Agency counts have not been computed yet"}
+            return
+
+        if slug is not None:
+            entry = counts["agencies"].get(slug)
+            if entry is None:
+                resp.status = falcon.HTTP_NOT_FOUND
+                resp.media = {"error": f"Agency {slug} not found"}
+                return
+            resp.status = falcon.HTTP_OK
+            resp.media = {
+                **agency_summary(entry),
+                "cfr_references": entry["cfr_references"],
+                "parts": [
+                    {"title": title, "part": part, "word_count": count}
+                    for title, part, count in entry["parts"]
+                ],
+            }
+            return
+
+        agencies = sorted(
+            (agency_summary(entry) for entry in counts["agencies"].values()),
+            key=lambda entry: entry["word_count_with_children"],
+            reverse=True,
+        )
+        resp.status = falcon.HTTP_OK
+        resp.media = {"computed_at": counts["computed_at"], "agencies": agencies}
+
+
+def agency_summary(entry: dict) -> dict:
+    return {
+        key: entry[key]
+        for key in (
+            "slug",
+            "name",
+            "short_name",
+            "parent",
+            "children",
+            "word_count",
+            "word_count_with_children",
+        )
+    }
+
+
 class TitlesResource:
-    """Gets and stores all titles and all sections in each title."""
+    """
+    Gets and stores all titles. With get_all=true the sections of every title are stored
+    too, by a background populate job when jobs are enabled, answered with 202 and the job.
+    """
 
     auth = {"auth_disabled": True}
 
-    def __init__(self, title_service: TitleService):
+    def __init__(self, title_service: TitleService, jobs: JobManager | None = None):
         self.title_service = title_service
+        self.jobs = jobs
 
     @log_errors
     async def on_get(self, req, resp):
         params = req.params
-        titles = await self.title_service.get_titles()
+        await self.title_service.get_titles()
         if "get_all" in params and params["get_all"] == "true":
+            if self.jobs is not None:
+                await JobsResource(self.jobs).on_post(req, resp, media={"kind": "populate"})
+                return
             await self.title_service.populate_title_sections()
 
         # Prepare the response
-        resp.status = falcon.HTTP_OK
-        resp.content_type = "application/json"
-        resp.media = await self.title_service.get_counts()
+        responses = self.title_service.responses
+        entry = responses.get("titles")
+        if entry is None:
+            generation = responses.generation
+            counts = await self.title_service.get_counts()
+            entry = responses.put("titles", counts, generation)
+        responses.respond(req, resp, entry)
 
 
 async def call_url(url, client: httpx.AsyncClient) -> httpx.Response | None:
@@ -74,27 +199,143 @@ async def call_url(url, client: httpx.AsyncClient) -> httpx.Response | None:
     return response
 
 
+def follower(election: LeaderElection | None) -> bool:
+    """True in a worker process that is not the elected leader"""
+    return election is not None and not election.leader
+
+
+def not_counted_yet(resp, cache, what: str):
+    """
+    Answer a follower's request for counts the leader has not stored yet with 503 and the
+    leader's published warm up progress, queueing a refresh for the leader to count them
+    """
+    if REFRESH_REQUEST_KEY not in cache:
+        cache[REFRESH_REQUEST_KEY] = nowIso8601()
+    resp.status = falcon.HTTP_SERVICE_UNAVAILABLE
+    resp.content_type = "application/json"
+    resp.set_header("Retry-After", "30")
+    resp.media = {"error": f"{what} not counted yet", "progress": cache.get(PROGRESS_KEY)}
+
+
 class TitleCountsResource:
-    """Gets word counts for all titles"""
+    """
+    Gets word counts for all titles, or with ?titles=1,5,40 and an optional &date=YYYY-MM-DD
+    streams the counts of those titles as NDJSON, one line per title as each completes. A
+    failure part way through the stream ends it with an {"error": ...} line.
+
+    In a worker process that is not the elected leader only stored counts are served. The
+    aggregate answers 503 until the leader stores it, and a stream queues the titles missing
+    a count as a counts job for the leader, with a {"status": "queued", "job": ...} line each.
+    """
 
     auth = {"auth_disabled": True}
 
-    def __init__(self, title_service: TitleService):
+    def __init__(
+        self,
+        title_service: TitleService,
+        jobs: JobManager | None = None,
+        election: LeaderElection | None = None,
+    ):
         self.title_service = title_service
+        self.jobs = jobs
+        self.election = election
 
     @log_errors
     async def on_get(self, req, resp):
-        # Read the request body
-        counts = await self.title_service.get_title_counts_cached()
+        # comma separated, or repeated as ?titles=1&titles=5
+        titles = [
+            title.strip()
+            for value in req.get_param_as_list("titles") or []
+            for title in value.split(",")
+            if title.strip()
+        ]
+        if titles:
+            date = req.get_param("date")
+            if date is not None and not DATE_RE.match(date):
+                resp.status = falcon.HTTP_BAD_REQUEST
+                resp.media = {"error": "date must be formatted YYYY-MM-DD"}
+                return
+            # dict.fromkeys drops repeated titles while keeping their order
+            titles = list(dict.fromkeys(titles))
+            if len(titles) > MAX_STREAM_TITLES:
+                resp.status = falcon.HTTP_BAD_REQUEST
+                resp.media = {"error": f"at most {MAX_STREAM_TITLES} titles per request"}
+                return
+            titles_json = await self.title_service.get_titles()
+            if not isinstance(titles_json, list):
+                resp.status = falcon.HTTP_BAD_GATEWAY
+                resp.media = {"error": "Failed to retrieve titles"}
+                return
+            known = {str(title_json["number"]) for title_json in titles_json}
+            unknown = [title for title in titles if title not in known]
+            if unknown:
+                resp.status = falcon.HTTP_BAD_REQUEST
+                resp.media = {"error": "Unknown titles", "titles": unknown}
+                return
+            if follower(self.election):
+                await self.queue_missing(resp, titles, date)
+                return
+            resp.status = falcon.HTTP_OK
+            resp.content_type = "application/x-ndjson"
+            resp.stream = self.ndjson(titles, date)
+            return
+
+        # Serialized once per change to the counts
+        responses = self.title_service.responses
+        entry = responses.get("title-counts")
+        if entry is None:
+            generation = responses.generation
+            if follower(self.election):
+                counts = self.title_service.cache.get("title-counts")
+                if counts is None:
+                    not_counted_yet(resp, self.title_service.cache, "Titles")
+                    return
+            else:
+                counts = await self.title_service.get_title_counts_cached()
+            entry = responses.put("title-counts", counts, generation)
 
         # Prepare the response
+        responses.respond(req, resp, entry)
+
+    async def ndjson(self, titles, date):
+        # the status is sent by now, so a failure can only be reported in the body
+        counts = self.title_service.stream_title_counts(titles, date)
+        try:
+            async for count in counts:
+                yield json.dumps(count).encode() + b"\n"
+        except Exception as e:
+            logger.error("Title counts stream failed: %s", e, exc_info=True)
+            yield json.dumps({"error": "Failed to count titles"}).encode() + b"\n"
+        finally:
+            await counts.aclose()
+
+    async def queue_missing(self, resp, titles, date):
+        """Stream the stored counts of titles, queueing the others for the leader"""
+        counts, missing = self.title_service.stored_title_counts(titles, date)
+        if missing:
+            try:
+                job = await self.jobs.submit("counts", missing, date)
+            except asyncio.QueueFull:
+                resp.status = falcon.HTTP_TOO_MANY_REQUESTS
+                resp.content_type = "application/json"
+                resp.set_header("Retry-After", "60")
+                resp.media = {"error": "Too many jobs queued, try again later"}
+                return
+            for title in missing:
+                queued = {"title": title, "status": "queued", "job": job["id"]}
+                if date is not None:
+                    queued["date"] = date
+                counts.append(queued)
         resp.status = falcon.HTTP_OK
-        resp.content_type = "application/json"
-        resp.media = counts
+        resp.content_type = "application/x-ndjson"
+        resp.text = "".join(json.dumps(count) + "\n" for count in counts)
 
 
 class SectionCountsResource:
-    """Gets word counts for all sections"""
+    """
+    Gets word counts for all sections, holding the request open until every title is
+    counted. POST /jobs with kind sections does the same in the background.
+    """
 
     auth = {"auth_disabled": True}
 
@@ -108,10 +349,12 @@ class SectionCountsResource:
         titles = [str(title_json["number"]) for title_json in titles_json]
 
         try:
-            counts = [
-                await self.title_service.get_title_word_count_by_sections(title)
-                for title in titles
-            ]
+            counts = await asyncio.gather(
+                *[
+                    self.title_service.get_title_word_count_by_sections(title)
+                    for title in titles
+                ]
+            )
         except (httpx.ReadError, RuntimeError):
             logger.error("HTTPX read error while cancelling, shutting down")
             resp.status = falcon.HTTP_INTERNAL_SERVER_ERROR
@@ -125,12 +368,16 @@ class SectionCountsResource:
 
 
 class TitleCountResource:
-    """Gets word count per title"""
+    """
+    Gets word count per title. In a worker process that is not the elected leader only a
+    stored count is served, answering 503 until the leader stores it.
+    """
 
     auth = {"auth_disabled": True}
 
-    def __init__(self, title_service: TitleService):
+    def __init__(self, title_service: TitleService, election: LeaderElection | None = None):
         self.title_service = title_service
+        self.election = election
 
     @log_errors
     async def on_get(self, req, resp, title):
@@ -140,7 +387,313 @@ class TitleCountResource:
             resp.media = {"error": "Title is required"}
             return
 
+        responses = self.title_service.responses
+        entry = responses.get(f"title-counts/{title}")
+        if entry is None:
+            generation = responses.generation
+            if follower(self.election):
+                counts, _missing = self.title_service.stored_title_counts([title])
+                if not counts:
+                    self.not_counted(resp, title)
+                    return
+                (count,) = counts
+            else:
+                count = await self.title_service.get_title_words(title)
+            if "error" in count:
+                resp.status = falcon.HTTP_OK
+                resp.content_type = "application/json"
+                resp.media = count
+                return
+            entry = responses.put(f"title-counts/{title}", count, generation)
+
         # Prepare the response
+        responses.respond(req, resp, entry)
+
+    def not_counted(self, resp, title):
+        cache = self.title_service.cache
+        titles_json = cache.get(TitleService.TITLES_KEY)
+        if isinstance(titles_json, list) and title not in {
+            str(title_json["number"]) for title_json in titles_json
+        }:
+            # the leader never counts a title missing from titles.json
+            resp.status = falcon.HTTP_NOT_FOUND
+            resp.content_type = "application/json"
+            resp.media = {"error": f"Title {title} not found"}
+            return
+        not_counted_yet(resp, cache, f"Title {title}")
+
+
+class RefreshResource:
+    """
+    Recounts the titles amended since they were last counted and the affected agencies.
+    In a worker process that is not the elected leader the refresh is queued for the leader
+    and answered with 202.
+    """
+
+    auth = {"auth_disabled": True}
+
+    def __init__(
+        self,
+        title_service: TitleService,
+        agency_service: AgencyService,
+        search_service: SearchService | None = None,
+        election: LeaderElection | None = None,
+        history_service: HistoryService | None = None,
+    ):
+        self.title_service = title_service
+        self.agency_service = agency_service
+        self.search_service = search_service
+        self.election = election
+        self.history_service = history_service
+
+    @log_errors
+    async def on_post(self, req, resp):
+        if self.election is not None and not self.election.leader:
+            requested_at = nowIso8601()
+            self.title_service.cache[REFRESH_REQUEST_KEY] = requested_at
+            resp.status = falcon.HTTP_ACCEPTED
+            resp.content_type = "application/json"
+            resp.media = {"status": "queued", "requested_at": requested_at}
+            return
+
+        report = await refresh_all(
+            self.title_service, self.agency_service, self.search_service, self.history_service
+        )
+        if "error" in report:
+            resp.status = falcon.HTTP_BAD_GATEWAY
+        else:
+            resp.status = falcon.HTTP_OK
+        resp.content_type = "application/json"
+        resp.media = report
+
+
+class SearchResource:
+    """
+    Full text search over the sections of every indexed title, for example
+    /search?q=emission AND vehicle&page=2&per_page=20. Queries use SQLite FTS5 syntax.
+    """
+
+    auth = {"auth_disabled": True}
+
+    def __init__(self, search_service: SearchService):
+        self.search_service = search_service
+
+    @log_errors
+    async def on_get(self, req, resp):
+        resp.content_type = "application/json"
+        query = (req.get_param("q") or "").strip()
+        if not query:
+            resp.status = falcon.HTTP_BAD_REQUEST
+            resp.media = {"error": "q is required"}
+            return
+        page = req.get_param_as_int("page", min_value=1, default=1)
+        per_page = req.get_param_as_int("per_page", min_value=1, default=20)
+        try:
+            results = await self.search_service.search(query, page, per_page)
+        except ValueError as e:
+            resp.status = falcon.HTTP_BAD_REQUEST
+            resp.media = {"error": str(e)}
+            return
+        resp.status = falcon.HTTP_OK
+        resp.media = results
+
+
+class TitleAnalyticsResource:
+    """
+    Gets the most frequent terms, regulatory keyword counts and sentence statistics of a
+    title, or of one part with ?part=
+    """
+
+    auth = {"auth_disabled": True}
+
+    def __init__(self, title_service: TitleService):
+        self.title_service = title_service
+
+    @log_errors
+    async def on_get(self, req, resp, title):
+        resp.content_type = "application/json"
+        part = req.get_param("part")
+        analytics = await self.title_service.get_title_analytics(title, part)
+        if analytics is None:
+            resp.status = falcon.HTTP_NOT_FOUND
+            resp.media = {"error": f"No analytics for title {title}", "part": part}
+            return
+        resp.status = falcon.HTTP_OK
+        resp.media = analytics
+
+
+class HierarchyCountsResource:
+    """
+    Gets the word total of any node of a title's hierarchy and of its children, largest
+    first. /counts/{title}/chapter-I/part-52 addresses part 52 of chapter I by the segments
+    listed in each node's children, and ?top= keeps only the largest children.
+    """
+
+    auth = {"auth_disabled": True}
+
+    def __init__(self, title_service: TitleService):
+        self.title_service = title_service
+
+    @log_errors
+    async def on_get(self, req, resp, title, path=""):
+        resp.content_type = "application/json"
+        segments = [segment for segment in path.split("/") if segment]
+        top = req.get_param_as_int("top", min_value=0)
+        counts = await self.title_service.get_hierarchy_counts(title, segments, top)
+        if counts is None:
+            resp.status = falcon.HTTP_NOT_FOUND
+            resp.media = {"error": f"No counts for title {title}", "path": segments}
+            return
+        resp.status = falcon.HTTP_OK
+        resp.media = counts
+
+
+class JobsResource:
+    """
+    Starts, lists, polls and cancels background jobs.
+
+    POST /jobs with {"kind": "counts" | "sections" | "populate", "titles": [...], "date":
+    "YYYY-MM-DD"} queues a job over the titles, all titles when none are given, and answers
+    202 with the job. GET /jobs/{id} reports its progress, bytes fetched and estimated
+    seconds remaining, and DELETE /jobs/{id} cancels it.
+    """
+
+    auth = {"auth_disabled": True}
+
+    def __init__(self, jobs: JobManager):
+        self.jobs = jobs
+
+    @log_errors
+    async def on_get(self, req, resp, job_id=None):
+        resp.content_type = "application/json"
+        if job_id is None:
+            resp.status = falcon.HTTP_OK
+            resp.media = {"jobs": self.jobs.list()}
+            return
+        job = self.jobs.get(job_id)
+        if job is None:
+            resp.status = falcon.HTTP_NOT_FOUND
+            resp.media = {"error": f"Job {job_id} not found"}
+            return
         resp.status = falcon.HTTP_OK
+        resp.media = job
+
+    @log_errors
+    async def on_post(self, req, resp, media=None):
         resp.content_type = "application/json"
-        resp.media = await self.title_service.get_title_words(title)
+        if media is None:
+            media = await req.get_media(default_when_empty={})
+        titles = media.get("titles")
+        date = media.get("date")
+        if date is not None and not DATE_RE.match(str(date)):
+            resp.status = falcon.HTTP_BAD_REQUEST
+            resp.media = {"error": "date must be formatted YYYY-MM-DD"}
+            return
+        if titles is not None and not isinstance(titles, list):
+            resp.status = falcon.HTTP_BAD_REQUEST
+            resp.media = {"error": "titles must be a list"}
+            return
+        try:
+            job = await self.jobs.submit(media.get("kind", "counts"), titles, date)
+        except ValueError as e:
+            resp.status = falcon.HTTP_BAD_REQUEST
+            resp.media = {"error": str(e)}
+            return
+        except asyncio.QueueFull:
+            resp.status = falcon.HTTP_TOO_MANY_REQUESTS
+            resp.set_header("Retry-After", "60")
+            resp.media = {"error": "Too many jobs queued, try again later"}
+            return
+        resp.status = falcon.HTTP_ACCEPTED
+        resp.location = f"/jobs/{job['id']}"
+        resp.media = job
+
+    @log_errors
+    async def on_delete(self, req, resp, job_id=None):
+        resp.content_type = "application/json"
+        job = self.jobs.cancel(job_id) if job_id is not None else None
+        if job is None:
+            resp.status = falcon.HTTP_NOT_FOUND
+            resp.media = {"error": f"Job {job_id} not found"}
+            return
+        resp.status = falcon.HTTP_OK
+        resp.media = job
+
+
+class TitleDiffResource:
+    """
+    Gets the words added, removed and changed in a title between two snapshot dates, in
+    total, per part and per changed section, with ?from=YYYY-MM-DD&to=YYYY-MM-DD
+    """
+
+    auth = {"auth_disabled": True}
+
+    def __init__(self, diff_service: DiffService):
+        self.diff_service = diff_service
+
+    @log_errors
+    async def on_get(self, req, resp, title):
+        resp.content_type = "application/json"
+        from_date = req.get_param("from")
+        to_date = req.get_param("to")
+        if not (from_date and to_date and DATE_RE.match(from_date) and DATE_RE.match(to_date)):
+            resp.status = falcon.HTTP_BAD_REQUEST
+            resp.media = {"error": "from and to dates formatted YYYY-MM-DD are required"}
+            return
+        diff = await self.diff_service.get_diff(title, from_date, to_date)
+        if "error" in diff:
+            not_found = diff.get("status_code") == 404
+            resp.status = falcon.HTTP_NOT_FOUND if not_found else falcon.HTTP_BAD_GATEWAY
+            resp.media = diff
+            return
+        resp.status = falcon.HTTP_OK
+        resp.media = diff
+
+
+class TitleHistoryResource:
+    """
+    Gets the word count of a title, or of one part with ?part=, over time. A series not
+    computed yet is started in the background and answered with 202.
+    """
+
+    auth = {"auth_disabled": True}
+
+    def __init__(self, history_service: HistoryService):
+        self.history_service = history_service
+
+    @log_errors
+    async def on_get(self, req, resp, title):
+        history = self.history_service.get_history(title)
+        resp.content_type = "application/json"
+        if history is None:
+            title_service = self.history_service.title_service
+            if await title_service.get_title_json(title) is None:
+                resp.status = falcon.HTTP_NOT_FOUND
+                resp.media = {"error": f"Title {title} not found"}
+                return
+            versions = await title_service.get_title_sections(title)
+            if not isinstance(versions, list):
+                not_found = versions.get("status_code") == 404
+                resp.status = falcon.HTTP_NOT_FOUND if not_found else falcon.HTTP_BAD_GATEWAY
+                resp.media = versions
+                return
+            self.history_service.start_history(title)
+            resp.status = falcon.HTTP_ACCEPTED
+            resp.media = {"title": title, "status": "computing"}
+            return
+
+        part = req.get_param("part")
+        if part:
+            series = part_series(history, part)
+        else:
+            series = [
+                {"date": point["date"], "word_count": point["word_count"]}
+                for point in history["series"]
+            ]
+        resp.status = falcon.HTTP_OK
+        resp.media = {
+            "title": title,
+            "part": part,
+            "computed_at": history.get("computed_at"),
+            "series": series,
+        }
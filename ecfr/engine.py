@@ -0,0 +1,51 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from ecfr import counting
+
+logger = logging.getLogger("ecfr")
+
+
+class CountEngine:
+    """
+    CountEngine runs CPU bound XML parsing and counting in a pool of worker processes so the
+    event loop keeps serving requests while large titles are being counted.
+    """
+
+    def __init__(self, max_workers: int | None = None):
+        self.max_workers = max_workers
+        self.pool: ProcessPoolExecutor | None = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Start the pool on first use so that idle processes never pay for it"""
+        if self.pool is None:
+            # spawn rather than fork: forking a process running an event loop copies its state
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            logger.info(f"Started count engine with {self.pool._max_workers} workers")
+        return self.pool
+
+    async def run(self, fn, *args):
+        """Run a picklable function in the pool and await its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_pool(), fn, *args)
+
+    async def word_count(self, xml: bytes | str) -> int:
+        return await self.run(counting.word_count, xml)
+
+    async def section_word_counts_file(self, path: str) -> dict[str, int]:
+        return await self.run(counting.section_word_counts_file, path)
+
+    async def index_title_file(self, path: str) -> dict:
+        return await self.run(counting.index_title_file, path)
+
+    def shutdown(self):
+        """Stop the workers without waiting on queued counts"""
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+            logger.info("Count engine shut down")
@@ -0,0 +1,129 @@
+import asyncio
+import contextlib
+import email.utils
+import logging
+import random
+import time
+
+import httpx
+
+from ecfr import metrics
+from ecfr.timestamps import nowUTC
+
+logger = logging.getLogger("ecfr")
+
+# Statuses that mean "try again later" rather than "this does not exist"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class Fetcher:
+    """
+    Fetcher schedules requests to the eCFR API over the shared HTTP client.
+
+    At most `concurrency` requests are in flight at once. When a host answers with 429 or a
+    5xx status, or the connection fails, every request to that host pauses for the
+    Retry-After period or an exponential backoff before the request is retried.
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        concurrency: int = 4,
+        retries: int = 3,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        self.client: httpx.AsyncClient = client
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.paused_until: dict[str, float] = {}  # host -> loop time
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        """
+        GET a URL, retrying transient failures. Returns the last response once retries are
+        exhausted so callers can report the status code; raises the last transport error if
+        no response was ever received.
+        """
+        async with self.semaphore:
+            response = await self._send(url, stream=False, **kwargs)
+        if not response.extensions.get("from_cache"):
+            metrics.UPSTREAM_BYTES.inc(metrics.endpoint_class(url), amount=len(response.content))
+        return response
+
+    @contextlib.asynccontextmanager
+    async def stream(self, url: str, **kwargs):
+        """
+        GET a URL like get() without reading the body, for streaming large documents. The
+        request holds its concurrency slot until the body has been consumed.
+        """
+        async with self.semaphore:
+            response = await self._send(url, stream=True, **kwargs)
+            try:
+                yield response
+            finally:
+                await response.aclose()
+
+    async def _send(self, url: str, stream: bool, **kwargs) -> httpx.Response:
+        host = httpx.URL(url).host
+        endpoint = metrics.endpoint_class(url)
+        attempt = 0
+        while True:
+            await self._wait_for_host(host)
+            try:
+                request = self.client.build_request("GET", url, **kwargs)
+                started = time.perf_counter()
+                response = await self.client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                if attempt >= self.retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+                logger.warning(f"Retrying {url} in {delay:.1f}s after error: {e}")
+            else:
+                # responses answered by the on-disk HTTP cache are lookups, not requests
+                from_cache = bool(response.extensions.get("from_cache"))
+                metrics.record_cache("http", from_cache)
+                if not from_cache:
+                    metrics.UPSTREAM_SECONDS.observe(
+                        time.perf_counter() - started, endpoint, str(response.status_code)
+                    )
+                if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    return response
+                delay = self._retry_after(response) or self._backoff_delay(attempt)
+                logger.warning(
+                    f"Retrying {url} in {delay:.1f}s after status {response.status_code}"
+                )
+                await response.aclose()
+            metrics.UPSTREAM_RETRIES.inc(endpoint)
+            self._pause_host(host, delay)
+            attempt += 1
+
+    async def _wait_for_host(self, host: str):
+        loop = asyncio.get_running_loop()
+        while (delay := self.paused_until.get(host, 0.0) - loop.time()) > 0:
+            await asyncio.sleep(delay)
+
+    def _pause_host(self, host: str, delay: float):
+        until = asyncio.get_running_loop().time() + delay
+        self.paused_until[host] = max(self.paused_until.get(host, 0.0), until)
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff with a little jitter so retries do not arrive in lockstep"""
+        delay = min(self.backoff * 2**attempt, self.max_backoff)
+        return delay + random.uniform(0, delay / 10)
+
+    def _retry_after(self, response: httpx.Response) -> float | None:
+        """Seconds to wait from a Retry-After header in either delta-seconds or HTTP-date form"""
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = (email.utils.parsedate_to_datetime(value) - nowUTC()).total_seconds()
+            except (TypeError, ValueError):
+                return None
+        return min(max(delay, 0.0), self.max_backoff)
@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import logging
+
+from ecfr import urls
+from ecfr.services import TitleService
+from ecfr.tasks import active_tasks
+from ecfr.timestamps import nowIso8601
+
+logger = logging.getLogger("ecfr")
+
+
+class HistoryService:
+    """
+    HistoryService computes and stores the word count of each title over time.
+
+    The amendment dates of a title come from its content versions. At each date only the
+    parts with a version on that date are downloaded and counted; every other part keeps its
+    count from the previous date. Part documents are identified by content hash so a part
+    whose text is unchanged, such as one amended and later restored, is never parsed twice.
+    Series are persisted under `history/{title}` and extended with new dates when a refresh
+    recounts their title.
+    """
+
+    def __init__(self, title_service: TitleService):
+        self.title_service = title_service
+        self.cache = title_service.cache
+        self.tasks: dict[str, asyncio.Task] = {}  # title -> in-flight computation
+
+    def get_history(self, title):
+        """The stored series for a title, None if it has not been computed"""
+        return self.cache.get(f"history/{title}")
+
+    def start_history(self, title) -> asyncio.Task:
+        """Start computing a title's series in the background, or return the running task"""
+        title = str(title)
+        task = self.tasks.get(title)
+        if task is None or task.done():
+            task = asyncio.create_task(self.compute_history(title))
+            self.tasks[title] = task
+            active_tasks.add(task)
+
+            def history_done(t):
+                active_tasks.discard(t)
+                if self.tasks.get(title) is t:
+                    del self.tasks[title]
+
+            task.add_done_callback(history_done)
+        return task
+
+    async def extend_histories(self, titles) -> list[str]:
+        """
+        Extend the stored series of the given titles with the dates amended since, returning
+        the titles extended. Titles without a series are left until one is requested.
+        """
+        titles = [str(title) for title in titles if self.get_history(title) is not None]
+        histories = await asyncio.gather(
+            *[asyncio.shield(self.start_history(title)) for title in titles]
+        )
+        return [title for title, history in zip(titles, histories) if history is not None]
+
+    async def compute_history(self, title):
+        """Compute or extend the series for a title and persist it"""
+        versions = await self.title_service.get_title_sections(title)
+        if not isinstance(versions, list):
+            logger.error(f"No versions for title {title}, cannot compute history")
+            return None
+
+        history = self.get_history(title) or {"title": title, "series": [], "parts": {}}
+        last_date = history["series"][-1]["date"] if history["series"] else ""
+        changes = amendment_dates(versions, after=last_date)
+        if not changes:
+            return history
+
+        pairs = [(date, part) for date, parts in changes.items() for part in parts]
+        logger.info(
+            f"Title {title} history counting {len(pairs)} part versions on {len(changes)} dates"
+        )
+        counts = await asyncio.gather(
+            *[self.get_part_count(title, date, part) for date, part in pairs]
+        )
+        if any(count is None for count in counts):
+            logger.error(f"Title {title} history incomplete, will retry on next request")
+            return None
+        part_counts = dict(zip(pairs, counts))
+
+        parts = history["parts"]
+        for date, changed in changes.items():
+            for part in changed:
+                parts[part] = part_counts[(date, part)]
+            history["series"].append(
+                {
+                    "date": date,
+                    "word_count": sum(parts.values()),
+                    "parts": {part: parts[part] for part in changed},
+                }
+            )
+        history["computed_at"] = nowIso8601()
+        self.cache[f"history/{title}"] = history
+        return history
+
+    async def get_part_count(self, title, date, part) -> int | None:
+        """Word count of one part of a title on a date, None if it could not be retrieved"""
+        hash_key = f"part-hash/{title}/{date}/{part}"
+        digest = self.cache.get(hash_key)
+        if digest is not None and f"hash-counts/{digest}" in self.cache:
+            return self.cache[f"hash-counts/{digest}"]
+
+        url = f"{urls.VRSN_URL}/full/{date}/title-{title}.xml"
+        response = await self.title_service.fetcher.get(url, params={"part": part})
+        if response.status_code == 404:
+            return 0  # part removed or reserved on this date
+        if response.status_code != 200:
+            logger.error(f"Failed to retrieve {url} part {part}: {response.status_code}")
+            return None
+
+        digest = hashlib.sha256(response.content).hexdigest()
+        self.cache[hash_key] = digest
+        count_key = f"hash-counts/{digest}"
+        if count_key in self.cache:
+            return self.cache[count_key]
+        count = await self.title_service.engine.word_count(response.content)
+        self.cache[count_key] = count
+        return count
+
+
+def amendment_dates(versions: list[dict], after: str = "") -> dict[str, list[str]]:
+    """The parts with a version on each date later than after, in date order"""
+    changes: dict[str, set[str]] = {}
+    for version in versions:
+        date, part = version.get("date"), version.get("part")
+        if date and part and date > after:
+            changes.setdefault(date, set()).add(part)
+    return {date: sorted(changes[date]) for date in sorted(changes)}
+
+
+def part_series(history: dict, part: str) -> list[dict]:
+    """The word count of one part at each date it changed"""
+    return [
+        {"date": point["date"], "word_count": point["parts"][part]}
+        for point in history["series"]
+        if part in point["parts"]
+    ]
@@ -0,0 +1,342 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+from ecfr.services import TitleService
+from ecfr.tasks import active_tasks, fetched_bytes
+from ecfr.timestamps import nowIso8601
+
+logger = logging.getLogger("ecfr")
+
+# counts: word count of each title, as of date when given
+# sections: word count of every version of every section of each title
+# populate: version lists of each title
+JOB_KINDS = ("counts", "sections", "populate")
+
+JOBS_KEY = "jobs"  # ids of the jobs kept in the store, oldest first
+KEEP_JOBS = 100  # finished jobs kept for status queries
+
+PENDING = ("queued", "running")
+
+# Seconds a running job stays claimed by its runner without a renewal, and how often the
+# runner renews it
+JOB_LEASE = 30.0
+LEASE_RENEWAL = JOB_LEASE / 3
+
+
+def job_key(job_id: str) -> str:
+    return f"jobs/{job_id}"
+
+
+def cancel_key(job_id: str) -> str:
+    return f"jobs/{job_id}/cancel"
+
+
+def lease_key(job_id: str) -> str:
+    return f"jobs/{job_id}/lease"
+
+
+class JobManager:
+    """
+    JobManager runs long recounts and cache population in the background so requests
+    return at once with a job id to poll instead of holding a connection open.
+
+    Every process accepts jobs, but only the one that called start() runs them, so with
+    several workers sharing a store followers persist the jobs they are sent and the leader
+    pulls them from the store. At most `max_queued` jobs wait and at most `concurrency` run
+    at once; within a job the titles are processed concurrently up to the fetcher's limit.
+
+    Each job is persisted under `jobs/{id}` and written only by its runner as every title
+    completes, so status can be read from any worker process. The runner holds a lease under
+    `jobs/{id}/lease`, renewed while the job runs, and a job whose runner is gone resumes
+    with the titles it had not finished once its lease runs out. Cancellation is a separate
+    `jobs/{id}/cancel` key that any process may set and the runner checks between titles,
+    or acts on at once when the job runs in the same process.
+    """
+
+    def __init__(self, title_service: TitleService, concurrency: int = 1, max_queued: int = 16):
+        self.title_service = title_service
+        self.cache = title_service.cache
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.queued: set[str] = set()  # job ids on the queue of this process
+        self.running: dict[str, asyncio.Task] = {}  # job id -> task running it here
+        self.workers: list[asyncio.Task] = []
+
+    def start(self, poll_interval: float | None = None):
+        """
+        Start the workers taking jobs off the queue and, with poll_interval, a task queueing
+        the jobs other processes submit every poll_interval seconds
+        """
+        if self.workers:
+            return
+        workers = [self.work() for _ in range(self.concurrency)]
+        if poll_interval:
+            workers.append(self.poll(poll_interval))
+        for coroutine in workers:
+            worker = asyncio.create_task(coroutine)
+            self.workers.append(worker)
+            active_tasks.add(worker)
+            worker.add_done_callback(active_tasks.discard)
+
+    async def poll(self, interval: float):
+        while True:
+            self.resume()
+            await asyncio.sleep(interval)
+
+    def pending(self) -> list[dict]:
+        """The stored jobs queued or running"""
+        jobs = [self.cache.get(job_key(job_id)) for job_id in self.cache.get(JOBS_KEY, [])]
+        return [job for job in jobs if job is not None and job["status"] in PENDING]
+
+    def resume(self) -> list[str]:
+        """
+        Queue the pending jobs no live runner holds: those submitted to other processes and
+        those left running by a runner whose lease ran out
+        """
+        now = time.time()
+        resumed = []
+        for job in self.pending():
+            job_id = job["id"]
+            if job_id in self.queued or job_id in self.running:
+                continue
+            if job["status"] == "running" and self.cache.get(lease_key(job_id), 0) > now:
+                continue
+            self.queued.add(job_id)
+            self.queue.put_nowait(job_id)
+            resumed.append(job_id)
+        if resumed:
+            logger.info(f"Resumed {len(resumed)} jobs")
+        return resumed
+
+    async def submit(self, kind: str, titles: list[str] | None = None, date=None) -> dict:
+        """
+        Queue a job over the given titles, all titles when none are given. Raises ValueError
+        for an unknown kind and asyncio.QueueFull when the queue is full.
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"kind must be one of {', '.join(JOB_KINDS)}")
+        if date is not None and kind != "counts":
+            raise ValueError("date only applies to counts jobs")
+        if sum(job["status"] == "queued" for job in self.pending()) >= self.max_queued:
+            raise asyncio.QueueFull()
+        if not titles:
+            titles_json = await self.title_service.get_titles()
+            if not isinstance(titles_json, list):
+                raise RuntimeError("Failed to retrieve titles")
+            titles = [str(title_json["number"]) for title_json in titles_json]
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "titles": [str(title) for title in dict.fromkeys(titles)],
+            "date": date,
+            "status": "queued",
+            "created_at": nowIso8601(),
+            "started_at": None,
+            "finished_at": None,
+            "completed": [],
+            "failed": [],
+            "results": {},
+            "bytes_fetched": 0,
+            "elapsed_seconds": 0.0,
+            "runner": None,
+            "error": None,
+        }
+        self.cache[job_key(job["id"])] = job
+        self._remember(job["id"])
+        if self.workers:
+            self.queued.add(job["id"])
+            self.queue.put_nowait(job["id"])
+        return self.describe(job)
+
+    def get(self, job_id: str) -> dict | None:
+        job = self.cache.get(job_key(job_id))
+        return self.describe(job) if job is not None else None
+
+    def list(self) -> list[dict]:
+        jobs = [self.cache.get(job_key(job_id)) for job_id in self.cache.get(JOBS_KEY, [])]
+        return [self.describe(job) for job in jobs if job is not None]
+
+    def describe(self, job: dict) -> dict:
+        return describe(job, cancel_key(job["id"]) in self.cache)
+
+    def cancel(self, job_id: str) -> dict | None:
+        """Cancel a queued or running job, None if there is no such job"""
+        key = job_key(job_id)
+        job = self.cache.get(key)
+        if job is None:
+            return None
+        if job["status"] in PENDING:
+            self.cache[cancel_key(job_id)] = True
+            if job["status"] == "queued":
+                # not written by a runner yet, one taking it now sees the cancel key
+                job["status"] = "cancelled"
+                job["finished_at"] = nowIso8601()
+                self.cache[key] = job
+            task = self.running.get(job_id)
+            if task is not None:
+                task.cancel()
+        return self.describe(job)
+
+    async def work(self):
+        while True:
+            job_id = await self.queue.get()
+            self.queued.discard(job_id)
+            try:
+                job = self.cache.get(job_key(job_id))
+                if job is None or job["status"] not in PENDING:
+                    continue  # cancelled while queued
+                if cancel_key(job_id) in self.cache:
+                    self.finish_cancelled(job)
+                    continue
+                task = asyncio.create_task(self.run(job))
+                self.running[job_id] = task
+                active_tasks.add(task)
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    if asyncio.current_task().cancelling():
+                        raise  # shutting down, the job resumes on restart
+                finally:
+                    active_tasks.discard(task)
+                    self.running.pop(job_id, None)
+            finally:
+                self.queue.task_done()
+
+    async def run(self, job: dict):
+        key = job_key(job["id"])
+        this = asyncio.current_task()
+        job["status"] = "running"
+        job["started_at"] = job["started_at"] or nowIso8601()
+        job["runner"] = os.getpid()
+        self.cache[lease_key(job["id"])] = time.time() + JOB_LEASE
+        self.cache[key] = job
+        lease = asyncio.create_task(self.renew_lease(job["id"]))
+        done = set(job["completed"]) | set(job["failed"])
+        remaining = [title for title in job["titles"] if title not in done]
+        counter = [0]
+        fetched_bytes.set(counter)
+        started = time.monotonic()
+        previous_bytes = job["bytes_fetched"]
+        previous_elapsed = job["elapsed_seconds"]
+        logger.info(f"Job {job['id']} {job['kind']} running over {len(remaining)} titles")
+
+        def record(update):
+            """Apply update to the job and store it, stopping the job when it was cancelled"""
+            if cancel_key(job["id"]) in self.cache:
+                this.cancel()
+                return
+            update(job)
+            job["bytes_fetched"] = previous_bytes + counter[0]
+            job["elapsed_seconds"] = round(previous_elapsed + time.monotonic() - started, 3)
+            self.cache[key] = job
+
+        async def process(title):
+            try:
+                result = await self.process_title(job, title)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job['id']} failed on title {title}: {e}", exc_info=True)
+                result = {"error": str(e)}
+
+            def update(job):
+                if "error" in result:
+                    job["failed"].append(title)
+                else:
+                    job["completed"].append(title)
+                job["results"][title] = result
+
+            record(update)
+
+        try:
+            await asyncio.gather(*[process(title) for title in remaining])
+            if cancel_key(job["id"]) in self.cache:
+                raise asyncio.CancelledError()
+            if job["kind"] == "counts" and job["date"] is None:
+                # the aggregate served by /title-counts picks up the recounted titles
+                self.title_service.update_title_counts(
+                    [
+                        {"title": title, **result}
+                        for title, result in job["results"].items()
+                        if "error" not in result
+                    ]
+                )
+            job["status"] = "failed" if job["failed"] else "completed"
+            job["finished_at"] = nowIso8601()
+            self.cache[key] = job
+            logger.info(f"Job {job['id']} {job['status']}")
+        except asyncio.CancelledError:
+            if cancel_key(job["id"]) in self.cache:
+                job["bytes_fetched"] = previous_bytes + counter[0]
+                self.finish_cancelled(job)
+            raise
+        finally:
+            lease.cancel()
+            # a job interrupted by a shutdown is free for the next runner at once
+            self.cache.pop(lease_key(job["id"]), None)
+
+    async def renew_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(LEASE_RENEWAL)
+            self.cache[lease_key(job_id)] = time.time() + JOB_LEASE
+
+    def finish_cancelled(self, job: dict):
+        job["status"] = "cancelled"
+        job["finished_at"] = nowIso8601()
+        self.cache[job_key(job["id"])] = job
+        logger.info(f"Job {job['id']} cancelled")
+
+    async def process_title(self, job: dict, title: str) -> dict:
+        if job["kind"] == "counts":
+            count = await self.title_service.get_title_words(title, job["date"])
+            if "error" in count:
+                return {"error": count["error"], "status_code": count.get("status_code")}
+            return {"word_count": count["word_count"]}
+        if job["kind"] == "sections":
+            counts = await self.title_service.get_title_word_count_by_sections(title)
+            return {"word_count": counts["word_count"], "sections": len(counts["sections"])}
+        versions = await self.title_service.get_title_sections(title)
+        if not isinstance(versions, list):
+            return {"error": versions["error"], "status_code": versions.get("status_code")}
+        return {"versions": len(versions)}
+
+    def _remember(self, job_id: str):
+        """Add a job to the index, dropping the oldest finished jobs beyond KEEP_JOBS"""
+        job_ids = [*self.cache.get(JOBS_KEY, []), job_id]
+        while len(job_ids) > KEEP_JOBS:
+            oldest = next(
+                (
+                    old
+                    for old in job_ids
+                    if (self.cache.get(job_key(old)) or {}).get("status") not in PENDING
+                ),
+                None,
+            )
+            if oldest is None:
+                break
+            job_ids.remove(oldest)
+            self.cache.pop(job_key(oldest), None)
+            self.cache.pop(cancel_key(oldest), None)
+        self.cache[JOBS_KEY] = job_ids
+
+
+def describe(job: dict, cancel_requested: bool = False) -> dict:
+    """A job with its progress and estimated seconds remaining"""
+    done = len(job["completed"]) + len(job["failed"])
+    total = len(job["titles"])
+    eta = None
+    if job["status"] == "running" and done:
+        eta = round(job["elapsed_seconds"] / done * (total - done), 1)
+    return {
+        **job,
+        "cancel_requested": cancel_requested,
+        "total": total,
+        "done": done,
+        "percent": round(100.0 * done / total, 1) if total else 100.0,
+        "eta_seconds": eta,
+    }
@@ -0,0 +1,55 @@
+import asyncio
+import fcntl
+import logging
+import os
+
+logger = logging.getLogger("ecfr")
+
+
+class LeaderElection:
+    """
+    LeaderElection picks the one worker process that runs background jobs when several
+    workers serve from the same store.
+
+    The leader is whichever process holds an exclusive flock on the lock file. The lock is
+    released by the kernel when its holder exits for any reason, so a follower polling the
+    lock takes over the jobs after a crash without any lease to expire.
+    """
+
+    def __init__(self, path: str, interval: float = 5.0):
+        self.path = path
+        self.interval = interval
+        self.file = None
+
+    @property
+    def leader(self) -> bool:
+        return self.file is not None
+
+    def try_acquire(self) -> bool:
+        """Take the lock if no other process holds it, without blocking"""
+        if self.file is not None:
+            return True
+        f = open(self.path, "a+")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        f.truncate(0)
+        f.write(f"{os.getpid()}\n")
+        f.flush()
+        self.file = f
+        logger.info(f"Process {os.getpid()} elected to run background jobs")
+        return True
+
+    async def run(self, lead):
+        """Poll for the lock until this process holds it, then await lead()"""
+        while not self.try_acquire():
+            await asyncio.sleep(self.interval)
+        await lead()
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
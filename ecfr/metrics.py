@@ -0,0 +1,249 @@
+import bisect
+import re
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+
+from ecfr.tasks import active_tasks
+
+# Latency buckets in seconds, from a cached lookup to a full title download
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# eCFR API URL classes, so labels stay bounded however many titles and dates are fetched
+ENDPOINT_CLASSES = [
+    (re.compile(r"/titles\.json$"), "titles"),
+    (re.compile(r"/agencies\.json$"), "agencies"),
+    (re.compile(r"/versions/"), "versions"),
+    (re.compile(r"/full/"), "full"),
+    (re.compile(r"/search/"), "search"),
+]
+
+
+class Metric(ABC):
+    """A named family of samples, one per combination of label values"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    def _label_text(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    @abstractmethod
+    def samples(self) -> list[str]:
+        """The exposition lines of the family, without its HELP and TYPE lines"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *values: str, amount: float = 1):
+        self.values[values] = self.values.get(values, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{self._label_text(values)} {_number(value)}"
+            for values, value in sorted(self.values.items())
+        ]
+
+
+class Gauge(Metric):
+    """A value read when the metrics are rendered"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.read = read
+
+    def samples(self) -> list[str]:
+        return [f"{self.name} {_number(self.read())}"]
+
+
+class Collector(Metric):
+    """Samples by one label, read from a callable returning {label value: sample}"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label: str,
+        read: Callable[[], dict],
+        type: str = "counter",
+    ):
+        super().__init__(name, documentation, (label,))
+        self.read = read
+        self.type = type
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{self._label_text((value,))} {_number(sample)}"
+            for value, sample in sorted(self.read().items())
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # label values -> [count per bucket plus +Inf, sum]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *values: str):
+        series = self.values.get(values)
+        if series is None:
+            series = self.values[values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self) -> list[str]:
+        lines = []
+        for values, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = bound if isinstance(bound, str) else _number(bound)
+                labels = self._label_text(values, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(values)} {_number(total)}")
+            lines.append(f"{self.name}_count{self._label_text(values)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The metrics of the process, rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def endpoint_class(url) -> str:
+    path = str(url)
+    for pattern, name in ENDPOINT_CLASSES:
+        if pattern.search(path):
+            return name
+    return "other"
+
+
+def key_class(key: str) -> str:
+    """The kind of a cache key, such as title-word-counts for title-word-counts/40"""
+    return str(key).split("/", 1)[0]
+
+
+REGISTRY = Registry()
+
+UPSTREAM_SECONDS = REGISTRY.register(
+    Histogram(
+        "ecfr_upstream_request_seconds",
+        "eCFR API request latency until the response headers arrive",
+        ("endpoint", "status"),
+    )
+)
+UPSTREAM_BYTES = REGISTRY.register(
+    Counter(
+        "ecfr_upstream_bytes_total", "Response bytes received from the eCFR API", ("endpoint",)
+    )
+)
+UPSTREAM_RETRIES = REGISTRY.register(
+    Counter("ecfr_upstream_retries_total", "eCFR API requests retried", ("endpoint",))
+)
+CACHE_LOOKUPS = REGISTRY.register(
+    Counter("ecfr_cache_lookups_total", "Cache lookups by key class", ("key_class", "result"))
+)
+PARSE_SECONDS = REGISTRY.register(
+    Histogram(
+        "ecfr_parse_seconds",
+        "Time to parse and index a title XML document in the count engine",
+        ("title", "kind"),
+    )
+)
+IN_FLIGHT_TASKS = REGISTRY.register(
+    Gauge("ecfr_in_flight_tasks", "Background tasks running", lambda: len(active_tasks))
+)
+REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "ecfr_request_seconds",
+        "Request latency by route",
+        ("method", "route", "status"),
+    )
+)
+
+
+def register_memory_tier(tier, registry: Registry = REGISTRY):
+    """Expose the lookups, evictions and size of an in-process cache tier"""
+    events = ("hits", "misses", "evictions", "rejected")
+    registry.register(
+        Collector(
+            "ecfr_memory_cache_events_total",
+            "In-process cache tier hits, misses, evictions and values not admitted",
+            "event",
+            lambda: {event: tier.stats()[event] for event in events},
+        )
+    )
+    registry.register(
+        Gauge(
+            "ecfr_memory_cache_bytes", "Bytes held by the in-process cache tier", lambda: tier.bytes
+        )
+    )
+
+
+def record_cache(key: str, hit: bool):
+    CACHE_LOOKUPS.inc(key_class(key), "hit" if hit else "miss")
+
+
+class MetricsMiddleware:
+    """Times every request by route template so labels stay bounded"""
+
+    async def process_request(self, req, resp):
+        req.context.metrics_started = time.perf_counter()
+
+    async def process_response(self, req, resp, resource, req_succeeded):
+        started = getattr(req.context, "metrics_started", None)
+        if started is None:
+            return
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            req.method,
+            req.uri_template or "unrouted",
+            str(resp.status_code),
+        )
@@ -0,0 +1,122 @@
+import gzip
+import hashlib
+import json
+import uuid
+from collections.abc import MutableMapping
+
+import falcon
+
+# Changes on every invalidation in any process sharing the store
+SHARED_GENERATION_KEY = "response-generation"
+
+
+class CachedResponse:
+    """
+    A JSON response body serialized and compressed once, with a strong ETag for each of its
+    two encodings
+    """
+
+    def __init__(self, media):
+        self.body = json.dumps(media, separators=(",", ":")).encode()
+        self.gzip_body = gzip.compress(self.body, compresslevel=6, mtime=0)
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+        self.shared_generation = None
+
+
+class ResponseCache:
+    """
+    ResponseCache holds pre-serialized JSON for read endpoints whose data only changes when a
+    count or refresh runs. Entries are built on the first read after they are invalidated and
+    served as bytes from memory with an ETag, answering a matching If-None-Match with 304.
+
+    When several worker processes serve from one store, pass it as shared. Every
+    invalidation then writes a new token to the store and each process drops its entries
+    once it sees a token other than the one its entries were built under.
+    """
+
+    def __init__(self, shared: MutableMapping | None = None):
+        self.entries: dict[str, CachedResponse] = {}
+        self.shared = shared
+        self.local_generation = 0  # bumped on every invalidation in this process
+
+    @property
+    def generation(self):
+        """Read before computing an entry and passed to put to detect invalidations"""
+        if self.shared is None:
+            return self.local_generation
+        return self.local_generation, self.shared.get(SHARED_GENERATION_KEY)
+
+    def get(self, name: str) -> CachedResponse | None:
+        entry = self.entries.get(name)
+        if entry is not None and self.shared is not None:
+            if entry.shared_generation != self.shared.get(SHARED_GENERATION_KEY):
+                self.entries.clear()
+                return None
+        return entry
+
+    def put(self, name: str, media, generation: int | None = None) -> CachedResponse:
+        """
+        Serialize media for name. When generation is given and an invalidation happened since
+        it was read, the data may already be stale so the entry is returned but not kept.
+        """
+        entry = CachedResponse(media)
+        current = self.generation
+        if generation is None or generation == current:
+            if self.shared is not None:
+                entry.shared_generation = current[1]
+            self.entries[name] = entry
+        return entry
+
+    def invalidate(self, *names: str):
+        self.local_generation += 1
+        for name in names:
+            self.entries.pop(name, None)
+        if self.shared is not None:
+            self.shared[SHARED_GENERATION_KEY] = uuid.uuid4().hex
+
+    @staticmethod
+    def respond(req: falcon.Request, resp: falcon.Response, entry: CachedResponse):
+        """Send a cached response, 304 when the client already has it"""
+        compressed = accepts_gzip(req.get_header("Accept-Encoding"))
+        etag = entry.gzip_etag if compressed else entry.etag
+        resp.set_header("ETag", etag)
+        resp.set_header("Cache-Control", "public, no-cache")
+        resp.set_header("Vary", "Accept-Encoding")
+        if_none_match = req.get_header("If-None-Match") or ""
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in tags or "*" in tags:
+            resp.status = falcon.HTTP_NOT_MODIFIED
+            return
+
+        resp.status = falcon.HTTP_OK
+        resp.content_type = "application/json"
+        if compressed:
+            resp.set_header("Content-Encoding", "gzip")
+            resp.data = entry.gzip_body
+        else:
+            resp.data = entry.body
+
+
+def accepts_gzip(accept_encoding: str | None) -> bool:
+    """
+    Whether an Accept-Encoding header allows gzip: listed, or covered by *, with a
+    non-zero q-value
+    """
+    qualities = {}
+    for coding in (accept_encoding or "").split(","):
+        name, *params = (part.strip() for part in coding.split(";"))
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.lower()] = quality
+    for name in ("gzip", "x-gzip", "*"):
+        if name in qualities:
+            return qualities[name] > 0
+    return False
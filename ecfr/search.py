@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+
+from ecfr.counting import CHUNK_SIZE, SectionIndexer
+from ecfr.services import TitleService
+
+logger = logging.getLogger("ecfr")
+
+MAX_PER_PAGE = 100
+
+# Sections written per executemany while indexing a title
+INSERT_BATCH = 500
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS indexed_titles ("
+    "title TEXT PRIMARY KEY, date TEXT NOT NULL, digest TEXT NOT NULL, "
+    "sections INTEGER NOT NULL)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS sections USING fts5("
+    "title UNINDEXED, part UNINDEXED, subpart UNINDEXED, section UNINDEXED, heading, text, "
+    "tokenize = 'porter unicode61')",
+]
+
+
+class SectionTextExtractor(SectionIndexer):
+    """
+    Extracts the heading and text of every section of a full title document in one pass.
+
+    Elements inside a section are kept until the section closes so its text can be read in
+    document order, then dropped like everywhere else, so memory is bounded by the largest
+    section rather than the document. Completed sections collect in `completed` as
+    (part, subpart, section, heading, text) and are taken by the caller between feeds.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.completed: list[tuple[str, str, str, str, str]] = []
+
+    def close(self) -> list[tuple[str, str, str, str, str]]:
+        self.parser.close()
+        self._drain()
+        return self.take()
+
+    def take(self) -> list[tuple[str, str, str, str, str]]:
+        completed, self.completed = self.completed, []
+        return completed
+
+    def _drain(self):
+        for event, elem in self.parser.read_events():
+            div = self._div(elem)
+            if event == "start":
+                if div:
+                    self.path.append(div)
+                continue
+            if div and div[0] in self.SECTION_TYPES:
+                part, subpart, section = self._section_key().split("/", 2)
+                heading = elem.findtext("HEAD") or ""
+                self.completed.append(
+                    (part, subpart, section, " ".join(heading.split()), _text(elem))
+                )
+                # an enclosing section must not index this text a second time
+                elem.clear(keep_tail=True)
+            if div:
+                self.path.pop()
+            if self._section_key() is None:
+                # outside any section, where no text is read in document order
+                del elem[:]
+                self._drop_previous(elem)
+
+
+def _text(elem) -> str:
+    return " ".join(" ".join(elem.itertext()).split())
+
+
+def connect(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("PRAGMA busy_timeout=30000")
+    with db:
+        for statement in SCHEMA:
+            db.execute(statement)
+    return db
+
+
+def index_title_file(
+    db_path: str, title: str, date: str, digest: str, path: str, chunk_size: int = CHUNK_SIZE
+) -> int:
+    """
+    Replace the indexed sections of a title with those of a full title XML file. Runs in a
+    count engine worker, which writes to the index directly so section text never crosses
+    back to the server process. Returns the number of sections indexed.
+    """
+    db = connect(db_path)
+    extractor = SectionTextExtractor()
+    indexed = 0
+    try:
+        with db:
+            db.execute("DELETE FROM sections WHERE title = ?", (title,))
+            with open(path, "rb") as f:
+                while chunk := f.read(chunk_size):
+                    extractor.feed(chunk)
+                    if len(extractor.completed) >= INSERT_BATCH:
+                        indexed += _insert(db, title, extractor.take())
+            indexed += _insert(db, title, extractor.close())
+            db.execute(
+                "INSERT OR REPLACE INTO indexed_titles (title, date, digest, sections) "
+                "VALUES (?, ?, ?, ?)",
+                (title, date, digest, indexed),
+            )
+    finally:
+        db.close()
+    return indexed
+
+
+def _insert(db: sqlite3.Connection, title: str, sections: list[tuple]) -> int:
+    db.executemany(
+        "INSERT INTO sections (title, part, subpart, section, heading, text) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [(title, *section) for section in sections],
+    )
+    return len(sections)
+
+
+class SearchService:
+    """
+    SearchService answers full text queries from a local SQLite FTS5 index of every section
+    of every title, so searches neither wait on nor count against the rate limited eCFR
+    search API and keep working offline.
+
+    The index is built from the full title documents already downloaded for word counts.
+    Each title records the digest of the document it was built from and is only reindexed
+    when the latest counted document of the title changes. Queries run in worker threads,
+    each reading through a connection of its own, so a slow query never blocks the event
+    loop.
+    """
+
+    def __init__(self, title_service: TitleService, path: str):
+        self.title_service = title_service
+        self.cache = title_service.cache
+        self.path = path
+        self.db = connect(path)
+        self.local = threading.local()
+        self.readers: list[sqlite3.Connection] = []
+        self.readers_lock = threading.Lock()
+
+    def indexed_digests(self) -> dict[str, str]:
+        rows = self.db.execute("SELECT title, digest FROM indexed_titles").fetchall()
+        return dict(rows)
+
+    async def update_index(self, progress=None) -> dict:
+        """
+        Index every counted title whose document changed since it was last indexed. Titles
+        are indexed one at a time so a single writer holds the index at once. progress, when
+        given, is called with each title checked.
+        """
+        titles = await self.title_service.get_titles()
+        if not isinstance(titles, list):
+            return {"error": "Failed to retrieve titles"}
+        indexed = self.indexed_digests()
+        updated = []
+        for title_json in titles:
+            title = str(title_json["number"])
+            marker = self.cache.get(f"title-processed/{title}")
+            if marker is not None:
+                document_key = f"document/{title}/{marker['date']}"
+                path = self.title_service.document_path(document_key)
+                digest = self.cache.get(document_key)
+                if path is not None and indexed.get(title) != digest:
+                    sections = await self.title_service.engine.run(
+                        index_title_file, self.path, title, marker["date"], digest, path
+                    )
+                    logger.info(f"Indexed {sections} sections of title {title} for search")
+                    updated.append(title)
+            if progress is not None:
+                progress(title)
+        return {"updated": updated, "unchanged": len(titles) - len(updated)}
+
+    async def search(self, query: str, page: int = 1, per_page: int = 20) -> dict:
+        """
+        One page of the sections matching an FTS5 query, best match first, with the total
+        number of matching sections and the number in each title. Raises ValueError for a
+        query FTS5 cannot parse.
+        """
+        return await asyncio.to_thread(self._search, query, page, per_page)
+
+    def reader(self) -> sqlite3.Connection:
+        """The read connection of the calling thread"""
+        db = getattr(self.local, "db", None)
+        if db is None:
+            # only ever used by this thread, closed from the event loop's thread in close()
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA busy_timeout=30000")
+            self.local.db = db
+            with self.readers_lock:
+                self.readers.append(db)
+        return db
+
+    def _search(self, query: str, page: int, per_page: int) -> dict:
+        per_page = max(1, min(per_page, MAX_PER_PAGE))
+        page = max(1, page)
+        db = self.reader()
+        try:
+            by_title = db.execute(
+                "SELECT title, count(*) FROM sections WHERE sections MATCH ? GROUP BY title",
+                (query,),
+            ).fetchall()
+            rows = db.execute(
+                "SELECT title, part, subpart, section, heading, "
+                "snippet(sections, 5, '<mark>', '</mark>', '...', 24) "
+                "FROM sections WHERE sections MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+                (query, per_page, (page - 1) * per_page),
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError(f"Invalid search query: {e}") from e
+
+        hits = {title: count for title, count in by_title}
+        return {
+            "query": query,
+            "total": sum(hits.values()),
+            "page": page,
+            "per_page": per_page,
+            "titles": dict(sorted(hits.items(), key=lambda item: _title_order(item[0]))),
+            "results": [
+                {
+                    "title": title,
+                    "part": part,
+                    "subpart": subpart,
+                    "section": section,
+                    "heading": heading,
+                    "snippet": snippet,
+                }
+                for title, part, subpart, section, heading, snippet in rows
+            ],
+        }
+
+    def close(self):
+        with self.readers_lock:
+            for db in self.readers:
+                db.close()
+            self.readers = []
+        self.db.close()
+
+
+def _title_order(title: str):
+    return (0, int(title), "") if title.isdigit() else (1, 0, title)
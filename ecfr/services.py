@@ -1,18 +1,21 @@
 import asyncio
-import json
 import logging
-import re
-import shelve
-from shelve import DbfilenameShelf
-
-import httpx
-from lxml import etree
+import time
+from collections.abc import MutableMapping
 
 from ecfr import urls
-from main import active_tasks
+from ecfr.blobs import COLLECT_GRACE, BlobStore
+from ecfr.engine import CountEngine
+from ecfr.fetch import Fetcher
+from ecfr.metrics import CACHE_LOOKUPS, PARSE_SECONDS, record_cache
+from ecfr.responses import ResponseCache
+from ecfr.store import get_many, items_with_prefix
+from ecfr.tasks import active_tasks
+from ecfr.timestamps import nowIso8601
 
 logger = logging.getLogger("ecfr")
 
+# Fallback snapshot date for titles missing from titles.json
 TITLE_DATE = "2025-03-31"
 
 
@@ -23,39 +26,43 @@ class TitleService:
 
     TITLES_KEY = "titles"
 
-    def __init__(self, client: httpx.AsyncClient, cache: shelve.Shelf):
-        self.client: httpx.AsyncClient = client
-        self.cache: shelve.Shelf = cache
-
-    async def populate_title_sections(self):
-        """Retrieve all sections from all titles in the eCFR API and store in a local cache"""
+    def __init__(
+        self,
+        fetcher: Fetcher,
+        cache: MutableMapping,
+        engine: CountEngine,
+        blobs: BlobStore,
+        responses: ResponseCache | None = None,
+    ):
+        self.fetcher: Fetcher = fetcher
+        self.cache: MutableMapping = cache
+        self.engine: CountEngine = engine
+        self.blobs: BlobStore = blobs
+        self.responses = responses if responses is not None else ResponseCache()
+        self.refresh_lock = asyncio.Lock()
+        self.counts_task: asyncio.Task | None = None
+
+    async def populate_title_sections(self, progress=None):
+        """
+        Retrieve all sections from all titles in the eCFR API and store in a local cache.
+        progress, when given, is called with each title's versions as they are stored.
+        """
         titles_json = await self.get_titles()
 
-        for title_json in titles_json:
-            title = str(title_json["number"])
-            await self.get_title_sections(title)
-            if title not in self.cache:
-                versions_resp = await self.client.get(
-                    f"{urls.VRSN_URL}/versions/title-{title}.json"
-                )
-                if versions_resp.status_code != 200:
-                    logger.error(
-                        f"Failed to retrieve versions for title {title}: {versions_resp.status_code}"
-                    )
-                    return {
-                        "error": f"Title {title} not found or rate limited",
-                        "status_code": versions_resp.status_code,
-                    }
-
-                versions_json = versions_resp.json()
-                versions = versions_json["content_versions"]
-                self.cache[title] = versions
+        async def populate(title):
+            versions = await self.get_title_sections(title)
+            if progress is not None:
+                progress(versions)
+
+        await asyncio.gather(
+            *[populate(str(title_json["number"])) for title_json in titles_json]
+        )
         logger.info(f"Cache populated with sections for {len(titles_json)} titles")
 
     async def get_titles(self):
         """Retrieve all titles from the eCFR API and store in a local cache"""
         if self.TITLES_KEY not in self.cache:
-            titles_resp = await self.client.get(f"{urls.VRSN_URL}/titles.json")
+            titles_resp = await self.fetcher.get(f"{urls.VRSN_URL}/titles.json")
             if titles_resp.status_code != 200:
                 logger.error(f"Failed to retrieve titles: {titles_resp.status_code}")
                 return {
@@ -64,6 +71,7 @@ class TitleService:
                 }
             titles = titles_resp.json()["titles"]
             self.cache[self.TITLES_KEY] = titles
+            self.responses.invalidate("titles")
             return titles
         else:
             logger.debug(f"Cache hit for titles {self.TITLES_KEY}")
@@ -71,8 +79,9 @@ class TitleService:
 
     async def get_title_sections(self, title):
         """Retrieve all sections from a title in the eCFR API and store in a local cache"""
+        record_cache("versions", title in self.cache)
         if title not in self.cache:
-            versions_resp = await self.client.get(
+            versions_resp = await self.fetcher.get(
                 f"{urls.VRSN_URL}/versions/title-{title}.json"
             )
             if versions_resp.status_code != 200:
@@ -94,165 +103,445 @@ class TitleService:
 
     def check_version_cache(self, title, versions):
         """
-        Check version cache for each section in the title and return False if it does not exist
-        and needs to be retrieved.
+        Map each version of a section to the full title document for the version's date.
+        Returns (version_key, document_key, url, retrieve) tuples where retrieve is True when
+        the version has not been linked to a stored document yet. Many versions share a date,
+        so many versions point at the same document and URL. A linked document that has since
+        been released is downloaded again from its URL.
         """
         section_tuples = []
+        hits = 0
         for version in versions:
             title = version["title"] if version["title"] else title
             part = version["part"] if version["part"] else "-"
             subpart = version["subpart"] if version["subpart"] else "-"
             identifier = version["identifier"] if version["identifier"] else "-"
             date = version["date"] if version["date"] else "-"
-            removed = version["removed"] if version["removed"] else False
             version_key = f"{title}/{part}/{subpart}/{identifier}/{date}"
-            section_date = version["date"]
-            section_url = f"{urls.VRSN_URL}/full/{section_date}/title-{title}.xml"
-            if version_key in self.cache:
-                logger.info(f"Cache hit for {version_key}")
-                section_tuples.append((version_key, section_url, False))
+            ref_key = f"section-document/{version_key}"
+            if ref_key in self.cache:
+                logger.debug(f"Cache hit for {version_key}")
+                document_key = self.cache[ref_key]
+                section_tuples.append(
+                    (version_key, document_key, document_url(document_key), False)
+                )
+                hits += 1
+                continue
             logger.debug(f"Cache miss for {version_key}")
-            section_tuples.append((version_key, section_url, True))
+            document_key = f"document/{title}/{date}"
+            section_tuples.append((version_key, document_key, document_url(document_key), True))
+        # counted once per title rather than per version to keep the loop cheap
+        CACHE_LOOKUPS.inc("section-document", "hit", amount=hits)
+        CACHE_LOOKUPS.inc("section-document", "miss", amount=len(section_tuples) - hits)
         return section_tuples
 
-    async def get_title_counts_cached(self, cached=True):
+    async def get_title_counts_cached(self, cached=True, progress=None):
         """
-        Retrieve word counts for all titles in the eCFR API.
-        Gives a quick response with a sample response if the cache is empty.
+        Retrieve word counts for all titles in the eCFR API. Concurrent callers share one
+        in-flight computation rather than each starting their own, and a caller going away
+        does not cancel it for the others. progress is only used by the caller that starts it.
         """
-        first_run_cache_key = "first_run"
-        counts_task_name = "counts_task"
+        title_counts_key = "title-counts"
+        if cached and title_counts_key in self.cache:
+            logger.debug(f"Cache hit for {title_counts_key}")
+            return self.cache[title_counts_key]
 
-        def get_title_counts_task():
-            for task in active_tasks:
-                if hasattr(task, '_task_name') and task._task_name == counts_task_name and not task.done():
-                    return task
-                return None
+        if self.counts_task is None or self.counts_task.done():
+            logger.info("Computing title counts")
+            self.counts_task = asyncio.create_task(
+                self.get_title_counts(cached=cached, progress=progress)
+            )
+            active_tasks.add(self.counts_task)
+            self.counts_task.add_done_callback(active_tasks.discard)
+        return await asyncio.shield(self.counts_task)
 
-        if first_run_cache_key not in self.cache:
-            logger.info("First run, populating cache, giving sample response")
-
-            existing_task = get_title_counts_task()
-            if existing_task:
-                return json.loads(sample_title_counts)
-            else:
-                counts_task = asyncio.create_task(self.get_title_counts())
-                counts_task._task_name = counts_task_name
-                def first_run_done(t):
-                    logger.info("First run done")
-                    self.cache[first_run_cache_key] = True
-                    active_tasks.discard(counts_task)
-                counts_task.add_done_callback(first_run_done)
-                active_tasks.add(counts_task)
-            return json.loads(sample_title_counts)
-
-        existing_task = get_title_counts_task()
-        if existing_task:
-            return json.loads(sample_title_counts)
-        else:
-            logger.info("Cache populated, retrieving title counts")
-            counts_task = asyncio.create_task(self.get_title_counts(cached=cached))
-            counts_task._task_name = counts_task_name
-            active_tasks.add(counts_task)
-            counts = []
-            try:
-                counts = await counts_task
-            except asyncio.CancelledError:
-                logger.info("Task started during shutdown")
-                counts = []
-            finally:
-                return counts
-
-    async def get_title_counts(self, cached=True):
-        """Retrieve word counts for all titles in the eCFR API"""
+    async def get_title_counts(self, cached=True, progress=None):
+        """
+        Retrieve word counts for all titles in the eCFR API. progress, when given, is called
+        with each title's count as it completes.
+        """
         title_counts_key = "title-counts"
         if title_counts_key in self.cache and cached:
-            logger.info(f"Cache hit for {title_counts_key}")
+            logger.debug(f"Cache hit for {title_counts_key}")
             return self.cache[title_counts_key]
 
         titles_json = await self.get_titles()
         titles = [item["number"] for item in titles_json]
-        counts = [await self.get_title_words(title) for title in titles]
+
+        async def count_title(title):
+            count = await self.get_title_words(title)
+            if progress is not None:
+                progress(count)
+            return count
+
+        # Titles download concurrently up to the fetcher's limit and count as they arrive
+        counts = list(await asyncio.gather(*[count_title(title) for title in titles]))
         self.cache[title_counts_key] = counts
+        self.responses.invalidate(title_counts_key)
         return counts
 
-    async def get_title_words(self, title):
-        """Gets word count for a single title"""
-        key = f"title-counts/{title}"
-        if key in self.cache:
-            logger.info(f"Cache hit for {key}")
-            content_xml = self.cache[key]
-        else:
-            logger.info(f"Cache miss for {key}")
-            response = await self.client.get(
-                f"{urls.VRSN_URL}/full/{TITLE_DATE}/title-{title}.xml"
+    async def get_title_words(self, title, date=None, recount: bool = False):
+        """
+        Gets word count for a single title as of date, by default the title's up_to_date_as_of
+        date. For the default date it records which amendment of the title was counted so
+        refreshes can skip unchanged titles, and stores the per part counts and the text
+        analytics of the title and its parts and its hierarchy tree from the same pass.
+        With recount the document is downloaded and counted again, the stored values being
+        replaced only once that succeeds. The document of the previous snapshot, and that of
+        any other date once its count is stored, is released for collect_documents().
+        """
+        latest = date is None
+        if latest:
+            title_json = await self.get_title_json(title)
+            date = title_date(title_json)
+        count_key = title_count_key(title, None if latest else date)
+        parts_key = f"part-counts/{title}"
+        analytics_key = f"title-analytics/{title}"
+        hit = not recount and count_key in self.cache and (
+            not latest
+            or (
+                parts_key in self.cache
+                and analytics_key in self.cache
+                and hierarchy_key(title) in self.cache
             )
-            if response.status_code != 200:
-                return {
-                    "title": title,
-                    "word_count": 0,
-                    "error": f"Title {title} not found or rate limited",
-                    "status_code": response.status_code,
-                }
-            content_xml = response.text
-            self.cache[key] = content_xml
-        count_key = f"title-word-counts/{title}"
-        if count_key in self.cache:
-            logger.info(f"Cache hit for {count_key}")
+        )
+        record_cache(count_key, hit)
+        if hit:
+            logger.debug(f"Cache hit for {count_key}")
             section_count = self.cache[count_key]
+            return title_count(title, section_count, None if latest else date)
+
+        document_key = f"document/{title}/{date}"
+        status_code = await self.get_document(document_key, document_url(document_key), recount)
+        if status_code != 200:
+            return {
+                **title_count(title, 0, None if latest else date),
+                "error": f"Title {title} not found or rate limited",
+                "status_code": status_code,
+            }
+        # the file outlives its key until collected, so another caller releasing it is safe
+        path = self.document_path(document_key)
+        started = time.perf_counter()
+        index = await self.engine.index_title_file(path)
+        PARSE_SECONDS.observe(time.perf_counter() - started, str(title), "title")
+        section_count = index["word_count"]
+        self.cache[count_key] = section_count
+        if latest:
+            self.cache[parts_key] = index["parts"]
+            self.cache[analytics_key] = index["analytics"]["title"]
+            self.cache[f"part-analytics/{title}"] = index["analytics"]["parts"]
+            self.store_hierarchy(title, index["hierarchy"])
+            previous = self.cache.get(f"title-processed/{title}")
+            self.cache[f"title-processed/{title}"] = processed_marker(title_json, date)
+            self.responses.invalidate(f"title-counts/{title}")
+            if previous is not None and previous["date"] != date:
+                self.cache.pop(f"document/{title}/{previous['date']}", None)
         else:
-            section_count = word_count(content_xml)
-            self.cache[count_key] = section_count
+            self.release_document(title, date)
         logger.info(f"Title {title} has {section_count} words in total")
-        return {"title": title, "word_count": section_count}
-
-    async def get_section(self, section_tuple):
-        """Retrieve a single section from the eCFR API. Intended to be used with asyncio.gather"""
-        (key, url, retrieve) = section_tuple
-        response = await self.client.get(url, timeout=30.00)
-        if response.status_code != 200:
-            logger.error(f"Failed to retrieve {url}: {response.status_code}")
-            return None, None
-        self.cache[key] = response.text
-        logger.info(f"Put {key} in cache for {url}")
-        return key, response
+        return title_count(title, section_count, None if latest else date)
+
+    async def get_title_analytics(self, title, part=None) -> dict | None:
+        """
+        Term frequencies, keyword counts and sentence statistics of a title's latest snapshot,
+        or of one of its parts. Served from the store, counting the title first if needed.
+        None when the title or part is not found.
+        """
+        analytics_key = f"title-analytics/{title}"
+        if analytics_key not in self.cache:
+            count = await self.get_title_words(title)
+            if "error" in count:
+                return None
+        if part is None:
+            return {"title": title, **self.cache[analytics_key]}
+        analytics = self.cache.get(f"part-analytics/{title}", {}).get(str(part))
+        if analytics is None:
+            return None
+        return {"title": title, "part": str(part), **analytics}
+
+    def store_hierarchy(self, title, tree: dict):
+        """
+        Store the hierarchy tree of a title's latest snapshot as one entry per node with
+        children, replacing the previous tree. Nodes that no longer exist are removed first
+        and the root is written last, so a reader finding the root finds the whole tree.
+        """
+        entries = hierarchy_entries(title, tree)
+        for key in set(self.hierarchy_keys(title)) - entries.keys():
+            self.cache.pop(key, None)
+        for key in reversed(list(entries)):
+            self.cache[key] = entries[key]
+
+    def hierarchy_keys(self, title) -> list[str]:
+        """Keys of the stored hierarchy entries of a title, found by walking from the root"""
+        keys = []
+        pending = [()]
+        while pending:
+            path = pending.pop()
+            entry = self.cache.get(hierarchy_key(title, path))
+            if entry is None:
+                continue
+            keys.append(hierarchy_key(title, path))
+            pending.extend(
+                (*path, child["segment"]) for child in entry["children"] if child["children"]
+            )
+        return keys
+
+    async def get_hierarchy_counts(self, title, path=(), top: int | None = None) -> dict | None:
+        """
+        Word total of the node of a title's hierarchy at path, a sequence of segments such as
+        ("chapter-I", "part-52"), with its children largest first, the top ones when top is
+        given. A node is one or two store reads whatever the size of the title. The title is
+        counted first if needed. None when the title or node is not found.
+        """
+        path = tuple(path)
+        if hierarchy_key(title) not in self.cache:
+            count = await self.get_title_words(title)
+            if "error" in count:
+                return None
+        entry = self.cache.get(hierarchy_key(title, path))
+        if entry is None and path:
+            # leaves such as sections are only stored in their parent's entry
+            parent = self.cache.get(hierarchy_key(title, path[:-1])) or {"children": []}
+            child = next(
+                (child for child in parent["children"] if child["segment"] == path[-1]), None
+            )
+            if child is not None and not child["children"]:
+                entry = {**child, "children": []}
+                del entry["segment"]
+        if entry is None:
+            return None
+        children = entry["children"] if top is None else entry["children"][:top]
+        return {"title": title, "path": list(path), **entry, "children": children}
+
+    async def stream_title_counts(self, titles: list[str], date=None):
+        """
+        Yield the word count of each title as soon as it is available. Counts already stored
+        come first from a single bulk read, the rest are computed concurrently and yielded in
+        completion order so slow titles do not hold back fast ones. Closing the generator
+        early cancels the outstanding titles.
+        """
+        counts, missing = self.stored_title_counts(titles, date)
+        for count in counts:
+            yield count
+
+        tasks = [
+            asyncio.ensure_future(self.get_title_words(title, date)) for title in missing
+        ]
+        try:
+            for next_count in asyncio.as_completed(tasks):
+                yield await next_count
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stored_title_counts(self, titles: list[str], date=None) -> tuple[list[dict], list[str]]:
+        """The stored word counts of titles, from a single bulk read, and the titles missing"""
+        keys = {title: title_count_key(title, date) for title in titles}
+        stored = get_many(self.cache, keys.values())
+        counts = [
+            title_count(title, stored[keys[title]], date)
+            for title in titles
+            if keys[title] in stored
+        ]
+        return counts, [title for title in titles if keys[title] not in stored]
+
+    async def get_title_json(self, title) -> dict | None:
+        """The titles.json entry for a title, None if it is not listed"""
+        titles = await self.get_titles()
+        if not isinstance(titles, list):
+            return None
+        for title_json in titles:
+            if str(title_json["number"]) == str(title):
+                return title_json
+        return None
+
+    async def refresh_title_counts(self):
+        """
+        Re-download and recount only the titles amended since they were last counted and
+        update the aggregate title counts in place, dropping the stored version lists of the
+        recounted titles. Returns a report of what was updated.
+        """
+        async with self.refresh_lock:
+            titles_resp = await self.fetcher.get(f"{urls.VRSN_URL}/titles.json")
+            if titles_resp.status_code != 200:
+                logger.error(f"Failed to retrieve titles: {titles_resp.status_code}")
+                return {
+                    "error": "Failed to retrieve titles",
+                    "status_code": titles_resp.status_code,
+                }
+            titles_json = titles_resp.json()["titles"]
+            self.cache[self.TITLES_KEY] = titles_json
+
+            changed = [
+                title_json
+                for title_json in titles_json
+                if title_changed(
+                    title_json, self.cache.get(f"title-processed/{title_json['number']}")
+                )
+            ]
+            logger.info(f"Refreshing {len(changed)} of {len(titles_json)} titles")
+            # previous counts stay in place, and are served, until a title's recount succeeds
+            counts = await asyncio.gather(
+                *[
+                    self.get_title_words(title_json["number"], recount=True)
+                    for title_json in changed
+                ]
+            )
+
+            self.update_title_counts(
+                [count for count in counts if "error" not in count], titles_json
+            )
+            for count in counts:
+                if "error" not in count:
+                    # the version list of an amended title gained the new versions
+                    self.cache.pop(str(count["title"]), None)
+            self.responses.invalidate(self.TITLES_KEY)
+            await self.collect_documents()
+
+            return {
+                "refreshed_at": nowIso8601(),
+                "updated": [count["title"] for count in counts if "error" not in count],
+                "failed": [count["title"] for count in counts if "error" in count],
+                "unchanged": len(titles_json) - len(changed),
+            }
+
+    def update_title_counts(self, counts: list[dict], titles_json: list | None = None):
+        """
+        Merge recounted titles into the aggregate title counts, kept in titles.json order.
+        Titles that are not listed there are left out.
+        """
+        title_counts_key = "title-counts"
+        if titles_json is None:
+            titles_json = self.cache.get(self.TITLES_KEY, [])
+        by_title = {
+            str(count["title"]): count for count in self.cache.get(title_counts_key, [])
+        }
+        by_title.update({str(count["title"]): count for count in counts})
+        self.cache[title_counts_key] = [
+            {**by_title[str(title_json["number"])], "title": title_json["number"]}
+            for title_json in titles_json
+            if str(title_json["number"]) in by_title
+        ]
+        self.responses.invalidate(title_counts_key)
+
+    def document_path(self, document_key) -> str | None:
+        """Path of a downloaded document, None if it is not stored"""
+        digest = self.cache.get(document_key)
+        if digest in self.blobs:
+            return self.blobs.path(digest)
+        return None
+
+    def release_document(self, title, date):
+        """
+        Drop the key of a document downloaded for a date other than the title's latest
+        snapshot, once what was computed from it is stored, so collect_documents() removes it.
+        A later request for the same date downloads it again.
+        """
+        marker = self.cache.get(f"title-processed/{title}")
+        if marker is None or marker["date"] != date:
+            self.cache.pop(f"document/{title}/{date}", None)
+
+    async def collect_documents(self, grace: float = COLLECT_GRACE) -> int:
+        """Remove downloaded documents no `document/` key refers to, returning bytes freed"""
+        referenced = {digest for _key, digest in items_with_prefix(self.cache, "document/")}
+        return await asyncio.to_thread(self.blobs.collect, referenced, grace)
+
+    async def get_document(self, document_key, url, refresh: bool = False) -> int:
+        """
+        Download a full title XML document to the blob store, unless already stored or
+        refresh is given, and record its digest under document_key. A failed refresh leaves
+        the stored document in place. Concurrent calls for the same URL share a single
+        download. Returns the response status. Intended to be used with asyncio.gather
+        """
+        stored = self.document_path(document_key) is not None
+        record_cache(document_key, stored and not refresh)
+        if stored and not refresh:
+            logger.debug(f"Cache hit for {document_key}")
+            return 200
+        status_code, digest = await self.blobs.download(self.fetcher, url, timeout=30.00)
+        if status_code != 200:
+            logger.error(f"Failed to retrieve {url}: {status_code}")
+            return status_code
+        self.cache[document_key] = digest
+        return status_code
 
     async def get_title_word_count_by_sections(self, title):
         """
-        Retrieve the word count for a title in the eCFR API, section by section.
-        Caches both the HTTP XML response and the parsed word count from the XML for each section.
+        Retrieve the word count of every version of every section of a title.
+        Each distinct (title, date) document is downloaded, stored and indexed once and every
+        version of a section on that date points at it, so a version's count is a dictionary
+        lookup into its document's section counts. The title total sums the latest version of
+        each section.
         """
         versions = await self.get_title_sections(title)
-        title_word_count = 0
         section_tuples = self.check_version_cache(title, versions)
 
-        section_responses = await asyncio.gather(
-            *[self.get_section(sec_tup) for sec_tup in section_tuples]
-        )
+        documents = {}
+        for _version_key, document_key, url, _retrieve in section_tuples:
+            if document_key not in documents:
+                documents[document_key] = url
+        missing = {
+            key: url
+            for key, url in documents.items()
+            if self.document_path(key) is None
+        }
         logger.info(
-            f"Title {title} retrieving counts for {len(section_responses)} sections"
+            f"Title {title} retrieving {len(missing)} documents for {len(section_tuples)} sections"
         )
-        for response in section_responses:
-            key, response = response
-            if response is None:
-                continue
-            content_xml = response.text
-            self.cache[key] = content_xml
-
-        for key, _url, _retrieve in section_tuples:
-            content_xml = self.cache[key]
-            word_count_key = f"word-counts/{key}"
-            if word_count_key in self.cache:
-                logger.info(f"Cache hit for {word_count_key}")
-                section_count = self.cache[word_count_key]
-            else:
-                logger.info(f"Cache miss for {word_count_key}")
-                section_count = word_count(content_xml)
-                self.cache[word_count_key] = section_count
-            title_word_count += section_count
-            logger.info(f"Title {title} has {section_count} words in total")
-
-        return title_word_count
+        await asyncio.gather(
+            *[self.get_document(key, url) for key, url in missing.items()]
+        )
+
+        sections = []
+        section_counts = {}
+        latest = {}
+        for version_key, document_key, _url, retrieve in section_tuples:
+            if document_key not in section_counts:
+                if self.document_path(document_key) is None:
+                    continue  # download failed
+                section_counts[document_key] = SectionCounts(
+                    await self.get_document_section_counts(document_key)
+                )
+            if retrieve:
+                self.cache[f"section-document/{version_key}"] = document_key
+            _title, part, subpart, identifier, date = version_key.split("/", 4)
+            count = section_counts[document_key].get(part, subpart, identifier)
+            sections.append(
+                {
+                    "part": part,
+                    "subpart": subpart,
+                    "identifier": identifier,
+                    "date": date,
+                    "word_count": count,
+                }
+            )
+            section_id = (part, subpart, identifier)
+            if section_id not in latest or latest[section_id]["date"] <= date:
+                latest[section_id] = sections[-1]
+
+        title_word_count = sum(section["word_count"] for section in latest.values())
+        logger.info(f"Title {title} has {title_word_count} words in its current sections")
+        return {"title": title, "word_count": title_word_count, "sections": sections}
+
+    async def get_document_section_counts(self, document_key):
+        """
+        Per section word counts of a stored document, indexed in one pass and cached by the
+        document's digest so identical documents are only indexed once
+        """
+        counts_key = f"section-counts/{self.cache[document_key]}"
+        record_cache(counts_key, counts_key in self.cache)
+        if counts_key in self.cache:
+            logger.debug(f"Cache hit for {counts_key}")
+            return self.cache[counts_key]
+        logger.debug(f"Cache miss for {counts_key}")
+        started = time.perf_counter()
+        counts = await self.engine.section_word_counts_file(
+            self.document_path(document_key)
+        )
+        title = document_key.split("/")[1]
+        PARSE_SECONDS.observe(time.perf_counter() - started, title, "sections")
+        self.cache[counts_key] = counts
+        return counts
 
     async def get_counts(self):
         titles = self.cache[self.TITLES_KEY]
@@ -260,11 +549,106 @@ class TitleService:
         return {"title_count": len(title_names), "titles": title_names}
 
 
-def word_count(xml_str: str) -> int:
-    doc = etree.fromstring(xml_str.encode())
-    text = " ".join(
-        t.strip() for elem in doc.iter() for t in (elem.text, elem.tail) if t
+def document_url(document_key: str) -> str:
+    """URL of the full title XML stored under a `document/{title}/{date}` key"""
+    _prefix, title, date = document_key.split("/", 2)
+    return f"{urls.VRSN_URL}/full/{date}/title-{title}.xml"
+
+
+def title_count_key(title, date=None) -> str:
+    """Cache key of a title's word count, as of date or as of its latest snapshot"""
+    if date is None:
+        return f"title-word-counts/{title}"
+    return f"title-word-counts/{title}/{date}"
+
+
+def title_count(title, word_count: int, date=None) -> dict:
+    count = {"title": title, "word_count": word_count}
+    if date is not None:
+        count["date"] = date
+    return count
+
+
+def hierarchy_key(title, path=()) -> str:
+    return "/".join(["hierarchy", str(title), *path])
+
+
+def hierarchy_entries(title, tree: dict) -> dict[str, dict]:
+    """
+    The store entries of a hierarchy tree, root first. Each node with children gets an entry
+    listing them with their totals and how many children they have in turn.
+    """
+    entries = {}
+    pending = [((), tree)]
+    while pending:
+        path, node = pending.pop()
+        entries[hierarchy_key(title, path)] = {
+            "type": node["type"],
+            "number": node["number"],
+            "word_count": node["word_count"],
+            "children": [
+                {
+                    "segment": child["segment"],
+                    "type": child["type"],
+                    "number": child["number"],
+                    "word_count": child["word_count"],
+                    "children": len(child["children"]),
+                }
+                for child in node["children"]
+            ],
+        }
+        pending.extend(
+            ((*path, child["segment"]), child) for child in node["children"] if child["children"]
+        )
+    return entries
+
+
+def title_date(title_json: dict | None) -> str:
+    """Date of the latest available snapshot of a title"""
+    if title_json and title_json.get("up_to_date_as_of"):
+        return title_json["up_to_date_as_of"]
+    return TITLE_DATE
+
+
+def processed_marker(title_json: dict | None, date: str) -> dict:
+    """Records which amendment of a title a count was computed from"""
+    title_json = title_json or {}
+    return {
+        "date": date,
+        "latest_amended_on": title_json.get("latest_amended_on"),
+        "latest_issue_date": title_json.get("latest_issue_date"),
+    }
+
+
+def title_changed(title_json: dict, marker: dict | None) -> bool:
+    """
+    True when a title was amended since its count was computed. up_to_date_as_of advances
+    daily for every title so only the amendment and issue dates are compared.
+    """
+    if marker is None:
+        return True
+    return any(
+        marker.get(field) != title_json.get(field)
+        for field in ("latest_amended_on", "latest_issue_date")
     )
-    return len(re.findall(r"\w+", text))
 
-sample_title_counts = '[{"title": "1", "word_count": 69393}, {"title": "2", "word_count": 348252}, {"title": "3", "word_count": 4302}, {"title": "4", "word_count": 61581}, {"title": "5", "word_count": 1680516}, {"title": "6", "word_count": 265273}, {"title": "7", "word_count": 5881285}, {"title": "8", "word_count": 847269}, {"title": "9", "word_count": 1078540}, {"title": "10", "word_count": 2840892}, {"title": "11", "word_count": 250982}, {"title": "12", "word_count": 5894224}, {"title": "13", "word_count": 571469}, {"title": "14", "word_count": 2258606}, {"title": "15", "word_count": 1683376}, {"title": "16", "word_count": 977322}, {"title": "17", "word_count": 2537694}, {"title": "18", "word_count": 966321}, {"title": "19", "word_count": 1531979}, {"title": "20", "word_count": 2168518}, {"title": "21", "word_count": 2895151}, {"title": "22", "word_count": 975954}, {"title": "23", "word_count": 478352}, {"title": "24", "word_count": 1853440}, {"title": "25", "word_count": 855655}, {"title": "26", "word_count": 12643620}, {"title": "27", "word_count": 1073965}, {"title": "28", "word_count": 1424714}, {"title": "29", "word_count": 4115346}, {"title": "30", "word_count": 1437827}, {"title": "31", "word_count": 1445677}, {"title": "32", "word_count": 1895172}, {"title": "33", "word_count": 1597596}, {"title": "34", "word_count": 1300934}, {"title": "35", "word_count": 0, "error": "Title 35 not found or rate limited", "status_code": 404}, {"title": "36", "word_count": 1124535}, {"title": "37", "word_count": 672878}, {"title": "38", "word_count": 1341491}, {"title": "39", "word_count": 330609}, {"title": "40", "word_count": 17827071}, {"title": "41", "word_count": 766621}, {"title": "42", "word_count": 3282461}, {"title": "43", "word_count": 1196652}, {"title": "44", "word_count": 344404}, {"title": "45", "word_count": 2205816}, {"title": "46", "word_count": 2048160}, {"title": "47", "word_count": 2480965}, {"title": "48", "word_count": 2799489}, {"title": "49", "word_count": 4288192}, {"title": "50", "word_count": 3940123}]'
\ No newline at end of file
+
+class SectionCounts:
+    """Per section word counts of one document, looked up by full key or by identifier"""
+
+    def __init__(self, counts: dict[str, int]):
+        self.counts = counts
+        self.by_identifier = {
+            key.split("/", 2)[2]: count for key, count in counts.items()
+        }
+
+    def get(self, part, subpart, identifier) -> int:
+        """
+        Falls back to matching on the identifier alone since the versioner and the document
+        can disagree on the subpart. Sections missing from the document, such as removed
+        ones, count zero.
+        """
+        count = self.counts.get(f"{part}/{subpart}/{identifier}")
+        if count is None:
+            count = self.by_identifier.get(identifier, 0)
+        return count
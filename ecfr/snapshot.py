@@ -0,0 +1,291 @@
+"""
+Exports the computed counts and analytics of a cache to a compact columnar snapshot file and
+restores them into an empty store, so a fresh container or replica serves full results at
+boot without downloading or parsing any XML.
+
+    python -m ecfr.snapshot export --cache ecfr_cache --output ecfr_snapshot.bin
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+from collections.abc import MutableMapping
+
+from ecfr.services import hierarchy_key
+from ecfr.store import items_with_prefix, open_cache, set_many
+from ecfr.timestamps import nowIso8601
+
+logger = logging.getLogger("ecfr")
+
+MAGIC = b"ECFRSNAP"
+VERSION = 1
+HEADER = struct.Struct("<8sI")  # magic, header length
+# Sections start at multiples of 8 bytes so every column can be cast in place
+ALIGNMENT = 8
+
+# Counts kept as rows, string columns holding indexes into the string dictionary. A title
+# count has kind "count"; a hierarchy node has its type, the path of its parent and its
+# segment, both empty for the title itself, and its number of children.
+STRING_COLUMNS = ("title", "parent", "segment", "number", "date", "kind")
+COUNT_COLUMNS = (("word_count", "q"), ("children", "i"))
+
+# Values without a tabular shape, kept as compressed JSON alongside the columns
+DOCUMENT_KEYS = ("titles", "title-counts", "agencies", "agency-counts")
+DOCUMENT_PREFIXES = (
+    "title-processed/",
+    "part-counts/",
+    "title-analytics/",
+    "part-analytics/",
+    "history/",
+)
+
+
+class StringDictionary:
+    """Assigns each distinct string an index, in first seen order"""
+
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+
+    def id(self, value: str | None) -> int:
+        value = "" if value is None else value
+        if value not in self.ids:
+            self.ids[value] = len(self.ids)
+        return self.ids[value]
+
+    def encode(self) -> tuple[array, bytes]:
+        """
+        The strings as UTF-8, each followed by a NUL, which XML text cannot contain, and the
+        offset of each string in the data with the end offset last
+        """
+        offsets = array("q", [0])
+        data = bytearray()
+        for value in self.ids:
+            data += value.encode()
+            data += b"\0"
+            offsets.append(len(data))
+        return offsets, bytes(data)
+
+
+def export_snapshot(cache: MutableMapping, path: str) -> dict:
+    """Write the counts and analytics of cache to a snapshot file and return its header"""
+    strings = StringDictionary()
+    columns = {name: array("i") for name in STRING_COLUMNS}
+    columns.update({name: array(typecode) for name, typecode in COUNT_COLUMNS})
+
+    def row(title, parent, segment, number, date, kind, word_count, children=0):
+        values = (title, parent, segment, number, date, kind)
+        for name, value in zip(STRING_COLUMNS, values):
+            columns[name].append(strings.id(value))
+        columns["word_count"].append(word_count)
+        columns["children"].append(children)
+
+    for key, word_count in items_with_prefix(cache, "title-word-counts/"):
+        _prefix, title, *date = key.split("/", 2)
+        row(title, None, None, None, date[0] if date else None, "count", word_count)
+    # entries come in key order, so a node's row always precedes the rows of its children
+    for key, entry in items_with_prefix(cache, "hierarchy/"):
+        _prefix, title, *node_path = key.split("/", 2)
+        node_path = node_path[0] if node_path else None
+        if node_path is None:
+            row(title, None, None, entry["number"], None, entry["type"], entry["word_count"])
+        for child in entry["children"]:
+            row(
+                title,
+                node_path,
+                child["segment"],
+                child["number"],
+                None,
+                child["type"],
+                child["word_count"],
+                child["children"],
+            )
+
+    documents = {key: cache[key] for key in DOCUMENT_KEYS if key in cache}
+    for prefix in DOCUMENT_PREFIXES:
+        documents.update(items_with_prefix(cache, prefix))
+
+    offsets, data = strings.encode()
+    sections = [
+        *columns.items(),
+        ("string_offsets", offsets),
+        ("string_data", data),
+        ("documents", zlib.compress(json.dumps(documents).encode())),
+    ]
+    header = {
+        "version": VERSION,
+        "created_at": nowIso8601(),
+        "byteorder": sys.byteorder,
+        "rows": len(columns["word_count"]),
+        "strings": len(strings.ids),
+        "sections": {},
+    }
+    # section offsets are relative to the first section, which follows the header
+    offset = 0
+    for name, section in sections:
+        size = len(section) * section.itemsize if isinstance(section, array) else len(section)
+        typecode = section.typecode if isinstance(section, array) else "B"
+        header["sections"][name] = [offset, size, typecode]
+        offset = _align(offset + size)
+    encoded = json.dumps(header).encode()
+    start = _align(HEADER.size + len(encoded))
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(encoded)))
+        f.write(encoded)
+        for name, section in sections:
+            f.seek(start + header["sections"][name][0])
+            f.write(section.tobytes() if isinstance(section, array) else section)
+    logger.info(f"Exported {header['rows']} counts and {len(documents)} documents to {path}")
+    return header
+
+
+class Snapshot:
+    """
+    A snapshot file mapped into memory. Columns are read in place through memoryviews over
+    the mapping and strings are decoded from the dictionary only when asked for.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.map.close()
+            raise ValueError(f"{path} is not an eCFR snapshot")
+        self.header = json.loads(bytes(self.map[HEADER.size : HEADER.size + header_length]))
+        if self.header["version"] != VERSION:
+            self.map.close()
+            raise ValueError(f"Unsupported snapshot version {self.header['version']}")
+        self.start = _align(HEADER.size + header_length)
+        self.views: list[memoryview] = []
+        self.offsets = self.column("string_offsets")
+        self.data = self.section("string_data")
+
+    def section(self, name: str) -> memoryview:
+        offset, size, _typecode = self.header["sections"][name]
+        view = memoryview(self.map)[self.start + offset : self.start + offset + size]
+        self.views.append(view)
+        return view
+
+    def column(self, name: str):
+        _offset, _size, typecode = self.header["sections"][name]
+        view = self.section(name)
+        if self.header["byteorder"] == sys.byteorder:
+            column = view.cast(typecode)
+            self.views.append(column)
+            return column
+        swapped = array(typecode)
+        swapped.frombytes(view)
+        swapped.byteswap()
+        return swapped
+
+    def string(self, index: int) -> str:
+        return str(self.data[self.offsets[index] : self.offsets[index + 1] - 1], "utf-8")
+
+    def strings(self) -> list[str | None]:
+        """Every string of the dictionary decoded at once, None for the empty string"""
+        strings = str(self.data, "utf-8").split("\0")[: self.header["strings"]]
+        return [string or None for string in strings]
+
+    def rows(self):
+        """
+        (title, parent, segment, number, date, kind, word_count, children) of every row, with
+        strings as indexes into strings()
+        """
+        names = [*STRING_COLUMNS, *(name for name, _typecode in COUNT_COLUMNS)]
+        return zip(*(self.column(name) for name in names))
+
+    def documents(self) -> dict:
+        return json.loads(zlib.decompress(self.section("documents")))
+
+    def close(self):
+        self.offsets = self.data = None
+        for view in reversed(self.views):
+            view.release()
+        self.views = []
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def restore_snapshot(snapshot: Snapshot, cache: MutableMapping) -> int:
+    """Write the counts, hierarchies and documents of a snapshot to cache in one batch"""
+    items = dict(snapshot.documents())
+    strings = snapshot.strings()
+    count_kind = strings.index("count") if "count" in strings else -1
+    entries: dict[tuple[int, int], list] = {}  # (title, parent) -> children of the entry
+    interior: dict[tuple[int, str | None], dict] = {}  # (title, path) -> node with children
+    for title, parent, segment, number, date, kind, word_count, children in snapshot.rows():
+        if kind == count_kind:
+            key = f"title-word-counts/{strings[title]}"
+            items[key if strings[date] is None else f"{key}/{strings[date]}"] = word_count
+            continue
+        node = {"type": strings[kind], "number": strings[number], "word_count": word_count}
+        if strings[segment] is None:
+            interior[(title, None)] = node  # the title itself
+            continue
+        siblings = entries.get((title, parent))
+        if siblings is None:
+            # the first child of an entry, whose own row came before
+            path = strings[parent]
+            siblings = entries[(title, parent)] = []
+            items[hierarchy_key(strings[title], path.split("/") if path else ())] = {
+                **interior.pop((title, path)),
+                "children": siblings,
+            }
+        siblings.append({"segment": strings[segment], **node, "children": children})
+        if children:
+            parent_path = strings[parent]
+            path = f"{parent_path}/{strings[segment]}" if parent_path else strings[segment]
+            interior[(title, path)] = node
+    for (title, path), node in interior.items():
+        if path is None:  # a title with no children, which no row above completed
+            items[hierarchy_key(strings[title])] = {**node, "children": []}
+
+    set_many(cache, items.items())
+    logger.info(f"Restored {len(items)} entries from snapshot {snapshot.path}")
+    return len(items)
+
+
+def load_snapshot(path: str, cache: MutableMapping) -> int:
+    """Restore a snapshot file into cache, returning the number of entries written"""
+    with Snapshot(path) as snapshot:
+        return restore_snapshot(snapshot, cache)
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write a snapshot of a cache")
+    export.add_argument("--cache", default="ecfr_cache", help="cache name, as in main.py")
+    export.add_argument("--backend", default="sqlite", help="sqlite or shelve")
+    export.add_argument("--output", default="ecfr_snapshot.bin")
+    load = commands.add_parser("load", help="restore a snapshot into a cache")
+    load.add_argument("snapshot")
+    load.add_argument("--cache", default="ecfr_cache")
+    load.add_argument("--backend", default="sqlite")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    with open_cache(args.cache, args.backend) as cache:
+        if args.command == "export":
+            export_snapshot(cache, args.output)
+        else:
+            load_snapshot(args.snapshot, cache)
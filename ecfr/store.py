@@ -0,0 +1,412 @@
+import dbm
+import logging
+import pickle
+import shelve
+import sqlite3
+import zlib
+from collections import OrderedDict
+from collections.abc import Iterator, MutableMapping
+
+logger = logging.getLogger("ecfr")
+
+# Strings at least this long (raw XML documents) are compressed into the blobs table
+BLOB_THRESHOLD = 4096
+
+# Keys per query in get_many, well under SQLite's bound parameter limit
+GET_MANY_BATCH = 400
+
+# Sorts after every character that can appear in a key, used as the upper bound of prefix scans
+PREFIX_END = "\U0010ffff"
+
+
+class SqliteStore(MutableMapping):
+    """
+    SqliteStore is a drop in replacement for the shelve cache backed by SQLite in WAL mode.
+
+    Large text values such as full title XML are zlib compressed into a `blobs` table while
+    small derived values such as titles, version lists and word counts are pickled into a
+    separate `vals` table, so membership checks and count lookups never touch the documents.
+    Keys are indexed, which supports range queries by prefix such as `word-counts/40/`.
+    """
+
+    def __init__(self, path: str, blob_threshold: int = BLOB_THRESHOLD):
+        self.path = path
+        self.blob_threshold = blob_threshold
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA busy_timeout=30000")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS vals (key TEXT PRIMARY KEY, data BLOB NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL)"
+        )
+
+    def __getitem__(self, key: str):
+        row = self.db.execute(
+            "SELECT data, 0 FROM vals WHERE key = ? "
+            "UNION ALL SELECT data, 1 FROM blobs WHERE key = ?",
+            (key, key),
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self._decode(*row)
+
+    def __setitem__(self, key: str, value):
+        with self.db:
+            self._write(key, value)
+
+    def set_many(self, items) -> dict[str, int]:
+        """
+        Write every (key, value) pair in a single transaction, returning the stored size of
+        each value: its pickled length, or its uncompressed length for documents
+        """
+        with self.db:
+            return {key: self._write(key, value) for key, value in items}
+
+    def _write(self, key: str, value) -> int:
+        if isinstance(value, str) and len(value) >= self.blob_threshold:
+            data = value.encode()
+            self.db.execute("DELETE FROM vals WHERE key = ?", (key,))
+            self.db.execute(
+                "INSERT OR REPLACE INTO blobs (key, data, size) VALUES (?, ?, ?)",
+                (key, zlib.compress(data), len(data)),
+            )
+        else:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            self.db.execute("DELETE FROM blobs WHERE key = ?", (key,))
+            self.db.execute("INSERT OR REPLACE INTO vals (key, data) VALUES (?, ?)", (key, data))
+        return len(data)
+
+    def __delitem__(self, key: str):
+        with self.db:
+            deleted = self.db.execute("DELETE FROM vals WHERE key = ?", (key,)).rowcount
+            deleted += self.db.execute(
+                "DELETE FROM blobs WHERE key = ?", (key,)
+            ).rowcount
+        if not deleted:
+            raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        row = self.db.execute(
+            "SELECT 1 FROM vals WHERE key = ? UNION ALL SELECT 1 FROM blobs WHERE key = ?",
+            (key, key),
+        ).fetchone()
+        return row is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return self.keys_with_prefix("")
+
+    def __len__(self) -> int:
+        (count,) = self.db.execute(
+            "SELECT (SELECT COUNT(*) FROM vals) + (SELECT COUNT(*) FROM blobs)"
+        ).fetchone()
+        return count
+
+    def keys_with_prefix(self, prefix: str) -> Iterator[str]:
+        """Keys starting with prefix in sorted order, for example every count of one title"""
+        rows = self.db.execute(
+            "SELECT key FROM vals WHERE key >= ? AND key < ? "
+            "UNION ALL SELECT key FROM blobs WHERE key >= ? AND key < ? ORDER BY key",
+            (prefix, prefix + PREFIX_END) * 2,
+        ).fetchall()
+        return (key for (key,) in rows)
+
+    def items_with_prefix(self, prefix: str) -> Iterator[tuple[str, object]]:
+        """Key value pairs for keys starting with prefix in sorted order"""
+        rows = self.db.execute(
+            "SELECT key, data, 0 FROM vals WHERE key >= ? AND key < ? "
+            "UNION ALL SELECT key, data, 1 FROM blobs WHERE key >= ? AND key < ? "
+            "ORDER BY key",
+            (prefix, prefix + PREFIX_END) * 2,
+        ).fetchall()
+        return ((key, self._decode(data, is_blob)) for key, data, is_blob in rows)
+
+    def get_many(self, keys) -> dict:
+        """The stored values of every present key, read in one query per batch of keys"""
+        return {key: value for key, (value, _size) in self.get_many_sized(keys).items()}
+
+    def get_many_sized(self, keys) -> dict[str, tuple[object, int]]:
+        """
+        (value, stored size) of every present key, sized as by set_many without encoding
+        the value again
+        """
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), GET_MANY_BATCH):
+            batch = keys[start : start + GET_MANY_BATCH]
+            marks = ",".join("?" * len(batch))
+            rows = self.db.execute(
+                f"SELECT key, data, 0, length(data) FROM vals WHERE key IN ({marks}) "
+                f"UNION ALL SELECT key, data, 1, size FROM blobs WHERE key IN ({marks})",
+                batch * 2,
+            ).fetchall()
+            found.update(
+                (key, (self._decode(data, is_blob), size)) for key, data, is_blob, size in rows
+            )
+        return found
+
+    def is_empty(self) -> bool:
+        row = self.db.execute(
+            "SELECT 1 FROM vals UNION ALL SELECT 1 FROM blobs LIMIT 1"
+        ).fetchone()
+        return row is None
+
+    def blob_bytes(self) -> int:
+        """Uncompressed size of all stored documents"""
+        (size,) = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return size
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def _decode(data: bytes, is_blob: int):
+        if is_blob:
+            return zlib.decompress(data).decode()
+        return pickle.loads(data)
+
+
+class MemoryTier(MutableMapping):
+    """
+    MemoryTier keeps recently used small values in process memory in front of a persistent
+    cache, so repeated reads and membership checks of titles, counts and version lists never
+    unpickle from disk. Writes go through to the backend first.
+
+    Values are sized by their pickled length, as reported by a SQLite backend when it reads
+    or writes them, and kept in least recently used order within a byte budget. Large
+    strings such as raw XML and values over an eighth of the budget are never admitted, and
+    keys found too large are remembered so they are not sized again until rewritten.
+
+    Titles, title counts and version lists are pinned in their own segment of up to half the
+    budget, which any one of them may fill: they are evicted only by each other or once
+    nothing else is left to evict. Values are shared with callers, which must write back
+    any value they change, as they already must for the persistent backends.
+
+    Only one process may use a tier over a store, as writes by other processes are not seen.
+    """
+
+    PINNED = ("titles", "title-counts", "title-word-counts")
+
+    def __init__(self, backend: MutableMapping, max_bytes: int):
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_bytes // 8
+        self.max_pinned_bytes = max_bytes // 2
+        self.entries: OrderedDict[str, tuple[object, int]] = OrderedDict()
+        self.pinned: OrderedDict[str, tuple[object, int]] = OrderedDict()
+        self.too_large: set[str] = set()  # keys whose stored values were not admitted
+        self.bytes = self.pinned_bytes = 0
+        self.hits = self.misses = self.evictions = self.rejected = 0
+
+    def __getattr__(self, name):
+        # prefix scans, blob sizes and the like are answered by the backend
+        if name == "backend":
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    def __getitem__(self, key: str):
+        entry = self._lookup(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        if key in self.too_large:
+            return self.backend[key]
+        if not hasattr(self.backend, "get_many_sized"):
+            value = self.backend[key]
+            self._admit(key, value)
+            return value
+        found = self.backend.get_many_sized([key])
+        if key not in found:
+            raise KeyError(key)
+        value, size = found[key]
+        self._admit(key, value, size)
+        return value
+
+    def __setitem__(self, key: str, value):
+        self.set_many([(key, value)])
+
+    def __delitem__(self, key: str):
+        self._discard(key)
+        self.too_large.discard(key)
+        del self.backend[key]
+
+    def __contains__(self, key) -> bool:
+        if self._lookup(key) is not None:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return key in self.backend
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.backend)
+
+    def __len__(self) -> int:
+        return len(self.backend)
+
+    def get_many(self, keys) -> dict:
+        keys = list(keys)
+        found = {}
+        for key in keys:
+            entry = self._lookup(key)
+            if entry is not None:
+                found[key] = entry[0]
+        self.hits += len(found)
+        missing = [key for key in keys if key not in found]
+        self.misses += len(missing)
+        if hasattr(self.backend, "get_many_sized"):
+            for key, (value, size) in self.backend.get_many_sized(missing).items():
+                if key not in self.too_large:
+                    self._admit(key, value, size)
+                found[key] = value
+            return found
+        for key, value in get_many(self.backend, missing).items():
+            if key not in self.too_large:
+                self._admit(key, value)
+            found[key] = value
+        return found
+
+    def set_many(self, items):
+        items = list(items)
+        sizes = set_many(self.backend, items) or {}
+        for key, value in items:
+            self.too_large.discard(key)
+            self._admit(key, value, sizes.get(key))
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "rejected": self.rejected,
+            "entries": len(self.entries) + len(self.pinned),
+            "bytes": self.bytes,
+            "pinned_bytes": self.pinned_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def close(self):
+        self.entries.clear()
+        self.pinned.clear()
+        self.too_large.clear()
+        self.bytes = self.pinned_bytes = 0
+        self.backend.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _lookup(self, key) -> tuple[object, int] | None:
+        for segment in (self.pinned, self.entries):
+            entry = segment.get(key)
+            if entry is not None:
+                segment.move_to_end(key)
+                return entry
+        return None
+
+    def _discard(self, key):
+        entry = self.pinned.pop(key, None)
+        if entry is not None:
+            self.pinned_bytes -= entry[1]
+        else:
+            entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def _admit(self, key: str, value, size: int | None = None):
+        """Keep value in memory when it fits, size being its stored size when known"""
+        self._discard(key)
+        if isinstance(value, (str, bytes)) and len(value) >= BLOB_THRESHOLD:
+            self._reject(key)
+            return
+        if size is None:
+            size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        name = str(key)
+        pinned = name.split("/", 1)[0] in self.PINNED or name.isdigit()  # digits: version lists
+        if size > (self.max_pinned_bytes if pinned else self.max_item_bytes):
+            self._reject(key)
+            return
+        (self.pinned if pinned else self.entries)[key] = (value, size)
+        self.bytes += size
+        if pinned:
+            self.pinned_bytes += size
+            while self.pinned_bytes > self.max_pinned_bytes:
+                self._evict(self.pinned)
+        while self.bytes > self.max_bytes:
+            self._evict(self.entries or self.pinned)
+
+    def _reject(self, key: str):
+        self.too_large.add(key)
+        self.rejected += 1
+
+    def _evict(self, segment: OrderedDict):
+        _key, (_value, size) = segment.popitem(last=False)
+        self.bytes -= size
+        if segment is self.pinned:
+            self.pinned_bytes -= size
+        self.evictions += 1
+
+
+def get_many(cache: MutableMapping, keys) -> dict:
+    """Bulk read from any cache backend, a single query where the backend supports it"""
+    if hasattr(cache, "get_many"):
+        return cache.get_many(keys)
+    return {key: cache[key] for key in keys if key in cache}
+
+
+def set_many(cache: MutableMapping, items) -> dict[str, int] | None:
+    """
+    Bulk write to any cache backend, a single transaction where the backend supports it.
+    Returns the stored size of each value when the backend reports them.
+    """
+    if hasattr(cache, "set_many"):
+        return cache.set_many(items)
+    cache.update(items)
+    return None
+
+
+def items_with_prefix(cache: MutableMapping, prefix: str):
+    """Key value pairs of any cache backend for keys starting with prefix"""
+    if hasattr(cache, "items_with_prefix"):
+        return cache.items_with_prefix(prefix)
+    return ((key, cache[key]) for key in sorted(cache.keys()) if key.startswith(prefix))
+
+
+def migrate_shelve(shelf_path: str, store: MutableMapping) -> int:
+    """Copy every entry of an existing shelve cache into store, returning the number copied"""
+    copied = 0
+    with shelve.open(shelf_path, flag="r") as shelf:
+        for key in shelf.keys():
+            store[key] = shelf[key]
+            copied += 1
+    return copied
+
+
+def open_cache(name: str, backend: str = "sqlite") -> MutableMapping:
+    """
+    Open the application cache. The sqlite backend lives at `{name}.sqlite3` and, when
+    created empty next to a shelve cache of the same name, imports that shelve file once.
+    """
+    if backend == "shelve":
+        return shelve.open(name)
+    if backend != "sqlite":
+        raise ValueError(f"Unknown cache backend {backend}")
+
+    store = SqliteStore(f"{name}.sqlite3")
+    # whichdb only looks for files, checked first so opening never scans the store
+    if dbm.whichdb(name) and store.is_empty():
+        logger.info(f"Migrating shelve cache {name} to {store.path}")
+        copied = migrate_shelve(name, store)
+        logger.info(f"Migrated {copied} entries from shelve cache {name}")
+    return store
@@ -0,0 +1,9 @@
+import contextvars
+
+# Background asyncio tasks that must be cancelled and awaited on shutdown
+active_tasks = set()
+
+# Bytes downloaded by the current job, a one item list shared with the tasks it starts
+fetched_bytes: contextvars.ContextVar[list[int] | None] = contextvars.ContextVar(
+    "fetched_bytes", default=None
+)
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+import httpx
+
+logger = logging.getLogger("ecfr")
+
+# Seconds a stored response is served without asking upstream, by URL class. After that it is
+# revalidated with a conditional request.
+DEFAULT_POLICIES = [
+    (re.compile(r"/titles\.json$"), 60 * 60),
+    (re.compile(r"/agencies\.json$"), 24 * 60 * 60),
+    (re.compile(r"/versions/"), 6 * 60 * 60),
+]
+
+# URLs passed straight through. Full XML is kept by the BlobStore, so a copy here would only
+# store every document twice.
+DEFAULT_BYPASS = [re.compile(r"/full/")]
+
+CHUNK_SIZE = 64 * 1024
+
+# Headers describing the original connection rather than the stored body
+HOP_BY_HOP = {"connection", "keep-alive", "transfer-encoding"}
+
+
+class CachingTransport(httpx.AsyncBaseTransport):
+    """
+    CachingTransport wraps another transport with an on-disk HTTP cache for GET requests.
+
+    Each 200 response body is written to disk as it streams to the caller, together with its
+    ETag and Last-Modified validators. While a stored response is within the TTL of its URL
+    class it is served from disk without a request. Once it has expired it is revalidated
+    with If-None-Match / If-Modified-Since and a 304 is answered from the local copy. URLs
+    matching a bypass pattern are never stored.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        transport: httpx.AsyncBaseTransport | None = None,
+        policies: list[tuple[re.Pattern, int]] | None = None,
+        bypass: list[re.Pattern] | None = None,
+    ):
+        self.directory = directory
+        self.transport = transport or httpx.AsyncHTTPTransport()
+        self.policies = DEFAULT_POLICIES if policies is None else policies
+        self.bypass = DEFAULT_BYPASS if bypass is None else bypass
+        os.makedirs(directory, exist_ok=True)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        if request.method != "GET" or any(pattern.search(url) for pattern in self.bypass):
+            return await self.transport.handle_async_request(request)
+
+        path = os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest())
+        meta = self._load_meta(path)
+        if meta is not None and time.time() - meta["stored_at"] < self.ttl(url):
+            logger.debug(f"HTTP cache hit for {url}")
+            return self._stored_response(path, meta, request)
+
+        if meta is not None:
+            if meta.get("etag"):
+                request.headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                request.headers["If-Modified-Since"] = meta["last_modified"]
+
+        response = await self.transport.handle_async_request(request)
+        if response.status_code == 304 and meta is not None:
+            await response.aclose()
+            logger.debug(f"HTTP cache revalidated {url}")
+            meta["stored_at"] = time.time()
+            self._write_meta(path, meta)
+            return self._stored_response(path, meta, request)
+        if response.status_code != 200:
+            return response
+
+        meta = {
+            "url": url,
+            "headers": [
+                (name, value)
+                for name, value in response.headers.multi_items()
+                if name.lower() not in HOP_BY_HOP
+            ],
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        return httpx.Response(
+            200,
+            headers=meta["headers"],
+            stream=_TeeStream(response, path, meta, self),
+            request=request,
+            extensions=response.extensions,
+        )
+
+    def ttl(self, url: str) -> int:
+        for pattern, seconds in self.policies:
+            if pattern.search(url):
+                return seconds
+        return 0
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    @staticmethod
+    def _load_meta(path: str) -> dict | None:
+        try:
+            with open(f"{path}.json") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if os.path.exists(f"{path}.body") else None
+
+    @staticmethod
+    def _write_meta(path: str, meta: dict):
+        tmp_path = f"{path}.json.{os.getpid()}.{id(meta)}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, f"{path}.json")
+
+    @staticmethod
+    def _stored_response(path: str, meta: dict, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200,
+            headers=meta["headers"],
+            stream=_FileStream(f"{path}.body"),
+            request=request,
+            extensions={"from_cache": True},
+        )
+
+
+class _FileStream(httpx.AsyncByteStream):
+    """A stored response body read from disk in chunks"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def __aiter__(self):
+        with open(self.path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                yield chunk
+
+
+class _TeeStream(httpx.AsyncByteStream):
+    """
+    Passes an upstream body through to the caller while writing it to disk. The stored copy
+    only replaces the previous one once the whole body has been received.
+    """
+
+    def __init__(
+        self, response: httpx.Response, path: str, meta: dict, cache: CachingTransport
+    ):
+        self.response = response
+        self.path = path
+        self.meta = meta
+        self.cache = cache
+
+    async def __aiter__(self):
+        tmp_path = f"{self.path}.body.{os.getpid()}.{id(self)}.tmp"
+        complete = False
+        try:
+            with open(tmp_path, "wb") as f:
+                async for chunk in self.response.stream:
+                    f.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, f"{self.path}.body")
+            self.meta["stored_at"] = time.time()
+            self.cache._write_meta(self.path, self.meta)
+            complete = True
+        finally:
+            if not complete and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    async def aclose(self):
+        await self.response.aclose()
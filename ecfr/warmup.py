@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import time
+
+from ecfr.agencies import AgencyService
+from ecfr.history import HistoryService
+from ecfr.search import SearchService
+from ecfr.services import TitleService
+from ecfr.tasks import active_tasks
+from ecfr.timestamps import nowIso8601
+
+logger = logging.getLogger("ecfr")
+
+# Progress of the warm up, published for worker processes that are not running it
+PROGRESS_KEY = "warmup-progress"
+
+# Seconds between publications of the progress within a stage
+PUBLISH_INTERVAL = 1.0
+
+# Set by a worker process that is not the leader to have the leader run a refresh
+REFRESH_REQUEST_KEY = "refresh-requested"
+
+
+class CacheWarmer:
+    """
+    CacheWarmer populates the cache in the background when the server starts: the titles
+    and agencies lists, the word count of every title, the agency aggregates built on those
+    counts, then
+    the version list of every title and, when search is enabled, the search index of every
+    title. It tracks progress so readiness can be reported while it runs. The counts stage
+    goes through TitleService.get_title_counts_cached so requests arriving during warm up
+    wait on the same computation instead of starting another. Progress is published to the
+    store at every stage, and at most every PUBLISH_INTERVAL seconds within one, so other
+    worker processes can report readiness too.
+    """
+
+    def __init__(
+        self,
+        title_service: TitleService,
+        agency_service: AgencyService,
+        search_service: SearchService | None = None,
+    ):
+        self.title_service = title_service
+        self.agency_service = agency_service
+        self.search_service = search_service
+        self.stage = "pending"
+        self.total = 0
+        self.completed = 0
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.task: asyncio.Task | None = None
+        self.published_at = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self.progress()["ready"]
+
+    @property
+    def cache(self):
+        return self.title_service.cache
+
+    def start(self) -> asyncio.Task:
+        """Start warming up in the background unless it is already running"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+            active_tasks.add(self.task)
+            self.task.add_done_callback(active_tasks.discard)
+        return self.task
+
+    async def run(self):
+        self.started_at = nowIso8601()
+        self.error = None
+        try:
+            self.enter("titles")
+            titles = await self.title_service.get_titles()
+            if not isinstance(titles, list):
+                raise RuntimeError(f"Failed to retrieve titles: {titles}")
+            if self.agency_service.get_agencies() is None:
+                # served by /word-count at once, the aggregates wait for the counts
+                await self.agency_service.load_agencies()
+            # one step each for the titles list and agencies, one per title for each of
+            # counts, versions and search
+            stages = 3 if self.search_service is not None else 2
+            self.total = 2 + stages * len(titles)
+            self.completed = 1
+
+            self.enter("counts")
+            await self.title_service.get_title_counts_cached(progress=self.advance)
+            self.completed = 1 + len(titles)
+
+            self.enter("agencies")
+            if self.agency_service.get_agency_counts() is None:
+                await self.agency_service.refresh_agencies()
+            self.completed = 2 + len(titles)
+
+            self.enter("versions")
+            await self.title_service.populate_title_sections(progress=self.advance)
+            self.completed = 2 + 2 * len(titles)
+
+            if self.search_service is not None:
+                self.enter("search")
+                await self.search_service.update_index(progress=self.advance)
+            self.completed = self.total
+
+            self.finished_at = nowIso8601()
+            self.enter("ready")
+            logger.info("Cache warm up complete")
+        except asyncio.CancelledError:
+            logger.info("Cache warm up cancelled")
+            raise
+        except Exception as e:
+            self.error = str(e)
+            self.enter("failed")
+            logger.error("Cache warm up failed: %s", e, exc_info=True)
+
+    def enter(self, stage: str):
+        self.stage = stage
+        self.publish()
+
+    def advance(self, *_):
+        self.completed = min(self.completed + 1, max(self.total - 1, 0))
+        if time.monotonic() - self.published_at >= PUBLISH_INTERVAL:
+            self.publish()
+
+    def publish(self):
+        """
+        Publish the progress of this process for the others, replacing any left by a
+        previous leader
+        """
+        self.published_at = time.monotonic()
+        self.cache[PROGRESS_KEY] = self.local_progress()
+
+    def progress(self) -> dict:
+        """
+        Progress of the warm up in this process or, when another worker process runs it,
+        as that process last published it
+        """
+        if self.task is None:
+            published = self.cache.get(PROGRESS_KEY)
+            if published is not None:
+                return published
+        return self.local_progress()
+
+    def local_progress(self) -> dict:
+        percent = 100.0 * self.completed / self.total if self.total else 0.0
+        return {
+            "ready": self.stage == "ready",
+            "stage": self.stage,
+            "percent": 100.0 if self.stage == "ready" else round(percent, 1),
+            "completed": self.completed,
+            "total": self.total,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+async def refresh_all(
+    title_service: TitleService,
+    agency_service: AgencyService,
+    search_service: SearchService | None = None,
+    history_service: HistoryService | None = None,
+) -> dict:
+    """
+    Recount the titles amended since they were last counted, then the agencies, search
+    index entries and history series depending on them. Returns a report of what changed.
+    """
+    report = await title_service.refresh_title_counts()
+    if "error" not in report:
+        report["agencies"] = await agency_service.refresh_agencies()
+        if search_service is not None:
+            report["search"] = await search_service.update_index()
+        if history_service is not None:
+            report["history"] = await history_service.extend_histories(report["updated"])
+    return report
@@ -1,10 +1,11 @@
 import asyncio
 import logging
 import logging.config
+import multiprocessing
 import os
-import shelve
 import signal
 import ssl
+import sys
 from typing import Any
 
 import falcon
@@ -13,8 +14,22 @@ import httpx
 import uvloop
 from hypercorn import Config
 from hypercorn.asyncio import serve
+from hypercorn.asyncio.run import worker_serve
+from hypercorn.config import Sockets
+from hypercorn.utils import wrap_app
 
-from ecfr import endpoints
+from ecfr import endpoints, metrics
+from ecfr.blobs import BlobStore
+from ecfr.engine import CountEngine
+from ecfr.fetch import Fetcher
+from ecfr.jobs import JobManager
+from ecfr.leader import LeaderElection
+from ecfr.responses import ResponseCache
+from ecfr.snapshot import load_snapshot
+from ecfr.store import MemoryTier, open_cache
+from ecfr.transport import CachingTransport
+from ecfr.tasks import active_tasks
+from ecfr.warmup import PROGRESS_KEY, REFRESH_REQUEST_KEY, refresh_all
 
 logging.config.fileConfig("logging.conf")
 logger = logging.getLogger("ecfr")
@@ -24,13 +39,16 @@ shutdown_event = asyncio.Event()
 
 CACHE = "ecfr_cache"
 
-active_tasks = set()
 
 def _shutdown_signal_handler(
-    client: httpx.AsyncClient, loop: asyncio.AbstractEventLoop, *_: Any
+    client: httpx.AsyncClient,
+    engine: CountEngine,
+    loop: asyncio.AbstractEventLoop,
+    *_: Any,
 ) -> None:
     logger.info("SIGTERM received, shutting down gracefully")
     shutdown_event.set()
+    engine.shutdown()
     for task in active_tasks:
         task.cancel()
     logger.info(f"Cancelled {len(active_tasks)} tasks")
@@ -68,16 +86,22 @@ def cors_middleware():
     )
 
 
+def metrics_middleware():
+    return metrics.MetricsMiddleware()
+
+
 def ecfr_app():
     return falcon.asgi.App(
-        middleware=[cors_middleware()],
+        middleware=[metrics_middleware(), cors_middleware()],
     )
 
 
-def configure_loop(loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient):
+def configure_loop(
+    loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient, engine: CountEngine
+):
     loop.set_debug(False)  # Disable asyncio debug logs
     for sig in [signal.SIGTERM, signal.SIGINT]:
-        loop.add_signal_handler(sig, _shutdown_signal_handler, client, loop)
+        loop.add_signal_handler(sig, _shutdown_signal_handler, client, engine, loop)
     loop.set_exception_handler(_exception_handler)
     return loop
 
@@ -96,41 +120,201 @@ def configure_hypercorn(port: int):
     return config
 
 
-async def start():
+def restore_cold_cache(cache):
+    """
+    Fill an empty store from the snapshot file, when there is one, so a fresh container
+    serves every count at once instead of downloading and counting every title
+    """
+    snapshot = os.environ.get("EFCR_SNAPSHOT", "ecfr_snapshot.bin")
+    if snapshot and os.path.exists(snapshot) and "title-counts" not in cache:
+        logger.info(f"Restoring counts from snapshot {snapshot}")
+        load_snapshot(snapshot, cache)
+
+
+async def lead(
+    warmer: endpoints.CacheWarmer,
+    jobs: JobManager,
+    history_service: endpoints.HistoryService,
+    warm_cache: bool,
+    interval: float,
+):
+    """
+    Background work of the elected worker: the jobs every worker accepts, those interrupted
+    by a restart first, the warm up, then refreshes other workers queue
+    """
+    cache = warmer.cache
+    # followers report this leader's progress from now on, not the previous one's
+    warmer.publish()
+    jobs.start(poll_interval=interval)
+    if warm_cache:
+        await warmer.start()
+    while True:
+        if cache.pop(REFRESH_REQUEST_KEY, None) is not None:
+            logger.info("Running queued refresh")
+            try:
+                report = await refresh_all(
+                    warmer.title_service,
+                    warmer.agency_service,
+                    warmer.search_service,
+                    history_service,
+                )
+                if "error" in report:
+                    logger.error(f"Queued refresh failed: {report}")
+            except Exception as e:
+                logger.error("Queued refresh failed: %s", e, exc_info=True)
+        await asyncio.sleep(interval)
+
+
+async def start(sockets: Sockets | None = None):
+    """
+    Serve the API. With sockets this process is one of several workers sharing the
+    listening sockets and the store, and only the elected worker runs background jobs.
+    """
     port = os.environ.get("EFCR_PORT", 3001)
+    # Processes used for XML parsing and word counting, defaults to one per core
+    count_workers = int(os.environ.get("EFCR_COUNT_WORKERS") or 0) or None
+    # Concurrent requests to the eCFR API
+    fetch_concurrency = int(os.environ.get("EFCR_FETCH_CONCURRENCY") or 4)
+    # sqlite, or shelve for the original single file cache
+    cache_backend = os.environ.get("EFCR_CACHE_BACKEND", "sqlite")
+    # Populate titles, counts and versions in the background at startup
+    warm_cache = os.environ.get("EFCR_WARM_CACHE", "true") == "true"
+    # On-disk HTTP cache for eCFR API responses, empty to disable
+    http_cache = os.environ.get("EFCR_HTTP_CACHE", "http_cache")
+    # Directory of downloaded XML documents
+    documents = os.environ.get("EFCR_DOCUMENTS", "documents")
+    # SQLite full text search index of every title, empty to disable
+    search_index = os.environ.get("EFCR_SEARCH_INDEX", "search_index.sqlite3")
+    # Lock file electing the worker that runs background jobs in multi-worker mode
+    leader_lock = os.environ.get("EFCR_LEADER_LOCK", "ecfr_leader.lock")
+    # Seconds between checks for stored jobs to run, and in multi-worker mode for leadership
+    # and queued refreshes
+    leader_interval = float(os.environ.get("EFCR_LEADER_INTERVAL") or 5)
+    # Background jobs run at once by the leader, and jobs allowed to wait for them
+    job_workers = int(os.environ.get("EFCR_JOB_WORKERS") or 1)
+    job_queue = int(os.environ.get("EFCR_JOB_QUEUE") or 16)
+    # In-process cache of small values in front of the store, single worker only, 0 to disable
+    memory_cache_mb = float(os.environ.get("EFCR_MEMORY_CACHE_MB") or 64)
 
     # Hypercorn config
     config = configure_hypercorn(port)
     loop = asyncio.get_event_loop()
 
-    limits = httpx.Limits(max_connections=2, max_keepalive_connections=2)
-    client = httpx.AsyncClient(http2=False, limits=limits, timeout=45.00)
+    limits = httpx.Limits(
+        max_connections=fetch_concurrency, max_keepalive_connections=fetch_concurrency
+    )
+    transport = httpx.AsyncHTTPTransport(http2=False, limits=limits)
+    if http_cache:
+        transport = CachingTransport(http_cache, transport)
+    client = httpx.AsyncClient(transport=transport, timeout=45.00)
+    fetcher = Fetcher(client, concurrency=fetch_concurrency)
+    engine = CountEngine(max_workers=count_workers)
 
     # Configure Hypercorn asyncio event loop
-    configure_loop(loop, client)
+    configure_loop(loop, client, engine)
 
     try:
         # Open cache at app level
-        with shelve.open(CACHE) as cache:
+        with open_cache(CACHE, cache_backend) as cache:
             # Use a common async http client for all requests
 
-            title_service = endpoints.TitleService(client, cache)
+            blobs = BlobStore(documents)
+            election = None
+            responses = None
+            if sockets is None:
+                restore_cold_cache(cache)
+                if memory_cache_mb > 0:
+                    # other workers' writes would go unseen, so only a single process has one
+                    cache = MemoryTier(cache, int(memory_cache_mb * 2**20))
+                    metrics.register_memory_tier(cache)
+            else:
+                election = LeaderElection(leader_lock, leader_interval)
+                # entries are invalidated across workers through the store
+                responses = ResponseCache(cache)
+            title_service = endpoints.TitleService(fetcher, cache, engine, blobs, responses)
+            history_service = endpoints.HistoryService(title_service)
+            diff_service = endpoints.DiffService(title_service)
+            agency_service = endpoints.AgencyService(title_service)
+            search_service = None
+            if search_index:
+                search_service = endpoints.SearchService(title_service, search_index)
+            warmer = endpoints.CacheWarmer(title_service, agency_service, search_service)
+            jobs = JobManager(title_service, job_workers, job_queue)
 
             app = ecfr_app()
             app.add_route("/health", endpoints.HealthResource())
-            app.add_route("/word-count", endpoints.WordCountResource())
-            app.add_route("/titles", endpoints.TitlesResource(title_service))
-            app.add_route("/title-counts", endpoints.TitleCountsResource(title_service))
+            app.add_route("/ready", endpoints.ReadyResource(warmer))
+            app.add_route("/metrics", endpoints.MetricsResource())
+            app.add_route("/word-count", endpoints.WordCountResource(agency_service))
+            agency_counts = endpoints.AgencyCountsResource(agency_service)
+            app.add_route("/agency-counts", agency_counts)
+            app.add_route("/agency-counts/{slug}", agency_counts)
+            app.add_route("/titles", endpoints.TitlesResource(title_service, jobs))
+            app.add_route(
+                "/title-counts",
+                endpoints.TitleCountsResource(title_service, jobs, election),
+            )
+            app.add_route(
+                "/title-counts/{title}",
+                endpoints.TitleCountResource(title_service, election),
+            )
+            app.add_route(
+                "/title-counts/{title}/analytics",
+                endpoints.TitleAnalyticsResource(title_service),
+            )
             app.add_route(
-                "/title-counts/{title}", endpoints.TitleCountResource(title_service)
+                "/title-counts/{title}/history",
+                endpoints.TitleHistoryResource(history_service),
             )
+            app.add_route(
+                "/title-diff/{title}", endpoints.TitleDiffResource(diff_service)
+            )
+            hierarchy_counts = endpoints.HierarchyCountsResource(title_service)
+            app.add_route("/counts/{title}", hierarchy_counts)
+            app.add_route("/counts/{title}/{path:path}", hierarchy_counts)
             app.add_route(
                 "/section-counts", endpoints.SectionCountsResource(title_service)
             )
+            app.add_route(
+                "/refresh",
+                endpoints.RefreshResource(
+                    title_service, agency_service, search_service, election, history_service
+                ),
+            )
+            if search_service is not None:
+                app.add_route("/search", endpoints.SearchResource(search_service))
+            jobs_resource = endpoints.JobsResource(jobs)
+            app.add_route("/jobs", jobs_resource)
+            app.add_route("/jobs/{job_id}", jobs_resource)
+
+            if election is not None:
+                lead_task = asyncio.create_task(
+                    election.run(
+                        lambda: lead(warmer, jobs, history_service, warm_cache, leader_interval)
+                    )
+                )
+                active_tasks.add(lead_task)
+                lead_task.add_done_callback(active_tasks.discard)
+            else:
+                # a job left running by a killed predecessor is taken back once its lease
+                # runs out, which may be after this process started
+                jobs.start(poll_interval=leader_interval)
+                if warm_cache:
+                    warmer.start()
 
             # Falcon App
-            logger.info("Starting ECFR server on port %s", port)
-            serve_task = asyncio.create_task(serve(app, config, shutdown_trigger=shutdown_event.wait))
+            if sockets is None:
+                logger.info("Starting ECFR server on port %s", port)
+                server = serve(app, config, shutdown_trigger=shutdown_event.wait)
+            else:
+                logger.info("Starting ECFR worker %s on port %s", os.getpid(), port)
+                server = worker_serve(
+                    wrap_app(app, config.wsgi_max_body_size, None),
+                    config,
+                    sockets=sockets,
+                    shutdown_trigger=shutdown_event.wait,
+                )
+            serve_task = asyncio.create_task(server)
             active_tasks.add(serve_task)
             await serve_task
     except asyncio.CancelledError:
@@ -138,12 +322,59 @@ async def start():
     except RuntimeError:
         logger.error("RuntimeError: %s", RuntimeError)
     finally:
+        engine.shutdown()
         if not client.is_closed:
             await client.aclose()
             logger.info("Client closed")
 
 
+def run_worker(sockets: Sockets):
+    asyncio.run(start(sockets))
+
+
+def run_workers(workers: int) -> int:
+    """
+    Serve with several worker processes accepting connections on the same sockets, each
+    with its own connection to the shared SQLite store. The sockets are bound and the store
+    is created, or migrated from shelve, once here so workers start without doing either.
+    """
+    cache_backend = os.environ.get("EFCR_CACHE_BACKEND", "sqlite")
+    if cache_backend != "sqlite":
+        raise ValueError("EFCR_WORKERS above 1 requires the sqlite cache backend")
+    with open_cache(CACHE, cache_backend) as cache:
+        restore_cold_cache(cache)
+        # left by the previous run, followers would report it until a leader publishes
+        cache.pop(PROGRESS_KEY, None)
+    sockets = configure_hypercorn(os.environ.get("EFCR_PORT", 3001)).create_sockets()
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker, args=(sockets,), name=f"ecfr-worker-{i}")
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Started {workers} ECFR workers")
+
+    def stop(*_: Any):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()  # SIGTERM, handled by each worker as a graceful shutdown
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for process in processes:
+        process.join()
+    for sock in sockets.insecure_sockets + sockets.secure_sockets + sockets.quic_sockets:
+        sock.close()
+    return max((abs(process.exitcode or 0) for process in processes), default=0)
+
+
 if __name__ == "__main__":
+    # Hypercorn worker processes, more than one shares the store and elects a leader
+    workers = int(os.environ.get("EFCR_WORKERS") or 1)
+    if workers > 1:
+        sys.exit(run_workers(workers))
     asyncio.run(
         start(),
     )
@@ -0,0 +1,113 @@
+import asyncio
+
+import falcon.asgi
+import falcon.testing
+import httpx
+import pytest
+
+from ecfr import endpoints
+from ecfr.agencies import AgencyService, resolve_parts
+from ecfr.fetch import Fetcher
+from ecfr.services import TitleService
+from ecfr.warmup import CacheWarmer
+
+PART_COUNTS = {
+    "1": {
+        "1": {"chapter": "I", "subchapter": "A", "word_count": 10},
+        "2": {"chapter": "I", "subchapter": "B", "word_count": 20},
+        "300": {"chapter": "III", "word_count": 300},
+    }
+}
+
+AGENCIES = [
+    {
+        "slug": "parent",
+        "name": "Parent Agency",
+        "short_name": "PA",
+        "cfr_references": [{"title": 1, "chapter": "I"}],
+        "children": [
+            {
+                "slug": "child",
+                "name": "Child Agency",
+                "short_name": "CA",
+                "cfr_references": [
+                    {"title": 1, "chapter": "I", "subchapter": "B"},
+                    {"title": 1, "part": "300"},
+                ],
+            }
+        ],
+    }
+]
+
+
+def test_resolve_parts_matches_reference_levels():
+    assert resolve_parts([{"title": 1, "chapter": "I", "subchapter": "B"}], PART_COUNTS) == [
+        ("1", "2", 20)
+    ]
+    assert len(resolve_parts([{"title": 1}], PART_COUNTS)) == 3
+    assert resolve_parts([{"title": 2}], PART_COUNTS) == []
+
+
+@pytest.mark.asyncio
+async def test_refresh_agencies_aggregates_children_and_skips_unchanged():
+    def handler(request):
+        return httpx.Response(200, json={"agencies": AGENCIES})
+
+    cache = {
+        "part-counts/1": PART_COUNTS["1"],
+        "title-processed/1": {"date": "2025-03-31"},
+    }
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        service = AgencyService(TitleService(Fetcher(client), cache, engine=None, blobs=None))
+        report = await service.refresh_agencies()
+        assert report["updated"] == ["parent", "child"]
+
+        counts = service.get_agency_counts()["agencies"]
+        assert counts["parent"]["word_count"] == 30
+        assert counts["parent"]["word_count_with_children"] == 330
+        assert counts["child"]["word_count"] == 320
+
+        assert (await service.refresh_agencies())["updated"] == []
+        cache["title-processed/1"] = {"date": "2025-04-01"}
+        assert (await service.refresh_agencies())["updated"] == ["parent", "child"]
+
+
+def test_word_count_loads_agencies_before_any_title_is_counted():
+    def handler(request):
+        return httpx.Response(200, json={"agencies": AGENCIES})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    service = AgencyService(TitleService(Fetcher(client), {}, None, None))
+    app = falcon.asgi.App()
+    app.add_route("/word-count", endpoints.WordCountResource(service))
+
+    response = falcon.testing.TestClient(app).simulate_get("/word-count")
+    assert response.status_code == 200
+    assert response.json == {"agency_count": 1, "agencies": ["PA"]}
+    assert service.get_agency_counts() is None
+
+
+@pytest.mark.asyncio
+async def test_warm_up_stores_agencies_with_the_titles():
+    counting = asyncio.Event()
+
+    def handler(request):
+        if request.url.path.endswith("/titles.json"):
+            return httpx.Response(200, json={"titles": [{"number": 1}]})
+        return httpx.Response(200, json={"agencies": AGENCIES})
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        title_service = TitleService(Fetcher(client), {}, None, None)
+
+        async def get_title_counts_cached(progress=None):
+            counting.set()
+            await asyncio.Event().wait()  # still counting
+
+        title_service.get_title_counts_cached = get_title_counts_cached
+        service = AgencyService(title_service)
+        task = CacheWarmer(title_service, service).start()
+        await counting.wait()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    assert service.get_agencies() == AGENCIES
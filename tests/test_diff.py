@@ -0,0 +1,75 @@
+import httpx
+import pytest
+
+from ecfr.blobs import BlobStore
+from ecfr.diff import DiffService, word_changes
+from ecfr.engine import CountEngine
+from ecfr.fetch import Fetcher
+from ecfr.services import TitleService
+
+
+def title_xml(sections: dict[str, str]) -> str:
+    divs = "".join(
+        f'<DIV8 N="{identifier}" TYPE="SECTION"><P>{text}</P></DIV8>'
+        for identifier, text in sections.items()
+    )
+    return f'<DIV1 N="1" TYPE="TITLE"><DIV5 N="1" TYPE="PART">{divs}</DIV5></DIV1>'
+
+
+SNAPSHOTS = {
+    "2020-01-01": title_xml(
+        {"1.1": "one two three", "1.2": "the operator shall file", "1.3": "gone soon"}
+    ),
+    "2021-01-01": title_xml(
+        {"1.1": "one two three", "1.2": "the owner must file today", "1.4": "brand new text"}
+    ),
+}
+
+
+def test_word_changes_counts_replaced_words_as_changed():
+    assert word_changes("a b c d", "a x c d e") == {
+        "words_added": 1,
+        "words_removed": 0,
+        "words_changed": 1,
+    }
+    assert word_changes("a b c", "a") == {"words_added": 0, "words_removed": 2, "words_changed": 0}
+
+
+@pytest.mark.asyncio
+async def test_diff_skips_identical_sections_and_is_stored(tmp_path):
+    downloads = []
+
+    def handler(request):
+        date = request.url.path.split("/")[-2]
+        downloads.append(date)
+        if date not in SNAPSHOTS:
+            return httpx.Response(404)
+        return httpx.Response(200, text=SNAPSHOTS[date])
+
+    engine = CountEngine(max_workers=1)
+    cache = {}
+    try:
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            blobs = BlobStore(str(tmp_path / "documents"))
+            service = DiffService(TitleService(Fetcher(client), cache, engine, blobs))
+            diff = await service.get_diff("1", "2020-01-01", "2021-01-01")
+            assert await service.get_diff("1", "2020-01-01", "2021-01-01") == diff
+            missing = await service.get_diff("1", "2020-01-01", "2019-01-01")
+    finally:
+        engine.shutdown()
+
+    # documents are released once the diff is stored, so a later comparison downloads again
+    assert sorted(downloads) == ["2019-01-01", "2020-01-01", "2020-01-01", "2021-01-01"]
+    assert not [key for key in cache if key.startswith("document/")]
+    assert missing["status_code"] == 404
+    assert [(s["section"], s["status"]) for s in diff["sections"]] == [
+        ("1.2", "modified"),
+        ("1.3", "removed"),
+        ("1.4", "added"),
+    ]
+    assert diff["sections"][0]["words_changed"] == 2
+    assert diff["sections"][0]["words_added"] == 1
+    assert (diff["words_added"], diff["words_removed"], diff["words_changed"]) == (4, 2, 2)
+    assert diff["sections_unchanged"] == 1
+    assert diff["parts"]["1"]["words_added"] == 4
+    assert cache["title-diff/1/2020-01-01/2021-01-01"] == diff
@@ -1,8 +1,254 @@
-import ecfr.services
+import gzip
+import json
+
+import falcon.asgi
+import falcon.testing
+
+import ecfr.counting
 from ecfr import endpoints
+from ecfr.jobs import JobManager
+from ecfr.responses import ResponseCache
+from ecfr.services import TitleService
+from ecfr.warmup import PROGRESS_KEY, REFRESH_REQUEST_KEY
 
 
 def test_word_counter():
     xml_text = "<root><p>Hello <b>world</b> again</p></root>"
-    count = ecfr.services.word_count(xml_text)
+    count = ecfr.counting.word_count(xml_text)
     assert 3 == count
+
+
+def test_word_counter_streams_chunks():
+    xml_text = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        "<DIV1><HEAD>Title 1</HEAD><!-- note -->General <I>provisions</I> apply."
+        "<P>(a) Each <E>agency</E> shall</P>publish</DIV1>"
+    )
+    counter = ecfr.counting.WordCounter()
+    for i in range(len(xml_text)):
+        counter.feed(xml_text[i : i + 1])
+    assert counter.close() == 11
+    assert ecfr.counting.word_count(xml_text) == 11
+    assert ecfr.counting.word_count(xml_text.encode(), chunk_size=7) == 11
+
+
+def test_word_counter_drops_closed_siblings():
+    class Probe(ecfr.counting.WordCounter):
+        def _drop_previous(self, elem):
+            self.last = elem
+            return super()._drop_previous(elem)
+
+    counter = Probe()
+    counter.feed("<DIV1>" + "<P>one two</P> tail <!-- note -->" * 1000)
+    assert len(counter.last.getparent()) <= 2
+    counter.feed("<P>end</P></DIV1>")
+    assert counter.close() == 4001
+
+
+def test_section_indexer_counts_each_section():
+    xml_text = (
+        '<DIV1 N="1" TYPE="TITLE"><HEAD>Title 1</HEAD>'
+        '<DIV5 N="2" TYPE="PART"><HEAD>PART 2</HEAD>'
+        '<DIV6 N="A" TYPE="SUBPART"><DIV8 N="2.1" TYPE="SECTION">'
+        "<HEAD>Scope.</HEAD><P>This <I>part</I> applies</P></DIV8></DIV6>"
+        '<DIV8 N="2.10" TYPE="SECTION"><P>Reserved</P></DIV8>'
+        '<DIV9 N="Appendix A to Part 2" TYPE="APPENDIX"><P>Forms</P></DIV9>'
+        "</DIV5></DIV1>"
+    )
+    assert ecfr.counting.section_word_counts(xml_text, chunk_size=16) == {
+        "2/A/2.1": 4,
+        "2/-/2.10": 1,
+        "2/-/Appendix A to Part 2": 1,
+    }
+
+
+def test_title_indexer_counts_parts_with_chapter():
+    xml_text = (
+        '<DIV1 N="1" TYPE="TITLE"><HEAD>Title 1</HEAD>'
+        '<DIV3 N="I" TYPE="CHAPTER"><HEAD>Chapter I</HEAD>'
+        '<DIV5 N="2" TYPE="PART"><HEAD>PART 2</HEAD>'
+        '<DIV8 N="2.1" TYPE="SECTION"><P>This part applies</P></DIV8></DIV5>'
+        "</DIV3></DIV1>"
+    )
+    index = ecfr.counting.index_title(xml_text)
+    assert index["word_count"] == 9
+    assert index["sections"] == {"2/-/2.1": 3}
+    assert index["parts"] == {"2": {"chapter": "I", "word_count": 5}}
+
+
+def test_title_indexer_analytics_per_title_and_part():
+    xml_text = (
+        '<DIV1 N="1" TYPE="TITLE"><HEAD>Title 1</HEAD>'
+        '<DIV5 N="2" TYPE="PART"><HEAD>PART 2</HEAD>'
+        '<DIV8 N="2.1" TYPE="SECTION"><P>The operator shall file. The operator '
+        "<I>may not</I> delay filing.</P></DIV8></DIV5>"
+        '<DIV5 N="3" TYPE="PART"><P>Each operator must file!</P></DIV5>'
+        "</DIV1>"
+    )
+    index = ecfr.counting.index_title(xml_text, chunk_size=16)
+    part = index["analytics"]["parts"]["2"]
+    assert part["word_count"] == index["parts"]["2"]["word_count"] == 12
+    assert part["sentence_count"] == 2
+    assert part["average_sentence_length"] == 6.0
+    assert part["keywords"] == {"shall": 1, "must": 0, "may not": 1}
+
+    title = index["analytics"]["title"]
+    assert title["word_count"] == index["word_count"] == 18
+    assert title["keywords"] == {"shall": 1, "must": 1, "may not": 1}
+    assert title["top_terms"][:2] == [["operator", 3], ["file", 2]]
+
+
+def test_title_indexer_hierarchy_totals_subtrees_largest_first():
+    xml_text = (
+        '<DIV1 N="1" TYPE="TITLE"><HEAD>Title 1</HEAD>'
+        '<DIV3 N="I" TYPE="CHAPTER">'
+        '<DIV5 N="2" TYPE="PART"><DIV8 N="2.1" TYPE="SECTION"><P>one two</P></DIV8></DIV5>'
+        '<DIV5 N="3" TYPE="PART"><DIV6 N="A" TYPE="SUBPART">'
+        '<DIV8 N="3.1" TYPE="SECTION"><P>one</P></DIV8>'
+        '<DIV8 N="3.2" TYPE="SECTION"><P>one two three</P></DIV8>'
+        "</DIV6></DIV5></DIV3></DIV1>"
+    )
+    tree = ecfr.counting.index_title(xml_text, chunk_size=16)["hierarchy"]
+    assert (tree["type"], tree["number"], tree["word_count"]) == ("title", "1", 8)
+    (chapter,) = tree["children"]
+    assert (chapter["segment"], chapter["word_count"]) == ("chapter-I", 6)
+    assert [(part["segment"], part["word_count"]) for part in chapter["children"]] == [
+        ("part-3", 4),
+        ("part-2", 2),
+    ]
+    (subpart,) = chapter["children"][0]["children"]
+    assert [section["segment"] for section in subpart["children"]] == [
+        "section-3.2",
+        "section-3.1",
+    ]
+
+
+def test_title_indexer_hierarchy_merges_repeated_segments_once():
+    xml_text = (
+        '<DIV1 N="1" TYPE="TITLE"><DIV5 N="1" TYPE="PART">'
+        '<DIV8 N="1.1" TYPE="SECTION"><P>one two</P></DIV8>'
+        '<DIV8 N="1.1" TYPE="SECTION"><P>three</P></DIV8>'
+        '<DIV8 TYPE="SECTION"><P>four five</P></DIV8>'
+        '<DIV8 TYPE="SECTION"><DIV9 TYPE="APPENDIX"><P>six</P></DIV9></DIV8>'
+        "</DIV5>"
+        '<DIV5 N="1" TYPE="PART"><P>seven</P></DIV5></DIV1>'
+    )
+    index = ecfr.counting.index_title(xml_text, chunk_size=16)
+    tree = index["hierarchy"]
+    assert tree["word_count"] == index["word_count"] == 7
+    (part,) = tree["children"]
+    assert part["word_count"] == 7
+    assert [(child["segment"], child["word_count"]) for child in part["children"]] == [
+        ("section-1.1", 3),
+        ("section--", 3),
+    ]
+
+
+class StubTitleService:
+    def __init__(self):
+        self.responses = ResponseCache()
+        self.calls = 0
+
+    async def get_title_counts_cached(self):
+        self.calls += 1
+        return [{"title": 1, "word_count": 3 * self.calls}]
+
+
+def test_title_counts_served_from_response_cache_with_etag():
+    service = StubTitleService()
+    app = falcon.asgi.App()
+    app.add_route("/title-counts", endpoints.TitleCountsResource(service))
+    client = falcon.testing.TestClient(app)
+
+    first = client.simulate_get("/title-counts", headers={"Accept-Encoding": "gzip"})
+    assert first.status_code == 200
+    assert first.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(first.content) == b'[{"title":1,"word_count":3}]'
+
+    assert first.headers["Vary"] == "Accept-Encoding"
+
+    etag = first.headers["ETag"]
+    headers = {"If-None-Match": etag, "Accept-Encoding": "br, gzip;q=0.5"}
+    second = client.simulate_get("/title-counts", headers=headers)
+    assert second.status_code == 304
+    assert service.calls == 1
+
+    # the uncompressed body is a different representation with its own ETag
+    headers = {"If-None-Match": etag, "Accept-Encoding": "gzip;q=0, identity"}
+    identity = client.simulate_get("/title-counts", headers=headers)
+    assert identity.status_code == 200
+    assert "Content-Encoding" not in identity.headers
+    assert identity.headers["ETag"] != etag
+    assert identity.json == [{"title": 1, "word_count": 3}]
+
+    service.responses.invalidate("title-counts")
+    third = client.simulate_get("/title-counts", headers={"If-None-Match": etag})
+    assert third.status_code == 200
+    assert third.json == [{"title": 1, "word_count": 6}]
+    assert service.calls == 2
+
+
+class StreamingTitleService:
+    def __init__(self):
+        self.responses = ResponseCache()
+
+    async def get_titles(self):
+        return [{"number": 1}, {"number": 2}]
+
+    async def stream_title_counts(self, titles, date=None):
+        yield {"title": titles[0], "word_count": 3}
+        raise RuntimeError("parser crashed")
+
+
+def test_title_counts_stream_validates_titles_and_reports_failures():
+    app = falcon.asgi.App()
+    app.add_route("/title-counts", endpoints.TitleCountsResource(StreamingTitleService()))
+    client = falcon.testing.TestClient(app)
+
+    unknown = client.simulate_get("/title-counts", query_string="titles=1,99")
+    assert unknown.status_code == 400
+    assert unknown.json["titles"] == ["99"]
+    many = ",".join(str(title) for title in range(endpoints.MAX_STREAM_TITLES + 1))
+    assert client.simulate_get("/title-counts", query_string=f"titles={many}").status_code == 400
+
+    streamed = client.simulate_get("/title-counts", query_string="titles=2,1,2")
+    assert streamed.status_code == 200
+    lines = [json.loads(line) for line in streamed.text.splitlines()]
+    assert lines == [{"title": "2", "word_count": 3}, {"error": "Failed to count titles"}]
+
+
+class Follower:
+    leader = False
+
+
+def test_followers_serve_stored_counts_and_queue_the_rest_for_the_leader():
+    cache = {
+        "titles": [{"number": 1}, {"number": 2}],
+        "title-word-counts/1": 3,
+        PROGRESS_KEY: {"ready": False, "stage": "counts"},
+    }
+    service = TitleService(None, cache, None, None)
+    jobs = JobManager(service)
+    app = falcon.asgi.App()
+    app.add_route("/title-counts", endpoints.TitleCountsResource(service, jobs, Follower()))
+    app.add_route("/title-counts/{title}", endpoints.TitleCountResource(service, Follower()))
+    client = falcon.testing.TestClient(app)
+
+    missing = client.simulate_get("/title-counts")
+    assert missing.status_code == 503
+    assert missing.json["progress"]["stage"] == "counts"
+    assert REFRESH_REQUEST_KEY in cache
+    assert client.simulate_get("/title-counts/1").json == {"title": "1", "word_count": 3}
+    assert client.simulate_get("/title-counts/2").status_code == 503
+    assert client.simulate_get("/title-counts/9").status_code == 404
+
+    streamed = client.simulate_get("/title-counts", query_string="titles=1,2")
+    (job,) = jobs.pending()
+    assert job["titles"] == ["2"]
+    assert [json.loads(line) for line in streamed.text.splitlines()] == [
+        {"title": "1", "word_count": 3},
+        {"title": "2", "status": "queued", "job": job["id"]},
+    ]
+
+    cache["title-counts"] = [{"title": 1, "word_count": 3}]
+    assert client.simulate_get("/title-counts").json == [{"title": 1, "word_count": 3}]
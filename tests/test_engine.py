@@ -0,0 +1,15 @@
+import pytest
+
+from ecfr.engine import CountEngine
+
+
+@pytest.mark.asyncio
+async def test_engine_counts_in_worker_process():
+    engine = CountEngine(max_workers=1)
+    try:
+        xml_text = "<root><p>Hello <b>world</b> again</p></root>"
+        assert 3 == await engine.word_count(xml_text)
+        assert 3 == await engine.word_count(xml_text.encode())
+    finally:
+        engine.shutdown()
+    assert engine.pool is None
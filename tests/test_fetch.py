@@ -0,0 +1,36 @@
+import httpx
+import pytest
+
+from ecfr.fetch import Fetcher
+
+
+@pytest.mark.asyncio
+async def test_fetcher_retries_rate_limited_requests():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url)
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0"})
+        if len(calls) == 2:
+            return httpx.Response(503)
+        return httpx.Response(200, text="ok")
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        fetcher = Fetcher(client, concurrency=2, backoff=0.01)
+        response = await fetcher.get("https://example.test/titles.json")
+
+    assert response.status_code == 200
+    assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_fetcher_returns_last_response_when_retries_exhausted():
+    def handler(request):
+        return httpx.Response(500)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        fetcher = Fetcher(client, retries=1, backoff=0.01)
+        response = await fetcher.get("https://example.test/titles.json")
+
+    assert response.status_code == 500
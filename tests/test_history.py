@@ -0,0 +1,154 @@
+import falcon.asgi
+import falcon.testing
+import httpx
+import pytest
+
+from ecfr import endpoints
+from ecfr.agencies import AgencyService
+from ecfr.blobs import BlobStore
+from ecfr.engine import CountEngine
+from ecfr.fetch import Fetcher
+from ecfr.history import HistoryService, amendment_dates, part_series
+from ecfr.services import TitleService
+from ecfr.warmup import refresh_all
+
+
+def version(part, identifier, date):
+    return {"title": "1", "part": part, "subpart": None, "identifier": identifier, "date": date}
+
+
+VERSIONS = [
+    version("1", "1.1", "2020-01-01"),
+    version("2", "2.1", "2020-01-01"),
+    version("1", "1.1", "2021-01-01"),
+    version("1", "1.2", "2021-01-01"),
+    version("2", "2.1", "2022-01-01"),
+]
+
+# word count text of each part on each date, part 2 is restored to its original text in 2022
+PARTS = {
+    ("2020-01-01", "1"): "one two",
+    ("2020-01-01", "2"): "three four five",
+    ("2021-01-01", "1"): "one two six",
+    ("2022-01-01", "2"): "three four five",
+}
+
+
+def test_amendment_dates_groups_parts_by_date():
+    assert amendment_dates(VERSIONS) == {
+        "2020-01-01": ["1", "2"],
+        "2021-01-01": ["1"],
+        "2022-01-01": ["2"],
+    }
+    assert amendment_dates(VERSIONS, after="2021-01-01") == {"2022-01-01": ["2"]}
+
+
+@pytest.mark.asyncio
+async def test_history_counts_changed_parts_per_date():
+    requests = []
+
+    def handler(request):
+        if request.url.path.endswith("/versions/title-1.json"):
+            return httpx.Response(200, json={"content_versions": VERSIONS})
+        date = request.url.path.split("/")[-2]
+        requests.append((date, request.url.params["part"]))
+        text = PARTS[(date, request.url.params["part"])]
+        return httpx.Response(200, text=f"<DIV5><P>{text}</P></DIV5>")
+
+    engine = CountEngine(max_workers=1)
+    cache = {}
+    try:
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            service = HistoryService(TitleService(Fetcher(client), cache, engine, blobs=None))
+            history = await service.compute_history("1")
+            assert await service.compute_history("1") == history
+    finally:
+        engine.shutdown()
+
+    assert [(p["date"], p["word_count"]) for p in history["series"]] == [
+        ("2020-01-01", 5),
+        ("2021-01-01", 6),
+        ("2022-01-01", 6),
+    ]
+    assert part_series(history, "1") == [
+        {"date": "2020-01-01", "word_count": 2},
+        {"date": "2021-01-01", "word_count": 3},
+    ]
+    assert sorted(requests) == sorted(PARTS)
+    assert len({key for key in cache if key.startswith("hash-counts/")}) == 3
+    assert service.get_history("1") == history
+
+
+@pytest.mark.asyncio
+async def test_refresh_extends_stored_history_with_new_dates(tmp_path):
+    upstream = {"amended_on": "2022-01-01", "versions": VERSIONS[:-1]}
+    parts = {**PARTS, ("2023-01-01", "1"): "one"}
+
+    def handler(request):
+        path = request.url.path
+        if path.endswith("/titles.json"):
+            title = {
+                "number": 1,
+                "latest_amended_on": upstream["amended_on"],
+                "latest_issue_date": upstream["amended_on"],
+                "up_to_date_as_of": "2025-03-31",
+            }
+            return httpx.Response(200, json={"titles": [title]})
+        if path.endswith("/agencies.json"):
+            return httpx.Response(200, json={"agencies": []})
+        if path.endswith("/versions/title-1.json"):
+            return httpx.Response(200, json={"content_versions": upstream["versions"]})
+        if "part" not in request.url.params:
+            return httpx.Response(200, text="<DIV1><P>one two</P></DIV1>")
+        text = parts[(path.split("/")[-2], request.url.params["part"])]
+        return httpx.Response(200, text=f"<DIV5><P>{text}</P></DIV5>")
+
+    engine = CountEngine(max_workers=1)
+    cache = {}
+    try:
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            title_service = TitleService(
+                Fetcher(client), cache, engine, BlobStore(str(tmp_path / "documents"))
+            )
+            history_service = HistoryService(title_service)
+            agency_service = AgencyService(title_service)
+            await refresh_all(title_service, agency_service, None, history_service)
+            await history_service.compute_history("1")
+
+            upstream["amended_on"] = "2023-01-01"
+            upstream["versions"] = [*VERSIONS, version("1", "1.1", "2023-01-01")]
+            report = await refresh_all(title_service, agency_service, None, history_service)
+    finally:
+        engine.shutdown()
+
+    assert report["history"] == ["1"]
+    assert [(p["date"], p["word_count"]) for p in cache["history/1"]["series"]] == [
+        ("2020-01-01", 5),
+        ("2021-01-01", 6),
+        ("2022-01-01", 6),
+        ("2023-01-01", 4),
+    ]
+    assert cache["1"][-1]["date"] == "2023-01-01"
+
+
+def test_history_of_an_unknown_title_is_not_found():
+    requests = []
+
+    def handler(request):
+        requests.append(request.url.path)
+        if request.url.path.endswith("/titles.json"):
+            return httpx.Response(200, json={"titles": [{"number": 1}]})
+        return httpx.Response(404)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    service = HistoryService(TitleService(Fetcher(client), {}, None, blobs=None))
+    app = falcon.asgi.App()
+    app.add_route("/title-counts/{title}/history", endpoints.TitleHistoryResource(service))
+    test_client = falcon.testing.TestClient(app)
+
+    assert test_client.simulate_get("/title-counts/9/history").status_code == 404
+    assert test_client.simulate_get("/title-counts/9/history").status_code == 404
+    # titles.json lists title 1, but its versions are not found upstream
+    assert test_client.simulate_get("/title-counts/1/history").status_code == 404
+    assert requests.count("/api/versioner/v1/titles.json") == 1
+    assert not service.tasks
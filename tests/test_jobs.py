@@ -0,0 +1,164 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from ecfr.blobs import BlobStore
+from ecfr.engine import CountEngine
+from ecfr.fetch import Fetcher
+from ecfr.jobs import JobManager, cancel_key, job_key, lease_key
+from ecfr.services import TitleService
+
+
+def titles_json():
+    return {
+        "titles": [
+            {
+                "number": number,
+                "latest_amended_on": "2021-01-01",
+                "latest_issue_date": "2021-01-01",
+                "up_to_date_as_of": "2025-03-31",
+            }
+            for number in (1, 2)
+        ]
+    }
+
+
+def handler(request):
+    if request.url.path.endswith("/titles.json"):
+        return httpx.Response(200, json=titles_json())
+    if "/versions/" in request.url.path:
+        return httpx.Response(200, json={"content_versions": []})
+    return httpx.Response(200, text="<DIV1><P>one two three</P></DIV1>")
+
+
+@pytest.fixture
+def blobs(tmp_path):
+    return BlobStore(str(tmp_path / "documents"))
+
+
+@pytest.fixture
+def engine():
+    engine = CountEngine(max_workers=1)
+    yield engine
+    engine.shutdown()
+
+
+async def wait_for(jobs: JobManager, job_id: str) -> dict:
+    for _ in range(500):
+        job = jobs.get(job_id)
+        if job["status"] not in ("queued", "running"):
+            return job
+        await asyncio.sleep(0.01)
+    raise TimeoutError(job_id)
+
+
+@pytest.mark.asyncio
+async def test_counts_job_reports_progress_and_updates_title_counts(engine, blobs):
+    cache = {}
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        service = TitleService(Fetcher(client), cache, engine, blobs)
+        jobs = JobManager(service)
+        jobs.start()
+        submitted = await jobs.submit("counts")
+        assert submitted["status"] == "queued"
+        assert submitted["titles"] == ["1", "2"]
+
+        job = await wait_for(jobs, submitted["id"])
+        for worker in jobs.workers:
+            worker.cancel()
+
+    assert job["status"] == "completed"
+    assert job["percent"] == 100.0
+    assert job["results"] == {"1": {"word_count": 3}, "2": {"word_count": 3}}
+    assert job["bytes_fetched"] > 0
+    assert [job["id"] for job in jobs.list()] == [submitted["id"]]
+    assert cache["title-counts"] == [
+        {"title": 1, "word_count": 3},
+        {"title": 2, "word_count": 3},
+    ]
+
+    with pytest.raises(ValueError):
+        await jobs.submit("recount")
+
+
+@pytest.mark.asyncio
+async def test_queued_jobs_cancel_and_resume(engine, blobs):
+    cache = {}
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        service = TitleService(Fetcher(client), cache, engine, blobs)
+        # a previous process queued two jobs and never ran them
+        previous = JobManager(service, max_queued=2)
+        cancelled = await previous.submit("counts", ["1"])
+        interrupted = await previous.submit("populate", ["2"])
+        with pytest.raises(asyncio.QueueFull):
+            await previous.submit("counts", ["2"])
+        assert previous.cancel(cancelled["id"])["status"] == "cancelled"
+        assert previous.cancel("missing") is None
+
+        jobs = JobManager(service)
+        assert jobs.resume() == [interrupted["id"]]
+        jobs.start()
+        job = await wait_for(jobs, interrupted["id"])
+        for worker in jobs.workers:
+            worker.cancel()
+
+    assert job["status"] == "completed"
+    assert job["results"] == {"2": {"versions": 0}}
+    assert cache[job_key(cancelled["id"])]["status"] == "cancelled"
+    assert cache[job_key(cancelled["id"])]["results"] == {}
+
+
+@pytest.mark.asyncio
+async def test_leader_runs_jobs_submitted_to_followers(engine, blobs):
+    cache = {}
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        service = TitleService(Fetcher(client), cache, engine, blobs)
+        follower = JobManager(service)
+        leader = JobManager(service)
+        submitted = await follower.submit("populate", ["1"])
+        assert follower.queue.empty()
+
+        # a job another live runner holds stays with it until its lease runs out
+        held = await follower.submit("populate", ["2"])
+        cache[job_key(held["id"])] = {**cache[job_key(held["id"])], "status": "running"}
+        cache[lease_key(held["id"])] = time.time() + 60
+        assert leader.resume() == [submitted["id"]]
+        assert leader.resume() == []
+        cache[lease_key(held["id"])] = time.time() - 1
+        assert leader.resume() == [held["id"]]
+
+        # a cancel from another process is seen by the runner, not lost to its writes
+        follower.cancel(held["id"])
+        assert cache[cancel_key(held["id"])] is True
+        leader.start(poll_interval=0.01)
+        job = await wait_for(follower, submitted["id"])
+        cancelled = await wait_for(follower, held["id"])
+        for worker in leader.workers:
+            worker.cancel()
+
+    assert job["status"] == "completed"
+    assert job["runner"] is not None
+    assert lease_key(submitted["id"]) not in cache
+    assert cancelled["status"] == "cancelled"
+    assert cancelled["cancel_requested"] is True
+
+
+@pytest.mark.asyncio
+async def test_polling_takes_back_a_job_once_its_lease_runs_out(engine, blobs):
+    cache = {}
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        service = TitleService(Fetcher(client), cache, engine, blobs)
+        # the process running the job was killed and restarted within its lease
+        killed = await JobManager(service).submit("populate", ["1"])
+        cache[job_key(killed["id"])] = {**cache[job_key(killed["id"])], "status": "running"}
+        cache[lease_key(killed["id"])] = time.time() + 0.05
+
+        jobs = JobManager(service)
+        jobs.start(poll_interval=0.01)
+        job = await wait_for(jobs, killed["id"])
+        for worker in jobs.workers:
+            worker.cancel()
+
+    assert job["status"] == "completed"
@@ -0,0 +1,14 @@
+from ecfr.leader import LeaderElection
+
+
+def test_one_holder_of_the_leader_lock(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    first, second = LeaderElection(path), LeaderElection(path)
+
+    assert first.try_acquire()
+    assert not second.try_acquire()
+    assert first.leader and not second.leader
+
+    first.release()
+    assert second.try_acquire()
+    second.release()
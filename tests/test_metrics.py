@@ -0,0 +1,42 @@
+import falcon
+import falcon.asgi
+import falcon.testing
+
+from ecfr import endpoints, metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("fetch_seconds", "Fetch latency", ("endpoint",), (0.1, 1.0))
+    histogram.observe(0.05, "full")
+    histogram.observe(0.1, "full")
+    histogram.observe(3.0, "full")
+
+    assert histogram.render().splitlines() == [
+        "# HELP fetch_seconds Fetch latency",
+        "# TYPE fetch_seconds histogram",
+        'fetch_seconds_bucket{endpoint="full",le="0.1"} 2',
+        'fetch_seconds_bucket{endpoint="full",le="1"} 2',
+        'fetch_seconds_bucket{endpoint="full",le="+Inf"} 3',
+        'fetch_seconds_sum{endpoint="full"} 3.15',
+        'fetch_seconds_count{endpoint="full"} 3',
+    ]
+
+
+def test_metrics_middleware_times_requests_by_route():
+    registry = metrics.Registry()
+    registry.register(metrics.REQUEST_SECONDS)
+    app = falcon.asgi.App(middleware=[metrics.MetricsMiddleware()])
+    app.add_route("/health", endpoints.HealthResource())
+    app.add_route("/metrics", endpoints.MetricsResource(registry))
+    client = falcon.testing.TestClient(app)
+
+    client.simulate_get("/health")
+    result = client.simulate_get("/metrics")
+
+    assert result.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert 'ecfr_request_seconds_count{method="GET",route="/health",status="200"} 1' in (
+        result.text
+    )
+    assert metrics.endpoint_class("https://x/api/versioner/v1/full/2025-01-01/title-1.xml") == (
+        "full"
+    )
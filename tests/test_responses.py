@@ -0,0 +1,18 @@
+from ecfr.responses import ResponseCache
+
+
+def test_invalidation_reaches_response_caches_sharing_a_store():
+    store = {}
+    leader, follower = ResponseCache(store), ResponseCache(store)
+    generation = follower.generation
+    follower.put("title-counts", [{"title": 1, "word_count": 3}], generation)
+    assert follower.get("title-counts") is not None
+
+    leader.invalidate("title-counts")
+    assert follower.get("title-counts") is None
+
+    # an entry computed before an invalidation elsewhere is served once but not kept
+    generation = follower.generation
+    leader.invalidate("titles")
+    follower.put("title-counts", [], generation)
+    assert follower.get("title-counts") is None
@@ -0,0 +1,87 @@
+import httpx
+import pytest
+
+from ecfr.blobs import BlobStore
+from ecfr.engine import CountEngine
+from ecfr.fetch import Fetcher
+from ecfr.search import SearchService, SectionTextExtractor
+from ecfr.services import TitleService
+
+TITLE_XML = """<DIV1 N="1" TYPE="TITLE"><HEAD>Title 1</HEAD>
+<DIV5 N="1" TYPE="PART"><HEAD>PART 1</HEAD>
+<DIV6 N="A" TYPE="SUBPART">
+<DIV8 N="§ 1.1" TYPE="SECTION"><HEAD>§ 1.1 Scope.</HEAD>
+<P>Each vehicle <I>shall</I> meet the emission limits.</P></DIV8>
+<DIV8 N="1.2" TYPE="SECTION"><HEAD>§ 1.2 Records.</HEAD>
+<P>Operators keep records of each vehicle.</P></DIV8>
+</DIV6></DIV5></DIV1>"""
+
+
+def test_section_text_extractor_keeps_document_order():
+    extractor = SectionTextExtractor()
+    for start in range(0, len(TITLE_XML), 7):
+        extractor.feed(TITLE_XML[start : start + 7])
+    sections = extractor.close()
+
+    assert sections == [
+        (
+            "1",
+            "A",
+            "1.1",
+            "§ 1.1 Scope.",
+            "§ 1.1 Scope. Each vehicle shall meet the emission limits.",
+        ),
+        (
+            "1",
+            "A",
+            "1.2",
+            "§ 1.2 Records.",
+            "§ 1.2 Records. Operators keep records of each vehicle.",
+        ),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_search_index_built_once_per_document(tmp_path):
+    def handler(request):
+        return httpx.Response(
+            200,
+            json={"titles": [{"number": 1, "up_to_date_as_of": "2025-03-31"}]},
+        )
+
+    blobs = BlobStore(str(tmp_path / "documents"))
+    engine = CountEngine(max_workers=1)
+    cache = {}
+    try:
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            title_service = TitleService(Fetcher(client), cache, engine, blobs)
+            search = SearchService(title_service, str(tmp_path / "search.sqlite3"))
+            assert (await search.update_index())["updated"] == []
+
+            digest = "ab" * 32
+            path = blobs.path(digest)
+            (tmp_path / "documents" / "ab").mkdir()
+            with open(path, "w") as f:
+                f.write(TITLE_XML)
+            cache["document/1/2025-03-31"] = digest
+            cache["title-processed/1"] = {"date": "2025-03-31"}
+
+            assert (await search.update_index())["updated"] == ["1"]
+            assert (await search.update_index())["updated"] == []
+    finally:
+        engine.shutdown()
+
+    results = await search.search("vehicles", per_page=1)
+    assert results["total"] == 2
+    assert results["titles"] == {"1": 2}
+    assert len(results["results"]) == 1
+    second_page = await search.search("vehicles", page=2, per_page=1)
+    assert second_page["results"][0]["title"] == "1"
+
+    hit = (await search.search('"emission limits"'))["results"][0]
+    assert (hit["part"], hit["subpart"], hit["section"]) == ("1", "A", "1.1")
+    assert "<mark>emission limits</mark>" in hit["snippet"]
+
+    with pytest.raises(ValueError):
+        await search.search('"unbalanced')
+    search.close()
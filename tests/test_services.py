@@ -0,0 +1,286 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+
+from ecfr import warmup
+from ecfr.agencies import AgencyService
+from ecfr.blobs import BlobStore
+from ecfr.engine import CountEngine
+from ecfr.fetch import Fetcher
+from ecfr.services import TitleService
+from ecfr.warmup import CacheWarmer
+
+
+def version(identifier, date, part="1", subpart="A"):
+    return {
+        "title": "1",
+        "part": part,
+        "subpart": subpart,
+        "identifier": identifier,
+        "date": date,
+        "removed": False,
+    }
+
+
+VERSIONS = [
+    version("1.1", "2020-01-01"),
+    version("1.2", "2020-01-01"),
+    version("1.3", "2020-01-01"),
+    version("1.1", "2021-06-01"),
+]
+
+
+TITLE_XML = """<DIV1 N="1" TYPE="TITLE"><HEAD>Title 1</HEAD>
+<DIV5 N="1" TYPE="PART"><HEAD>PART 1</HEAD>
+<DIV6 N="A" TYPE="SUBPART">
+<DIV8 N="\u00a7 1.1" TYPE="SECTION"><P>one two three</P></DIV8>
+<DIV8 N="1.2" TYPE="SECTION"><P>four <I>five</I></P></DIV8>
+</DIV6></DIV5></DIV1>"""
+
+
+@pytest.fixture
+def blobs(tmp_path):
+    return BlobStore(str(tmp_path / "documents"))
+
+
+@pytest.fixture
+def engine():
+    engine = CountEngine(max_workers=1)
+    yield engine
+    engine.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_section_documents_download_once_per_date(engine, blobs):
+    requests = []
+
+    def handler(request):
+        requests.append(request.url.path)
+        if request.url.path.endswith("/versions/title-1.json"):
+            return httpx.Response(200, json={"content_versions": VERSIONS})
+        return httpx.Response(200, text=TITLE_XML)
+
+    cache = {}
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        service = TitleService(Fetcher(client), cache, engine, blobs)
+        counts = await service.get_title_word_count_by_sections("1")
+        assert counts == await service.get_title_word_count_by_sections("1")
+
+    assert [section["word_count"] for section in counts["sections"]] == [3, 2, 0, 3]
+    assert counts["word_count"] == 5
+
+    full_requests = [path for path in requests if "/full/" in path]
+    assert sorted(full_requests) == [
+        "/api/versioner/v1/full/2020-01-01/title-1.xml",
+        "/api/versioner/v1/full/2021-06-01/title-1.xml",
+    ]
+    assert cache["section-document/1/1/A/1.2/2020-01-01"] == "document/1/2020-01-01"
+    # both dates serve the same bytes so they share one stored and indexed document
+    assert cache["document/1/2020-01-01"] == cache["document/1/2021-06-01"]
+    assert len([key for key in cache if key.startswith("section-counts/")]) == 1
+    assert blobs.path(cache["document/1/2020-01-01"]).endswith(".xml")
+
+
+def titles_json(amended_on_2):
+    return {
+        "titles": [
+            {
+                "number": 1,
+                "latest_amended_on": "2020-01-01",
+                "latest_issue_date": "2020-01-01",
+                "up_to_date_as_of": "2025-03-31",
+            },
+            {
+                "number": 2,
+                "latest_amended_on": amended_on_2,
+                "latest_issue_date": amended_on_2,
+                "up_to_date_as_of": "2025-03-31",
+            },
+        ]
+    }
+
+
+@pytest.mark.asyncio
+async def test_refresh_recounts_only_amended_titles(engine, blobs):
+    upstream = {"amended_on_2": "2021-01-01", "status": 200}
+    downloads = []
+
+    def handler(request):
+        if request.url.path.endswith("/titles.json"):
+            return httpx.Response(200, json=titles_json(upstream["amended_on_2"]))
+        downloads.append(request.url.path)
+        if upstream["status"] != 200:
+            return httpx.Response(upstream["status"])
+        return httpx.Response(200, text="<DIV1><P>one two three</P></DIV1>")
+
+    cache = {}
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        # the 503 below is retried without sleeping
+        service = TitleService(Fetcher(client, backoff=0), cache, engine, blobs)
+        report = await service.refresh_title_counts()
+        assert report["updated"] == [1, 2]
+        assert len(downloads) == 2
+
+        report = await service.refresh_title_counts()
+        assert report["updated"] == []
+        assert report["unchanged"] == 2
+
+        upstream["amended_on_2"] = "2025-03-01"
+        report = await service.refresh_title_counts()
+        assert report["updated"] == [2]
+        assert downloads[-1] == "/api/versioner/v1/full/2025-03-31/title-2.xml"
+        assert len(downloads) == 3
+
+        # a failed recount keeps serving the previous count
+        upstream["amended_on_2"], upstream["status"] = "2025-03-15", 503
+        report = await service.refresh_title_counts()
+        assert report["failed"] == [2]
+        assert cache["title-word-counts/2"] == 3
+        assert cache["title-counts"][1] == {"title": 2, "word_count": 3}
+
+    assert [count["title"] for count in cache["title-counts"]] == [1, 2]
+    assert cache["title-analytics/2"]["top_terms"] == [["one", 1], ["three", 1], ["two", 1]]
+
+
+@pytest.mark.asyncio
+async def test_documents_of_previous_and_dated_snapshots_are_collected(engine, blobs):
+    upstream = {"date": "2025-03-01"}
+
+    def handler(request):
+        if request.url.path.endswith("/titles.json"):
+            title = {
+                "number": 1,
+                "latest_amended_on": upstream["date"],
+                "latest_issue_date": upstream["date"],
+                "up_to_date_as_of": upstream["date"],
+            }
+            return httpx.Response(200, json={"titles": [title]})
+        return httpx.Response(200, text=f"<DIV1><P>{request.url.path}</P></DIV1>")
+
+    cache = {}
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        service = TitleService(Fetcher(client), cache, engine, blobs)
+        await service.refresh_title_counts()
+        previous = service.document_path("document/1/2025-03-01")
+        await service.get_title_words("1", "2020-01-01")
+        upstream["date"] = "2025-04-01"
+        await service.refresh_title_counts()
+    latest = service.document_path("document/1/2025-04-01")
+
+    assert [key for key in cache if key.startswith("document/")] == ["document/1/2025-04-01"]
+    assert "title-word-counts/1/2020-01-01" in cache
+    # recent downloads are kept until they are older than the grace period
+    assert await service.collect_documents() == 0
+    assert await service.collect_documents(grace=0) > 0
+    assert os.path.exists(latest) and not os.path.exists(previous)
+    stored = [name for _dir, _dirs, names in os.walk(blobs.directory) for name in names]
+    assert stored == [os.path.basename(latest)]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_title_counts_share_one_computation(engine, blobs):
+    downloads = []
+
+    def handler(request):
+        if request.url.path.endswith("/titles.json"):
+            return httpx.Response(200, json=titles_json("2021-01-01"))
+        if request.url.path.endswith("/agencies.json"):
+            return httpx.Response(200, json={"agencies": []})
+        if "/versions/" in request.url.path:
+            return httpx.Response(200, json={"content_versions": VERSIONS})
+        downloads.append(request.url.path)
+        return httpx.Response(200, text="<DIV1><P>one two three</P></DIV1>")
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        service = TitleService(Fetcher(client), {}, engine, blobs)
+        warmer = CacheWarmer(service, AgencyService(service))
+        task = warmer.start()
+        first, second = await asyncio.gather(
+            service.get_title_counts_cached(), service.get_title_counts_cached()
+        )
+        await task
+
+    assert first == second == [
+        {"title": 1, "word_count": 3},
+        {"title": 2, "word_count": 3},
+    ]
+    assert len(downloads) == 2
+    assert warmer.progress()["ready"] is True
+    assert warmer.progress()["percent"] == 100.0
+
+
+def test_warmup_progress_replaces_the_previous_leaders_and_advances(engine, blobs, monkeypatch):
+    cache = {warmup.PROGRESS_KEY: {"ready": True, "stage": "ready"}}
+    service = TitleService(None, cache, engine, blobs)
+    leader = CacheWarmer(service, AgencyService(service))
+    follower = CacheWarmer(service, AgencyService(service))
+    assert follower.progress()["ready"] is True
+
+    leader.publish()
+    assert follower.progress()["ready"] is False
+
+    leader.total = 10
+    leader.enter("counts")
+    leader.advance()
+    assert follower.progress()["completed"] == 0
+    monkeypatch.setattr(warmup, "PUBLISH_INTERVAL", 0.0)
+    leader.advance()
+    assert follower.progress()["completed"] == 2
+
+
+@pytest.mark.asyncio
+async def test_stream_title_counts_yields_stored_counts_first(engine, blobs):
+    def handler(request):
+        if request.url.path.endswith("/titles.json"):
+            return httpx.Response(200, json=titles_json("2021-01-01"))
+        return httpx.Response(200, text="<DIV1><P>one two three</P></DIV1>")
+
+    cache = {"title-word-counts/2/2024-01-01": 7}
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        service = TitleService(Fetcher(client), cache, engine, blobs)
+        counts = [
+            count async for count in service.stream_title_counts(["1", "2"], "2024-01-01")
+        ]
+
+    assert counts == [
+        {"title": "2", "word_count": 7, "date": "2024-01-01"},
+        {"title": "1", "word_count": 3, "date": "2024-01-01"},
+    ]
+    assert cache["title-word-counts/1/2024-01-01"] == 3
+
+
+@pytest.mark.asyncio
+async def test_hierarchy_counts_read_nodes_and_replace_stale_ones(engine, blobs):
+    upstream = {"amended_on_2": "2021-01-01", "xml": TITLE_XML}
+
+    def handler(request):
+        if request.url.path.endswith("/titles.json"):
+            return httpx.Response(200, json=titles_json(upstream["amended_on_2"]))
+        return httpx.Response(200, text=upstream["xml"])
+
+    cache = {}
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        service = TitleService(Fetcher(client), cache, engine, blobs)
+        root = await service.get_hierarchy_counts("1")
+        assert (root["word_count"], root["children"][0]["segment"]) == (9, "part-1")
+
+        subpart = await service.get_hierarchy_counts("1", ["part-1", "subpart-A"], top=1)
+        assert subpart["word_count"] == 5
+        assert [child["segment"] for child in subpart["children"]] == ["section-1.1"]
+        section = await service.get_hierarchy_counts("1", ["part-1", "subpart-A", "section-1.2"])
+        assert (section["type"], section["word_count"], section["children"]) == (
+            "section",
+            2,
+            [],
+        )
+        assert await service.get_hierarchy_counts("1", ["part-9"]) is None
+
+        upstream["xml"] = '<DIV1 N="1" TYPE="TITLE"><DIV5 N="2" TYPE="PART"><P>a</P></DIV5></DIV1>'
+        upstream["amended_on_2"] = "2025-03-01"
+        await service.refresh_title_counts()
+        assert await service.get_hierarchy_counts("1", ["part-1"]) is not None  # unchanged
+        assert (await service.get_hierarchy_counts("2"))["children"][0]["segment"] == "part-2"
+
+    assert [key for key in cache if key.startswith("hierarchy/2")] == ["hierarchy/2"]
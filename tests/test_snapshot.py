@@ -0,0 +1,86 @@
+import httpx
+import pytest
+
+from ecfr.blobs import BlobStore
+from ecfr.engine import CountEngine
+from ecfr.fetch import Fetcher
+from ecfr.services import TitleService
+from ecfr.snapshot import Snapshot, export_snapshot, load_snapshot
+from ecfr.store import SqliteStore
+
+TITLE_XML = """<DIV1 N="1" TYPE="TITLE"><HEAD>Title 1</HEAD>
+<DIV3 N="I" TYPE="CHAPTER"><DIV5 N="1" TYPE="PART"><HEAD>PART 1</HEAD>
+<DIV8 N="1.1" TYPE="SECTION"><P>The operator shall file.</P></DIV8>
+<DIV8 N="1.2" TYPE="SECTION"><P>one two</P></DIV8>
+</DIV5></DIV3></DIV1>"""
+
+
+def titles_json():
+    return {
+        "titles": [
+            {
+                "number": 1,
+                "latest_amended_on": "2021-01-01",
+                "latest_issue_date": "2021-01-01",
+                "up_to_date_as_of": "2025-03-31",
+            }
+        ]
+    }
+
+
+@pytest.mark.asyncio
+async def test_snapshot_restores_counts_without_downloads(tmp_path):
+    def handler(request):
+        if request.url.path.endswith("/titles.json"):
+            return httpx.Response(200, json=titles_json())
+        return httpx.Response(200, text=TITLE_XML)
+
+    def offline(request):
+        raise AssertionError(f"unexpected request {request.url}")
+
+    engine = CountEngine(max_workers=1)
+    blobs = BlobStore(str(tmp_path / "documents"))
+    source = {}
+    path = str(tmp_path / "snapshot.bin")
+    try:
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            service = TitleService(Fetcher(client), source, engine, blobs)
+            counts = await service.get_title_counts()
+            await service.get_title_words("1", "2020-01-01")
+        header = export_snapshot(source, path)
+
+        with Snapshot(path) as snapshot:
+            strings = snapshot.strings()
+            rows = [tuple(strings[i] for i in row[:6]) + row[6:] for row in snapshot.rows()]
+        assert header["rows"] == len(rows) == 2 + 5
+        assert ("1", "chapter-I", "part-1", "1", None, "part", 8, 2) in rows
+
+        with SqliteStore(str(tmp_path / "restored.sqlite3")) as restored:
+            load_snapshot(path, restored)
+            async with httpx.AsyncClient(transport=httpx.MockTransport(offline)) as client:
+                service = TitleService(Fetcher(client), restored, engine, blobs)
+                assert await service.get_title_counts_cached() == counts
+                assert (await service.get_title_words("1"))["word_count"] == counts[0]["word_count"]
+                assert (await service.get_title_words("1", "2020-01-01"))["word_count"] == 10
+                part = await service.get_hierarchy_counts("1", ["chapter-I", "part-1"])
+                assert [child["segment"] for child in part["children"]] == [
+                    "section-1.1",
+                    "section-1.2",
+                ]
+                analytics = await service.get_title_analytics("1", "1")
+                assert analytics["keywords"]["shall"] == 1
+            for key, value in source.items():
+                if key.startswith(("hierarchy/", "title-", "part-")):
+                    assert restored[key] == value, key
+    finally:
+        engine.shutdown()
+
+
+def test_snapshot_restores_a_title_without_children(tmp_path):
+    path = str(tmp_path / "snapshot.bin")
+    root = {"type": "title", "number": "2", "word_count": 0, "children": []}
+    export_snapshot({"hierarchy/2": root, "title-word-counts/2": 0}, path)
+
+    restored = {}
+    load_snapshot(path, restored)
+    assert restored == {"hierarchy/2": root, "title-word-counts/2": 0}
@@ -0,0 +1,101 @@
+import shelve
+
+from ecfr.store import MemoryTier, SqliteStore, get_many, open_cache
+
+
+def test_sqlite_store_round_trips_values_and_documents(tmp_path):
+    xml_text = "<DIV1>" + "<P>words in a section</P>" * 500 + "</DIV1>"
+    with SqliteStore(str(tmp_path / "cache.sqlite3"), blob_threshold=1024) as store:
+        store["titles"] = [{"number": 1}]
+        store["title-counts/1"] = xml_text
+        store["title-word-counts/1"] = 2000
+
+        assert "title-counts/1" in store
+        assert "missing" not in store
+        assert store["titles"] == [{"number": 1}]
+        assert store["title-counts/1"] == xml_text
+        assert store.blob_bytes() == len(xml_text)
+        assert len(store) == 3
+
+        store["title-counts/1"] = "small"
+        assert store["title-counts/1"] == "small"
+        assert store.blob_bytes() == 0
+        assert len(store) == 3
+
+
+def test_sqlite_store_prefix_queries(tmp_path):
+    with SqliteStore(str(tmp_path / "cache.sqlite3")) as store:
+        for key in ["word-counts/1/a", "word-counts/1/b", "word-counts/10/a", "titles"]:
+            store[key] = key
+        assert list(store.keys_with_prefix("word-counts/1/")) == [
+            "word-counts/1/a",
+            "word-counts/1/b",
+        ]
+        assert dict(store.items_with_prefix("word-counts/10")) == {
+            "word-counts/10/a": "word-counts/10/a"
+        }
+
+
+def test_open_cache_migrates_shelve_once(tmp_path):
+    name = str(tmp_path / "ecfr_cache")
+    with shelve.open(name) as shelf:
+        shelf["titles"] = [{"number": 1}]
+        shelf["title-word-counts/1"] = 42
+
+    with open_cache(name) as store:
+        assert store["title-word-counts/1"] == 42
+        store["title-word-counts/1"] = 43
+
+    with open_cache(name) as store:
+        assert store["title-word-counts/1"] == 43
+        assert len(store) == 2
+
+
+def test_memory_tier_writes_through_and_evicts_unpinned_first(tmp_path):
+    xml_text = "<DIV1>" + "<P>words</P>" * 1000 + "</DIV1>"
+    with SqliteStore(str(tmp_path / "cache.sqlite3")) as store:
+        tier = MemoryTier(store, max_bytes=4096)
+        tier["titles"] = [{"number": 1}]
+        tier["40"] = [{"identifier": "1.1"}]  # version list of title 40
+        tier["document/1/2020-01-01"] = xml_text
+        assert store["document/1/2020-01-01"] == xml_text
+        for i in range(30):
+            tier[f"title-analytics/{i}"] = {"summary": f"{i} " * 100}
+
+        assert "titles" in tier.pinned and "40" in tier.pinned
+        assert "document/1/2020-01-01" not in tier.entries
+        assert "title-analytics/0" not in tier.entries
+        assert tier.bytes <= tier.max_bytes
+        stats = tier.stats()
+        assert stats["evictions"] > 0 and stats["rejected"] == 1
+
+        assert tier["title-analytics/0"] == store["title-analytics/0"]  # read back from disk
+        assert tier["titles"] == [{"number": 1}]
+        assert get_many(tier, ["titles", "missing"]) == {"titles": [{"number": 1}]}
+        assert list(tier.keys_with_prefix("titles")) == ["titles"]
+
+        del tier["titles"]
+        assert "titles" not in tier and "titles" not in store
+        assert tier.stats()["hits"] >= 2 and tier.stats()["misses"] >= 2
+
+
+def test_memory_tier_sizes_from_the_store_and_pins_version_lists(tmp_path, monkeypatch):
+    with SqliteStore(str(tmp_path / "cache.sqlite3")) as store:
+        tier = MemoryTier(store, max_bytes=8192)
+        versions = [{"identifier": f"1.{i}"} for i in range(100)]  # over max_item_bytes
+        analytics = {"summary": "word " * 500}
+        tier["40"] = versions
+        store["title-analytics/1"] = analytics
+
+        # values are sized from the rows read and written, never pickled again
+        def dumps(*args, **kwargs):
+            raise AssertionError("value pickled to size it")
+
+        monkeypatch.setattr("ecfr.store.pickle.dumps", dumps)
+        assert tier["title-analytics/1"] == analytics
+        assert "title-analytics/1" in tier.too_large
+        assert tier["title-analytics/1"] == analytics
+        assert tier.stats()["rejected"] == 1
+
+        assert tier.pinned["40"][0] is versions
+        assert tier.max_item_bytes < tier.pinned_bytes <= tier.max_pinned_bytes
@@ -0,0 +1,56 @@
+import re
+
+import httpx
+import pytest
+
+from ecfr.transport import CachingTransport
+
+
+class StubServer:
+    """Stands in for the eCFR API, answering conditional requests like the real one"""
+
+    def __init__(self):
+        self.requests = []
+        self.body = b"<DIV1><P>one two three</P></DIV1>"
+        self.etag = '"v1"'
+
+    def __call__(self, request):
+        self.requests.append(request)
+        if request.headers.get("If-None-Match") == self.etag:
+            return httpx.Response(304, headers={"ETag": self.etag})
+        return httpx.Response(200, headers={"ETag": self.etag}, content=self.body)
+
+
+@pytest.mark.asyncio
+async def test_caching_transport_revalidates_and_serves_304_from_disk(tmp_path):
+    server = StubServer()
+    transport = CachingTransport(
+        str(tmp_path), httpx.MockTransport(server), policies=[(re.compile("/versions/"), 3600)]
+    )
+    async with httpx.AsyncClient(transport=transport) as client:
+        url = "https://example.test/api/versioner/v1/titles.json"
+        first = await client.get(url)
+        second = await client.get(url)
+        assert first.content == second.content == server.body
+        assert second.extensions.get("from_cache") is True
+        assert server.requests[1].headers["If-None-Match"] == '"v1"'
+
+        server.body, server.etag = b"<DIV1><P>changed</P></DIV1>", '"v2"'
+        third = await client.get(url)
+        assert third.content == server.body
+        assert len(server.requests) == 3
+
+        # version lists are fresh for an hour so they are served without a request
+        versions_url = "https://example.test/api/versioner/v1/versions/title-1.json"
+        await client.get(versions_url)
+        async with client.stream("GET", versions_url) as response:
+            assert await response.aread() == server.body
+        assert len(server.requests) == 4
+
+        # full XML is left to the blob store
+        full_url = "https://example.test/api/versioner/v1/full/2025-03-31/title-1.xml"
+        await client.get(full_url)
+        second_full = await client.get(full_url)
+        assert second_full.extensions.get("from_cache") is None
+        assert "If-None-Match" not in server.requests[-1].headers
+        assert len(server.requests) == 6